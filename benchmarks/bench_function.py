@@ -0,0 +1,107 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+'''Compare native functional profiling against ``shogun functional``
+
+Usage: python benchmarks/bench_function.py [n_strains] [n_kos] [n_samples]
+       [threads]
+
+Writes a SHOGUN database holding only a synthetic functional annotation,
+and a strain-level taxatable. The annotation is compiled as by
+``compile-functions`` and profiled as by ``profile-functions``. When
+``shogun`` is on the PATH, ``shogun functional`` profiles the same table,
+and the KEGG ortholog, module and pathway tables of both must be equal.
+'''
+
+import glob
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import yaml
+
+from bench_load_table import write_taxatable
+from q2_shogun._function import functional_tables, read_shogun_functions
+from q2_shogun._table import read_taxatable
+
+# output suffixes of ``shogun functional`` at strain level
+SUFFIXES = ['.strain.kegg.txt', '.strain.kegg.modules.txt',
+            '.strain.kegg.pathways.txt']
+
+
+def write_annotation(dbdir, n_strains, n_kos, seed=0):
+    rng = np.random.default_rng(seed)
+    os.mkdir(os.path.join(dbdir, 'function'))
+    prefix = os.path.join(dbdir, 'function', 'ko')
+    kos = ['K%05d' % i for i in range(n_kos)]
+    with open(prefix + '-strain2ko.tsv', 'w') as fh:
+        fh.write('\t%s\n' % '\t'.join(kos))
+        for i in range(n_strains):
+            copies = rng.poisson(0.05, n_kos)
+            fh.write('k__Bacteria;t__strain%d\t%s\n' % (
+                i, '\t'.join(map(str, copies))))
+    for name, fmt, n in [('module', 'M%05d', n_kos // 10 or 1),
+                         ('pathway', 'map%05d', n_kos // 50 or 1)]:
+        with open('%s-%s-annotations.txt' % (prefix, name), 'w') as fh:
+            for ko in kos:
+                ids = {fmt % j for j in rng.integers(0, n, 2)}
+                fh.write('%s\t%s\n' % (ko, ';'.join(sorted(ids))))
+    with open(os.path.join(dbdir, 'metadata.yaml'), 'w') as fh:
+        yaml.dump({'general': {'taxonomy': 'taxa.tsv',
+                               'fasta': 'refseqs.fna'},
+                   'function': 'function/ko'}, fh)
+
+
+def _sorted(table):
+    return table.sort_order(sorted(table.ids(axis='observation')),
+                            axis='observation').sort_order(
+                                sorted(table.ids()))
+
+
+def main(n_strains=2000, n_kos=5000, n_samples=200, threads=os.cpu_count()):
+    results = {'n_strains': n_strains, 'n_kos': n_kos,
+               'n_samples': n_samples, 'threads': threads}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        dbdir = os.path.join(tmpdir, 'database')
+        os.mkdir(dbdir)
+        write_annotation(dbdir, n_strains, n_kos)
+        taxatable = os.path.join(tmpdir, 'taxatable.strain.txt')
+        write_taxatable(taxatable, n_strains, n_samples)
+
+        start = time.perf_counter()
+        annotation = read_shogun_functions(dbdir)
+        results['compile_seconds'] = time.perf_counter() - start
+        table = read_taxatable(taxatable)
+        start = time.perf_counter()
+        native = functional_tables(table, annotation, threads)
+        results['native_seconds'] = time.perf_counter() - start
+
+        if shutil.which('shogun'):
+            out = os.path.join(tmpdir, 'functional')
+            start = time.perf_counter()
+            subprocess.run(['shogun', 'functional', '-i', taxatable,
+                            '-d', dbdir, '-o', out, '-l', 'strain'],
+                           check=True)
+            results['shogun_seconds'] = time.perf_counter() - start
+            cli = [read_taxatable(*glob.glob(os.path.join(out, '*' + s)))
+                   for s in SUFFIXES]
+            # native tables leave out observations absent from all samples
+            results['identical'] = all(
+                _sorted(n) == _sorted(c.remove_empty(axis='observation',
+                                                     inplace=False))
+                for n, c in zip(native, cli))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
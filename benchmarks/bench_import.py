@@ -0,0 +1,46 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+'''Time loading the plugin as the QIIME 2 framework does
+
+Usage: python benchmarks/bench_import.py [repeats]
+
+Reports the median ``-X importtime`` cumulative time of the framework
+modules the plugin depends on, of loading ``q2_shogun.plugin_setup`` on
+top of them, and the slowest modules the plugin itself adds.
+'''
+
+import statistics
+import sys
+
+from q2_shogun.tests.test_imports import FRAMEWORK, importtime
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    repeats = int(argv[0]) if argv else 5
+    framework, plugin, added = [], [], {}
+    for _ in range(repeats):
+        times = importtime(*FRAMEWORK)
+        framework.append(sum(times[m] for m in FRAMEWORK if m in times))
+        times = importtime(*FRAMEWORK, 'q2_shogun.plugin_setup')
+        plugin.append(times['q2_shogun.plugin_setup'])
+        for name, us in times.items():
+            if name.startswith('q2_shogun'):
+                added.setdefault(name, []).append(us)
+    print('framework: %.1f ms' % (statistics.median(framework) / 1000))
+    print('q2_shogun.plugin_setup: %.1f ms'
+          % (statistics.median(plugin) / 1000))
+    slowest = sorted(((statistics.median(us), name)
+                      for name, us in added.items()), reverse=True)
+    for us, name in slowest[:10]:
+        print('  %-32s %8.1f ms' % (name, us / 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+'''Compare native LCA assignment against ``shogun assign_taxonomy``
+
+Usage: python benchmarks/bench_lca.py [n_reads] [n_refs] [workers]
+
+The native engine is timed with 1, 2, 4, ... up to ``workers`` processes,
+and its speedup over a single process reported for each, along with the
+highest speedup any number of workers could reach: the main process reads
+and ships every chunk itself, and that share of the work is serial. The
+SHOGUN
+comparison is skipped when ``shogun`` is not on the PATH. Both engines run
+with strict LCA (taxacut of 1.0) and must produce equal tables.
+'''
+
+import json
+import os
+import pickle
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import biom
+import numpy as np
+import pandas as pd
+import yaml
+
+from q2_shogun._lca import (LineageIndex, assign_lca, _CHUNK_READS,
+                            _read_chunks)
+
+
+def write_reference(dbdir, n_refs, seed=0):
+    rng = np.random.default_rng(seed)
+    ranks = 'kpcofgst'
+    lineages = []
+    for i in range(n_refs):
+        # a branching factor of 4 per rank keeps lineages overlapping
+        codes = rng.integers(0, 4, len(ranks)).cumsum()
+        lineages.append(';'.join('%s__%s%d' % (r, r, c)
+                                 for r, c in zip(ranks, codes)))
+    taxonomy = pd.Series(lineages, index=['ref%d' % i for i in range(n_refs)],
+                         name='Taxon')
+    taxonomy.index.name = 'Feature ID'
+    taxonomy.to_csv(os.path.join(dbdir, 'taxa.tsv'), sep='\t')
+    with open(os.path.join(dbdir, 'refseqs.fna'), 'w') as fh:
+        for ref in taxonomy.index:
+            fh.write('>%s\nACGT\n' % ref)
+    with open(os.path.join(dbdir, 'metadata.yaml'), 'w') as fh:
+        yaml.dump({'general': {'taxonomy': 'taxa.tsv',
+                               'fasta': 'refseqs.fna'},
+                   'bowtie2': 'bowtie2/genomes'}, fh)
+    return taxonomy
+
+
+def write_sam(fp, n_reads, n_refs, n_samples=10, max_hits=16, seed=0):
+    rng = np.random.default_rng(seed)
+    with open(fp, 'w') as fh:
+        for i in range(n_reads):
+            qname = 'sample%d_%d' % (rng.integers(n_samples), i)
+            for j, ref in enumerate(rng.integers(0, n_refs,
+                                                 rng.integers(1, max_hits))):
+                fh.write('%s\t%d\tref%d\t1\t255\t50M\t*\t0\t0\t%s\t*\t'
+                         'AS:i:0\tNM:i:0\n' % (qname, 256 if j else 0, ref,
+                                               'A' * 50))
+
+
+def main(n_reads=200000, n_refs=5000, workers=os.cpu_count()):
+    results = {'n_reads': n_reads, 'n_refs': n_refs, 'workers': workers}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        taxonomy = write_reference(tmpdir, n_refs)
+        sam = os.path.join(tmpdir, 'alignment.bowtie2.sam')
+        write_sam(sam, n_reads, n_refs)
+        index = LineageIndex.from_taxonomy(taxonomy)
+
+        tables = {}
+        for n in sorted({workers} | {2 ** i for i in range(workers)
+                                     if 2 ** i < workers}):
+            start = time.perf_counter()
+            with open(sam) as fh:
+                tables[n] = assign_lca(fh, index, taxacut=1.0, workers=n)
+            results['native_%d_seconds' % n] = time.perf_counter() - start
+            results['native_%d_speedup' % n] = (
+                results['native_1_seconds'] / results['native_%d_seconds' % n])
+        start = time.perf_counter()
+        with open(sam) as fh:
+            for chunk in _read_chunks(fh, _CHUNK_READS):
+                pickle.dumps(chunk)
+        results['serial_seconds'] = time.perf_counter() - start
+        results['max_speedup'] = (results['native_1_seconds'] /
+                                  results['serial_seconds'])
+        native = tables[1]
+        assert all(t == native for t in tables.values())
+
+        if shutil.which('shogun'):
+            out = os.path.join(tmpdir, 'taxatable.tsv')
+            start = time.perf_counter()
+            subprocess.run(['shogun', 'assign_taxonomy', '-i', sam,
+                            '-d', tmpdir, '-o', out, '-a', 'bowtie2'],
+                           check=True)
+            results['shogun_seconds'] = time.perf_counter() - start
+            with open(out) as fh:
+                cli = biom.Table.from_tsv(fh, None, None, None)
+            order = sorted(cli.ids(axis='observation'))
+            results['identical'] = (
+                sorted(native.ids(axis='observation')) == order and
+                native.sort_order(order, axis='observation').sort_order(
+                    sorted(native.ids())) ==
+                cli.sort_order(order, axis='observation').sort_order(
+                    sorted(cli.ids())))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
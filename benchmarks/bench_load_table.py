@@ -0,0 +1,63 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+'''Compare SHOGUN taxatable parsing against biom.Table.from_tsv
+
+Usage: python benchmarks/bench_load_table.py [n_features] [n_samples]
+'''
+
+import json
+import os
+import sys
+import tempfile
+import time
+
+import biom
+import numpy as np
+
+from q2_shogun._table import read_taxatable
+
+
+def write_taxatable(fp, n_features, n_samples, density=0.05, seed=0):
+    rng = np.random.default_rng(seed)
+    with open(fp, 'w') as fh:
+        fh.write('#OTU ID\t%s\n' % '\t'.join(
+            'sample%d' % i for i in range(n_samples)))
+        for i in range(n_features):
+            counts = rng.poisson(5, n_samples)
+            counts[rng.random(n_samples) > density] = 0
+            fh.write('k__Bacteria;t__strain%d\t%s\n' % (
+                i, '\t'.join(map(str, counts))))
+
+
+def _time(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def _from_tsv(fp):
+    with open(fp) as fh:
+        return biom.Table.from_tsv(fh, None, None, None)
+
+
+def main(n_features=20000, n_samples=500):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fp = os.path.join(tmpdir, 'taxatable.tsv')
+        write_taxatable(fp, n_features, n_samples)
+        baseline, expected = _time(_from_tsv, fp)
+        vectorized, observed = _time(read_taxatable, fp)
+    assert observed == expected
+    print(json.dumps({'n_features': n_features, 'n_samples': n_samples,
+                      'from_tsv_seconds': baseline,
+                      'read_taxatable_seconds': vectorized,
+                      'speedup': baseline / vectorized}, indent=2))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,103 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+'''Synthetic references and multiplexed shotgun queries for benchmarking
+
+All output is a deterministic function of the arguments and ``seed``.
+Queries are written in chunks, so 10^8 reads need no more memory than
+10^4.
+'''
+
+import os
+
+import numpy as np
+import pandas as pd
+
+
+_BASES = np.frombuffer(b'ACGT', dtype=np.uint8)
+_RANKS = 'kpcofgst'
+_CHUNK_READS = 100000
+
+
+def generate_reference(outdir, n_genomes=50, genome_length=100000,
+                       branching=3, seed=0):
+    '''Write refseqs.fna and taxonomy.tsv, returning their paths
+
+    Lineages are drawn from a tree with ``branching`` children per rank,
+    so that reads regularly hit references that only share higher ranks.
+    '''
+    rng = np.random.default_rng(seed)
+    refseqs = os.path.join(outdir, 'refseqs.fna')
+    ids = ['ref%d' % i for i in range(n_genomes)]
+    with open(refseqs, 'w') as fh:
+        for ref in ids:
+            genome = _BASES[rng.integers(0, 4, genome_length)].tobytes()
+            fh.write('>%s\n' % ref)
+            for i in range(0, genome_length, 80):
+                fh.write('%s\n' % genome[i:i + 80].decode())
+
+    lineages = []
+    for _ in ids:
+        codes = np.cumsum(rng.integers(0, branching, len(_RANKS)))
+        lineages.append(';'.join('%s__%s%d' % (rank, rank, code)
+                                 for rank, code in zip(_RANKS, codes)))
+    taxonomy = pd.Series(lineages, index=pd.Index(ids, name='Feature ID'),
+                         name='Taxon')
+    taxonomy_fp = os.path.join(outdir, 'taxonomy.tsv')
+    taxonomy.to_csv(taxonomy_fp, sep='\t')
+    return refseqs, taxonomy_fp
+
+
+def _read_genomes(refseqs):
+    genomes, seq = [], []
+    with open(refseqs) as fh:
+        for line in fh:
+            if line.startswith('>'):
+                if seq:
+                    genomes.append(''.join(seq))
+                seq = []
+            else:
+                seq.append(line.strip())
+    genomes.append(''.join(seq))
+    return [np.frombuffer(g.encode(), dtype=np.uint8) for g in genomes]
+
+
+def generate_queries(outdir, refseqs, n_reads=10000, n_samples=10,
+                     read_length=100, error_rate=0.01, duplicate_rate=0.0,
+                     seed=0):
+    '''Write query.fna with reads named ``sample<i>_<j>``
+
+    Reads are sampled uniformly from the references with substitution
+    errors at ``error_rate``; a ``duplicate_rate`` fraction of reads repeat
+    an earlier read of the same chunk exactly.
+    '''
+    rng = np.random.default_rng(seed)
+    genomes = _read_genomes(refseqs)
+    lengths = np.array([len(g) for g in genomes])
+    offsets = np.r_[0, np.cumsum(lengths)[:-1]]
+    concatenated = np.concatenate(genomes)
+    query = os.path.join(outdir, 'query.fna')
+    written = 0
+    with open(query, 'w') as fh:
+        while written < n_reads:
+            n = min(_CHUNK_READS, n_reads - written)
+            refs = rng.integers(0, len(genomes), n)
+            starts = offsets[refs] + rng.integers(
+                0, lengths[refs] - read_length + 1)
+            reads = concatenated[starts[:, None] + np.arange(read_length)]
+            errors = rng.random(reads.shape) < error_rate
+            reads[errors] = _BASES[rng.integers(0, 4, errors.sum())]
+            duplicates = np.flatnonzero(rng.random(n) < duplicate_rate)
+            duplicates = duplicates[duplicates > 0]
+            reads[duplicates] = reads[rng.integers(0, duplicates)]
+            samples = rng.integers(0, n_samples, n)
+            fh.writelines('>sample%d_%d\n%s\n' % (
+                sample, written + i, read.tobytes().decode())
+                for i, (sample, read) in enumerate(zip(samples, reads)))
+            written += n
+    return query
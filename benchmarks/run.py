@@ -0,0 +1,156 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+'''Stage-level throughput benchmarks for nobunaga and minipipe
+
+Generates a synthetic reference and multiplexed queries (see generate.py),
+builds the bowtie2 index once, then runs each requested execution mode on
+each query size and records the per-stage report of every run (database
+staging, alignment, taxonomy assignment, table loading). Example:
+
+    python benchmarks/run.py --reads 10000 100000 --modes default native \\
+        --output results.json
+
+Requires shogun and bowtie2 on the PATH. Results are a deterministic
+function of the arguments apart from the timings themselves, so two JSON
+files from different releases can be compared stage by stage.
+'''
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+
+import pandas as pd
+from q2_types.bowtie2 import Bowtie2IndexDirFmt
+from q2_types.feature_data import DNAFASTAFormat
+
+import q2_shogun
+from q2_shogun import _shogun
+from q2_shogun._instrument import REPORT_ENV
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from generate import generate_queries, generate_reference  # noqa: E402
+
+
+# keyword arguments of nobunaga for each execution mode; threads is filled
+# in from the command line
+MODES = {
+    'default': {},
+    'sharded': {'shards': 'threads'},
+    'streaming': {'streaming': True},
+    'native': {'assigner': 'native', 'taxacut': 1.0},
+    'native-streaming': {'assigner': 'native', 'taxacut': 1.0,
+                         'streaming': True},
+    'collapsed': {'collapse_duplicates': True},
+    'native-collapsed': {'assigner': 'native', 'taxacut': 1.0,
+                         'collapse_duplicates': True},
+}
+
+
+def _version(cmd):
+    try:
+        out = subprocess.run(cmd, capture_output=True, text=True).stdout
+    except FileNotFoundError:
+        return None
+    return out.strip().splitlines()[0] if out.strip() else None
+
+
+def build_index(refseqs, outdir, threads):
+    index_dir = os.path.join(outdir, 'bowtie2')
+    os.mkdir(index_dir)
+    subprocess.run(['bowtie2-build', '--threads', str(threads), '-q',
+                    refseqs, os.path.join(index_dir, 'genomes')],
+                   check=True)
+    return index_dir
+
+
+def run_mode(action, mode, query, refseqs, taxonomy, index_dir, threads,
+             workdir):
+    kwargs = {k: threads if v == 'threads' else v
+              for k, v in MODES[mode].items()}
+    fp = os.path.join(workdir, 'report-%s-%s.json' % (action, mode))
+    os.environ[REPORT_ENV] = fp
+    try:
+        getattr(_shogun, action)(
+            query=DNAFASTAFormat(query, mode='r'),
+            reference_reads=DNAFASTAFormat(refseqs, mode='r'),
+            reference_taxonomy=taxonomy,
+            database=Bowtie2IndexDirFmt(index_dir, mode='r'),
+            threads=threads, **kwargs)
+    finally:
+        del os.environ[REPORT_ENV]
+    with open(fp) as fh:
+        return json.load(fh)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--reads', type=int, nargs='+', default=[10 ** 4])
+    parser.add_argument('--samples', type=int, default=10)
+    parser.add_argument('--genomes', type=int, default=50)
+    parser.add_argument('--genome-length', type=int, default=100000)
+    parser.add_argument('--read-length', type=int, default=100)
+    parser.add_argument('--duplicate-rate', type=float, default=0.0)
+    parser.add_argument('--modes', nargs='+', default=['default'],
+                        choices=sorted(MODES))
+    parser.add_argument('--minipipe', action='store_true',
+                        help='also benchmark minipipe (needs KEGG data in '
+                             'the database, so off by default)')
+    parser.add_argument('--threads', type=int, default=os.cpu_count())
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workdir', default=None)
+    parser.add_argument('--output', default='-')
+    args = parser.parse_args(argv)
+
+    results = {
+        'config': vars(args),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'q2_shogun': q2_shogun.__version__,
+            'shogun': _version(['shogun', '--version']),
+            'bowtie2': _version(['bowtie2', '--version']),
+        },
+        'runs': [],
+    }
+    with tempfile.TemporaryDirectory(dir=args.workdir) as workdir:
+        refseqs, taxonomy_fp = generate_reference(
+            workdir, args.genomes, args.genome_length, seed=args.seed)
+        taxonomy = pd.read_csv(taxonomy_fp, sep='\t',
+                               index_col=0)['Taxon']
+        index_dir = build_index(refseqs, workdir, args.threads)
+        actions = ['nobunaga'] + (['minipipe'] if args.minipipe else [])
+        for n_reads in args.reads:
+            query = generate_queries(
+                workdir, refseqs, n_reads, args.samples, args.read_length,
+                duplicate_rate=args.duplicate_rate, seed=args.seed)
+            for action in actions:
+                modes = args.modes if action == 'nobunaga' else ['default']
+                for mode in modes:
+                    report = run_mode(action, mode, query, refseqs,
+                                      taxonomy, index_dir, args.threads,
+                                      workdir)
+                    results['runs'].append({'reads': n_reads,
+                                            'action': action,
+                                            'mode': mode, 'report': report})
+
+    out = json.dumps(results, indent=2)
+    if args.output == '-':
+        print(out)
+    else:
+        with open(args.output, 'w') as fh:
+            fh.write(out + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,254 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import contextlib
+import hashlib
+import heapq
+import itertools
+import os
+import re
+import shutil
+
+
+# number of alignments SHOGUN asks bowtie2 to report per read
+ALIGNMENTS_TO_REPORT = 16
+
+_AS = re.compile(r'\tAS:i:(-?\d+)')
+# SAM flags
+_UNMAPPED = 4
+_SECONDARY = 256
+
+
+def bowtie2_index(dbdir):
+    '''Return the bowtie2 index prefix of a SHOGUN database directory'''
+    import yaml
+
+    with open(os.path.join(dbdir, 'metadata.yaml')) as fh:
+        metadata = yaml.safe_load(fh)
+    if 'bowtie2' not in metadata:
+        raise ValueError('The database is partitioned into %d bowtie2 '
+                         'indexes, which this action cannot align against.'
+                         % len(metadata['bowtie2_partitions']))
+    return os.path.join(dbdir, metadata['bowtie2'])
+
+
+def bowtie2_partitions(dbdir):
+    '''Return the bowtie2 index prefixes of the partitions of a database
+
+    A database that is not partitioned is a single partition.
+    '''
+    import yaml
+
+    with open(os.path.join(dbdir, 'metadata.yaml')) as fh:
+        metadata = yaml.safe_load(fh)
+    return [os.path.join(dbdir, index) for index in
+            metadata.get('bowtie2_partitions') or [metadata['bowtie2']]]
+
+
+def index_size(prefix):
+    '''Size in bytes of the files of a bowtie2 index'''
+    root, name = os.path.split(prefix)
+    return sum(os.path.getsize(os.path.join(root, fp))
+               for fp in os.listdir(root) if fp.startswith(name + '.'))
+
+
+def bowtie2_build_command(fasta_fp, prefix, threads):
+    '''The bowtie2-build invocation indexing ``fasta_fp`` as ``prefix``'''
+    return ['bowtie2-build', '--threads', str(threads), fasta_fp, prefix]
+
+
+def bowtie2_command(index, query_fp, sam_fp, threads, percent_id,
+                    all_reads=False):
+    '''The bowtie2 invocation ``shogun align -a bowtie2`` would run
+
+    Scoring follows SHOGUN: mismatches and gap extensions cost 1 and gap
+    opens are free, so the minimum score rejects reads whose identity to
+    the reference is below ``percent_id``. Alignments are written to stdout
+    if ``sam_fp`` is None. With ``all_reads``, unaligned reads are reported
+    too and reads are written in input order, so that the alignments of
+    the same query against several indexes can be merged in lockstep.
+    '''
+    cmd = ['bowtie2'] + (['--reorder'] if all_reads else ['--no-unal'])
+    cmd += ['-x', index]
+    if sam_fp is not None:
+        cmd += ['-S', sam_fp]
+    return cmd + ['--np', '0', '--mp', '1,1', '--rdg', '0,1', '--rfg', '0,1',
+                  '--score-min', 'L,0,-%.2f' % (1. - percent_id),
+                  '-f', query_fp, '--very-sensitive',
+                  '-k', str(ALIGNMENTS_TO_REPORT), '-p', str(threads),
+                  '--no-hd']
+
+
+def split_fasta(fasta_fp, n, outdir):
+    '''Deal the records of a FASTA file round-robin into ``n`` files
+
+    Returns the paths of the non-empty shards. Assignment only depends on
+    the alignments of each read, not on their order, so shards need not be
+    contiguous.
+    '''
+    fps = [os.path.join(outdir, 'shard-%d.fna' % i) for i in range(n)]
+    with contextlib.ExitStack() as stack:
+        shards = [stack.enter_context(open(fp, 'w')) for fp in fps]
+        record = -1
+        with open(fasta_fp) as fh:
+            for line in fh:
+                if line.startswith('>'):
+                    record += 1
+                shards[record % n].write(line)
+    for fp in fps[max(record + 1, 1):]:
+        os.remove(fp)
+    return fps[:max(record + 1, 1)]
+
+
+def partition_fasta(fasta_fp, n, outdir):
+    '''Split the records of a FASTA file into ``n`` files of similar size
+
+    Each record goes to the file with the fewest bases so far, so that the
+    bowtie2 indexes of the files, whose size grows with their bases, are
+    balanced. Returns the paths of the non-empty partitions.
+    '''
+    fps = [os.path.join(outdir, 'partition-%d.fna' % i) for i in range(n)]
+    loads = [(0, i) for i in range(n)]
+    used = set()
+    with contextlib.ExitStack() as stack:
+        partitions = [stack.enter_context(open(fp, 'w')) for fp in fps]
+        with open(fasta_fp) as fh:
+            for name, seq in _fasta_records(fh):
+                bases, i = heapq.heappop(loads)
+                partitions[i].write('>%s\n%s\n' % (name, seq))
+                heapq.heappush(loads, (bases + len(seq), i))
+                used.add(i)
+    for i, fp in enumerate(fps):
+        if i not in used:
+            os.remove(fp)
+    return [fp for i, fp in enumerate(fps) if i in used]
+
+
+def concatenate_sam(sam_fps, out_fp):
+    '''Concatenate SAM files, keeping only the header of the first'''
+    with open(out_fp, 'w') as out:
+        for i, fp in enumerate(sam_fps):
+            with open(fp) as fh:
+                if i == 0:
+                    shutil.copyfileobj(fh, out)
+                    continue
+                for line in fh:
+                    if not line.startswith('@'):
+                        out.write(line)
+                        break
+                shutil.copyfileobj(fh, out)
+    return out_fp
+
+
+def _read_groups(fh):
+    '''Yield the name and records of each read of a SAM file'''
+    group, last = [], None
+    for line in fh:
+        if line.startswith('@'):
+            continue
+        qname = line[:line.find('\t')]
+        if qname != last and group:
+            yield last, group
+            group = []
+        last = qname
+        group.append(line)
+    if group:
+        yield last, group
+
+
+def _set_secondary(line, secondary):
+    qname, flag, rest = line.split('\t', 2)
+    flag = int(flag) | _SECONDARY if secondary else int(flag) & ~_SECONDARY
+    return '%s\t%d\t%s' % (qname, flag, rest)
+
+
+def merge_partition_sams(sam_fps, out_fp, hits=ALIGNMENTS_TO_REPORT):
+    '''Merge alignments of a query against the partitions of a reference
+
+    The SAM files must list every read, aligned or not, in the same order,
+    as written by ``bowtie2_command`` with ``all_reads``. The ``hits``
+    alignments of each read with the highest alignment score (AS) across
+    partitions are kept, ties going to the earlier partition, and the best
+    is marked primary. Unaligned reads are dropped, as with a single index.
+    '''
+    with contextlib.ExitStack() as stack:
+        sams = [_read_groups(stack.enter_context(open(fp)))
+                for fp in sam_fps]
+        out = stack.enter_context(open(out_fp, 'w'))
+        for reads in itertools.zip_longest(*sams):
+            if None in reads or len({qname for qname, _ in reads}) != 1:
+                raise ValueError('Alignments against reference partitions '
+                                 'do not list the same reads in the same '
+                                 'order.')
+            records = [line for _, lines in reads for line in lines
+                       if not int(line.split('\t', 2)[1]) & _UNMAPPED]
+            records.sort(key=lambda line: -int(_AS.search(line).group(1)))
+            for i, line in enumerate(records[:hits]):
+                out.write(_set_secondary(line, i > 0))
+    return out_fp
+
+
+def _fasta_records(fh):
+    name, seq = None, []
+    for line in fh:
+        line = line.rstrip('\n')
+        if line.startswith('>'):
+            if name is not None:
+                yield name, ''.join(seq)
+            # aligners report the name up to the first whitespace
+            name, seq = line[1:].split(None, 1)[0], []
+        elif line:
+            seq.append(line)
+    if name is not None:
+        yield name, ''.join(seq)
+
+
+def collapse_fasta(fasta_fp, out_fp):
+    '''Write each distinct sequence of a FASTA file once
+
+    Sequences are keyed by a 128-bit digest rather than held in memory.
+    Each unique sequence keeps the name of its first read, and the
+    returned dict maps that name to how many reads of each sample share the
+    sequence. Reads are named ``<sample>_<read>``, as SHOGUN expects.
+    '''
+    unique = {}
+    counts = {}
+    with open(fasta_fp) as fh, open(out_fp, 'w') as out:
+        for name, seq in _fasta_records(fh):
+            key = hashlib.blake2b(seq.upper().encode(),
+                                  digest_size=16).digest()
+            first = unique.setdefault(key, name)
+            if first == name:
+                counts[name] = {}
+                out.write('>%s\n%s\n' % (name, seq))
+            samples = counts[first]
+            sample = name.rsplit('_', 1)[0]
+            samples[sample] = samples.get(sample, 0) + 1
+    return counts
+
+
+def expand_sam(sam_fp, counts, out_fp):
+    '''Restore the records of collapsed reads in a SAM file
+
+    SHOGUN counts reads by name, so every alignment of a unique sequence
+    is repeated once for each read of each sample sharing it, under names
+    generated from the counts of ``collapse_fasta``.
+    '''
+    positions = {name: i for i, name in enumerate(counts)}
+    with open(sam_fp) as fh, open(out_fp, 'w') as out:
+        for line in fh:
+            if line.startswith('@'):
+                out.write(line)
+                continue
+            qname, rest = line.split('\t', 1)
+            i = positions[qname]
+            for sample, count in counts[qname].items():
+                for k in range(count):
+                    out.write('%s_%d.%d\t' % (sample, i, k))
+                    out.write(rest)
+    return out_fp
@@ -0,0 +1,247 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+
+
+DATABASE_CACHE_ENV = 'Q2_SHOGUN_DATABASE_CACHE'
+DATABASE_CACHE_SIZE_ENV = 'Q2_SHOGUN_DATABASE_CACHE_SIZE'
+RESULT_CACHE_ENV = 'Q2_SHOGUN_RESULT_CACHE'
+RESULT_CACHE_SIZE_ENV = 'Q2_SHOGUN_RESULT_CACHE_SIZE'
+
+_READ_BLOCK = 2 ** 20
+
+_UNITS = {'': 1, 'K': 2 ** 10, 'M': 2 ** 20, 'G': 2 ** 30, 'T': 2 ** 40}
+
+_COMPLETE = '.complete'
+_GLOBAL_LOCK = '.lock'
+# digests of files hashed before, kept in the root of a configured cache
+_DIGESTS = '.digests'
+
+# digests hashed by this process, by file identity
+_digests = {}
+
+
+def parse_size(size):
+    '''Parse a byte count such as "500000", "750M" or "2G"'''
+    size = str(size).strip().upper().rstrip('B')
+    unit = size[-1:] if size[-1:] in _UNITS else ''
+    try:
+        value = float(size[:len(size) - len(unit)])
+    except ValueError:
+        raise ValueError('Could not interpret %r as a size in bytes.' % size)
+    if value < 0:
+        raise ValueError('Sizes must be non-negative, not %r.' % size)
+    return int(value * _UNITS[unit])
+
+
+def _digest_dir():
+    for var in (DATABASE_CACHE_ENV, RESULT_CACHE_ENV):
+        if os.environ.get(var):
+            return os.path.join(os.environ[var], _DIGESTS)
+    return None
+
+
+def file_digest(fp):
+    '''SHA-256 of the full content of the file at ``fp``
+
+    Hashing a multi-gigabyte index takes a while, so digests are memoized
+    by file identity: path, device, inode, size and modification time.
+    Artifact files are never modified in place, so this only hashes each
+    file once. When a database or result cache is configured, the digests
+    are also kept in its root, so that later runs reuse them.
+    '''
+    st = os.stat(fp)
+    identity = '\0'.join(str(part) for part in (
+        os.path.realpath(fp), st.st_dev, st.st_ino, st.st_size,
+        st.st_mtime_ns))
+    if identity in _digests:
+        return _digests[identity]
+    memo = _digest_dir()
+    memo_fp = None
+    if memo is not None:
+        memo_fp = os.path.join(
+            memo, hashlib.sha256(identity.encode()).hexdigest())
+        try:
+            with open(memo_fp) as fh:
+                _digests[identity] = fh.read()
+                return _digests[identity]
+        except FileNotFoundError:
+            pass
+    digest = hashlib.sha256()
+    with open(fp, 'rb') as fh:
+        for block in iter(lambda: fh.read(_READ_BLOCK), b''):
+            digest.update(block)
+    _digests[identity] = digest.hexdigest()
+    if memo_fp is not None:
+        os.makedirs(memo, exist_ok=True)
+        tmp = '%s.%d' % (memo_fp, os.getpid())
+        with open(tmp, 'w') as fh:
+            fh.write(_digests[identity])
+        os.replace(tmp, memo_fp)
+    return _digests[identity]
+
+
+def _files(path):
+    # (name relative to ``path``, file path), for a file or directory tree
+    path = str(path)
+    if not os.path.isdir(path):
+        yield os.path.basename(path), path
+        return
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            fp = os.path.join(root, name)
+            yield os.path.relpath(fp, path), fp
+
+
+def _combine(paths, describe, extra):
+    digest = hashlib.sha256()
+    for path in paths:
+        for name, fp in _files(path):
+            digest.update(name.encode())
+            digest.update(describe(fp).encode())
+    for item in extra:
+        digest.update(item if isinstance(item, bytes) else str(item).encode())
+    return digest.hexdigest()
+
+
+def fingerprint(*paths, extra=()):
+    '''Content fingerprint of files and directory trees
+
+    Directory trees are hashed by relative file path and file content, so
+    that identical inputs extracted to different locations share a key.
+    ``extra`` holds additional bytes or strings to fold into the key. Every
+    file is hashed in full, see ``file_digest``.
+    '''
+    return _combine(paths, file_digest, extra)
+
+
+def size_fingerprint(*paths, extra=()):
+    '''Fingerprint of files and directory trees by file name and size
+
+    This reads no file content, so it is cheap enough to compute on every
+    run, but only tells apart inputs that differ in their file names, file
+    sizes or ``extra``. Modification times are left out, as artifacts are
+    extracted anew, with new ones, for every QIIME 2 session.
+    '''
+    return _combine(paths, lambda fp: str(os.path.getsize(fp)), extra)
+
+
+def _tree_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.lstat(os.path.join(root, name)).st_size
+    return total
+
+
+class DirectoryCache:
+    '''Size-bounded, least-recently-used cache of directories on disk
+
+    Each entry lives in ``<root>/<key>`` and is only visible once its
+    ``.complete`` marker has been written, so partially built entries left
+    behind by a failed job are rebuilt rather than used. Entries in use are
+    protected by a shared ``flock`` on ``<root>/<key>.lock``, which makes
+    the cache safe to share between concurrent jobs. Eviction only removes
+    entries that no other process is holding.
+    '''
+
+    def __init__(self, root, max_bytes=None):
+        self.root = str(root)
+        self.max_bytes = max_bytes
+
+    @classmethod
+    def from_environment(cls, root_var, size_var):
+        '''Return the cache configured by environment, or None if unset'''
+        root = os.environ.get(root_var)
+        if not root:
+            return None
+        size = os.environ.get(size_var)
+        return cls(root, parse_size(size) if size else None)
+
+    @contextlib.contextmanager
+    def _global_lock(self):
+        with open(os.path.join(self.root, _GLOBAL_LOCK), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _entries(self):
+        for name in os.listdir(self.root):
+            marker = os.path.join(self.root, name, _COMPLETE)
+            if os.path.exists(marker):
+                yield name, marker
+
+    @contextlib.contextmanager
+    def acquire(self, key, build):
+        '''Yield the directory for ``key``, calling ``build(path)`` on a miss
+
+        The directory must not be modified by the caller, and stays
+        protected from eviction until the context exits.
+        '''
+        os.makedirs(self.root, exist_ok=True)
+        entry = os.path.join(self.root, key)
+        marker = os.path.join(entry, _COMPLETE)
+        with open(entry + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if not os.path.exists(marker):
+                shutil.rmtree(entry, ignore_errors=True)
+                os.makedirs(entry)
+                try:
+                    build(entry)
+                except BaseException:
+                    shutil.rmtree(entry, ignore_errors=True)
+                    raise
+                with open(marker, 'w') as fh:
+                    json.dump({'size': _tree_size(entry)}, fh)
+            # flock conversions are not atomic, so downgrade while holding
+            # the global lock to keep eviction out of the gap
+            with self._global_lock():
+                fcntl.flock(lock, fcntl.LOCK_SH)
+                os.utime(marker)
+            self.evict(keep=key)
+            try:
+                yield entry
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def evict(self, keep=None):
+        '''Remove least recently used entries until the cache fits'''
+        if self.max_bytes is None:
+            return
+        with self._global_lock():
+            entries = []
+            for name, marker in self._entries():
+                with open(marker) as fh:
+                    size = json.load(fh)['size']
+                entries.append((os.path.getmtime(marker), name, size))
+            total = sum(size for _, _, size in entries)
+            for _, name, size in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if name == keep:
+                    continue
+                entry = os.path.join(self.root, name)
+                with open(entry + '.lock', 'a') as lock:
+                    try:
+                        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue
+                    # drop the marker first so a crash mid-removal leaves
+                    # an entry that will be rebuilt, never a broken one
+                    os.remove(os.path.join(entry, _COMPLETE))
+                    shutil.rmtree(entry, ignore_errors=True)
+                    total -= size
@@ -0,0 +1,181 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import abc
+import gzip
+import os
+import zlib
+
+import qiime2.plugin.model as model
+from qiime2.plugin import ValidationError
+
+
+class NumpyArrayFormat(model.BinaryFileFormat):
+    def _validate_(self, level):
+        with self.open() as fh:
+            if fh.read(6) != b'\x93NUMPY':
+                raise ValidationError('File is not a .npy array.')
+
+
+class LabelsFormat(model.TextFileFormat):
+    def _validate_(self, level):
+        with self.open() as fh:
+            for lineno, line in enumerate(fh, 1):
+                if not line.rstrip('\n'):
+                    raise ValidationError('Empty label on line %d.' % lineno)
+                if level == 'min' and lineno >= 10:
+                    break
+
+
+class TaxonomyLabelsFormat(LabelsFormat):
+    pass
+
+
+class SparseMatrixFormat(model.BinaryFileFormat):
+    def _validate_(self, level):
+        with self.open() as fh:
+            if fh.read(4) != b'PK\x03\x04':
+                raise ValidationError('File is not a .npz archive.')
+        if level == 'max':
+            from scipy import sparse
+
+            try:
+                sparse.load_npz(str(self))
+            except (OSError, ValueError, KeyError) as e:
+                raise ValidationError('Invalid sparse matrix: %s' % e)
+
+
+class TaxonomyIndexDirFmt(model.DirectoryFormat):
+    labels = model.File('labels.txt', format=TaxonomyLabelsFormat)
+    lineages = model.File('lineages.npy', format=NumpyArrayFormat)
+    ids = model.File('ids.npy', format=NumpyArrayFormat)
+    id_rows = model.File('id-rows.npy', format=NumpyArrayFormat)
+    # fingerprint of the source taxonomy, missing from older indexes
+    source = model.File('source.txt', format=TaxonomyLabelsFormat,
+                        optional=True)
+
+
+class FunctionalAnnotationDirFmt(model.DirectoryFormat):
+    strains = model.File('strains.txt', format=LabelsFormat)
+    kos = model.File('kos.txt', format=LabelsFormat)
+    modules = model.File('modules.txt', format=LabelsFormat)
+    pathways = model.File('pathways.txt', format=LabelsFormat)
+    strain_kos = model.File('strain-kos.npz', format=SparseMatrixFormat)
+    ko_modules = model.File('ko-modules.npz', format=SparseMatrixFormat)
+    ko_pathways = model.File('ko-pathways.npz', format=SparseMatrixFormat)
+
+
+class _GzipTextFormat(model.BinaryFileFormat, metaclass=abc.ABCMeta):
+    '''gzip-compressed text, whose lines are checked by ``_sniff``'''
+
+    @abc.abstractmethod
+    def _sniff(self, lines):
+        '''Raise ValidationError unless ``lines`` are valid'''
+
+    def _validate_(self, level):
+        with self.open() as fh:
+            if fh.read(2) != b'\x1f\x8b':
+                raise ValidationError('File is not gzip compressed.')
+        try:
+            with gzip.open(str(self), 'rt') as fh:
+                self._sniff(fh if level == 'max' else
+                            (line for line, _ in zip(fh, range(10))))
+        except (OSError, EOFError, zlib.error) as e:
+            raise ValidationError('Invalid gzip file: %s' % e)
+
+
+class SAMGzFormat(_GzipTextFormat):
+    def _sniff(self, lines):
+        for lineno, line in enumerate(lines, 1):
+            if not line.startswith('@') and len(line.split('\t')) < 11:
+                raise ValidationError('Line %d is not a SAM record.'
+                                      % lineno)
+
+
+ShogunAlignmentDirFmt = model.SingleFileDirectoryFormat(
+    'ShogunAlignmentDirFmt', 'alignment.sam.gz', SAMGzFormat)
+
+
+class DNAFASTAGzFormat(_GzipTextFormat):
+    '''gzip or bgzip-compressed DNA FASTA'''
+
+    def _sniff(self, lines):
+        for lineno, line in enumerate(lines, 1):
+            line = line.rstrip('\n')
+            if lineno == 1 and not line.startswith('>'):
+                raise ValidationError('File does not start with a FASTA '
+                                      'header.')
+            if not line.startswith('>') and \
+                    line.strip('ACGTRYKMSWBDHVNacgtrykmswbdhvn-.'):
+                raise ValidationError('Line %d is not a FASTA header or '
+                                      'DNA sequence.' % lineno)
+
+
+DNAFASTAGzDirFmt = model.SingleFileDirectoryFormat(
+    'DNAFASTAGzDirFmt', 'dna-sequences.fasta.gz', DNAFASTAGzFormat)
+
+
+class ShogunMetadataFormat(model.TextFileFormat):
+    def _validate_(self, level):
+        import yaml
+
+        with self.open() as fh:
+            try:
+                metadata = yaml.safe_load(fh)
+            except yaml.YAMLError as e:
+                raise ValidationError('Invalid YAML: %s' % e)
+        if not isinstance(metadata, dict) or \
+                not isinstance(metadata.get('general'), dict):
+            raise ValidationError('SHOGUN metadata must have a "general" '
+                                  'section.')
+        for key in ('taxonomy', 'fasta'):
+            if key not in metadata['general']:
+                raise ValidationError('SHOGUN metadata does not name a %s '
+                                      'file.' % key)
+
+
+class ShogunDatabaseFileFormat(model.BinaryFileFormat):
+    # files of a SHOGUN database are only checked for being referenced by
+    # its metadata, by ShogunDatabaseDirFmt
+    def _validate_(self, level):
+        pass
+
+
+class ShogunDatabaseDirFmt(model.DirectoryFormat):
+    metadata = model.File('metadata.yaml', format=ShogunMetadataFormat)
+    files = model.FileCollection(r'(?!metadata\.yaml$).+',
+                                 format=ShogunDatabaseFileFormat)
+
+    @files.set_path_maker
+    def files_path_maker(self, relpath):
+        return relpath
+
+    def _validate_(self, level):
+        import yaml
+
+        with (self.path / 'metadata.yaml').open() as fh:
+            metadata = yaml.safe_load(fh)
+        for key in ('taxonomy', 'fasta'):
+            if not (self.path / metadata['general'][key]).is_file():
+                raise ValidationError('The %s file named in the metadata, '
+                                      '%s, is missing.' % (
+                                          key, metadata['general'][key]))
+        # partitioned databases have several indexes instead of one
+        indexes = metadata.get('bowtie2_partitions')
+        if indexes is None and 'bowtie2' in metadata:
+            indexes = [metadata['bowtie2']]
+        if not indexes:
+            raise ValidationError('The database has no bowtie2 index.')
+        for index in indexes:
+            prefix = self.path / index
+            if not prefix.parent.is_dir() or not any(
+                    name.startswith(prefix.name + '.') and
+                    name.endswith(('.bt2', '.bt2l'))
+                    for name in os.listdir(str(prefix.parent))):
+                raise ValidationError('The bowtie2 index %s named in the '
+                                      'metadata is missing.' % index)
@@ -0,0 +1,158 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import concurrent.futures
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+
+# samples profiled per task, so that threads get balanced work
+_BLOCK_SAMPLES = 64
+
+# KEGG module and pathway IDs, e.g. M00001, and map00010 or ko00010
+_MODULE_ID = re.compile(r'M\d{5}')
+_PATHWAY_ID = re.compile(r'(?:map|ko)\d{5}')
+
+
+class StrainFunctions:
+    '''KEGG annotation of reference strains as sparse matrices
+
+    ``strain_kos[i, j]`` is the copy number of ortholog ``kos[j]`` in strain
+    ``strains[i]``, where strains are named by their full lineage as in a
+    strain-level SHOGUN taxatable. ``ko_modules`` and ``ko_pathways`` are
+    KO by module and KO by pathway membership matrices.
+    '''
+
+    def __init__(self, strains, kos, strain_kos, modules, ko_modules,
+                 pathways, ko_pathways):
+        from scipy import sparse
+
+        self.strains = pd.Index(strains)
+        self.kos = np.asarray(kos, dtype=object)
+        self.strain_kos = sparse.csr_matrix(strain_kos)
+        self.modules = np.asarray(modules, dtype=object)
+        self.ko_modules = sparse.csr_matrix(ko_modules)
+        self.pathways = np.asarray(pathways, dtype=object)
+        self.ko_pathways = sparse.csr_matrix(ko_pathways)
+        shapes = [(self.strain_kos.shape, (len(self.strains), len(kos))),
+                  (self.ko_modules.shape, (len(kos), len(modules))),
+                  (self.ko_pathways.shape, (len(kos), len(pathways)))]
+        for shape, expected in shapes:
+            if shape != expected:
+                raise ValueError('Annotation matrix of shape %r does not '
+                                 'match its labels %r.' % (shape, expected))
+
+
+def _read_memberships(fp, pattern, kos):
+    '''KO by module (or pathway) membership in a SHOGUN annotation file
+
+    Each line starts with a KO, followed by tab-separated fields. Those that
+    are IDs matching ``pattern``, alone or ``;``-separated, are the modules
+    the KO belongs to; other fields, such as descriptions, are ignored, as
+    are KOs no strain carries.
+    '''
+    from scipy import sparse
+
+    column = {ko: i for i, ko in enumerate(kos)}
+    rows, ids = [], []
+    with open(fp) as fh:
+        for line in fh:
+            fields = line.rstrip('\n').split('\t')
+            if fields[0] not in column:
+                continue
+            for field in fields[1:]:
+                for token in field.split(';'):
+                    if pattern.fullmatch(token.strip()):
+                        rows.append(column[fields[0]])
+                        ids.append(token.strip())
+    codes, labels = pd.factorize(pd.Series(ids, dtype=object), sort=True)
+    matrix = sparse.coo_matrix((np.ones(len(rows)), (rows, codes)),
+                               shape=(len(kos), len(labels))).tocsr()
+    # a KO listed twice for a module is still one member
+    matrix.data[:] = 1
+    return list(labels), matrix
+
+
+def read_shogun_functions(dbdir):
+    '''The functional annotation of a SHOGUN database directory
+
+    The metadata of a SHOGUN database names the prefix of its annotation
+    files as ``function``: ``<prefix>-strain2ko.tsv`` holds the KO copy
+    numbers of each strain, with strains as rows and KOs as columns, and
+    ``<prefix>-module-annotations.txt`` and
+    ``<prefix>-pathway-annotations.txt`` the modules and pathways of each
+    KO. These are the files ``shogun functional`` reads.
+    '''
+    import yaml
+    from scipy import sparse
+
+    with open(os.path.join(dbdir, 'metadata.yaml')) as fh:
+        prefix = yaml.safe_load(fh).get('function')
+    if not prefix:
+        raise ValueError('The SHOGUN database has no functional annotation; '
+                         'its metadata names no "function" files.')
+    prefix = os.path.join(dbdir, prefix)
+    strain_kos = pd.read_csv(prefix + '-strain2ko.tsv', sep='\t',
+                             index_col=0)
+    kos = [str(ko) for ko in strain_kos.columns]
+    modules, ko_modules = _read_memberships(
+        prefix + '-module-annotations.txt', _MODULE_ID, kos)
+    pathways, ko_pathways = _read_memberships(
+        prefix + '-pathway-annotations.txt', _PATHWAY_ID, kos)
+    return StrainFunctions(
+        strain_kos.index.astype(str), kos,
+        sparse.csr_matrix(strain_kos.fillna(0).to_numpy(dtype=float)),
+        modules, ko_modules, pathways, ko_pathways)
+
+
+def _table(matrix, obs_ids, sample_ids):
+    '''biom Table of the observations that occur in any sample'''
+    import biom
+    from scipy import sparse
+
+    matrix = sparse.csr_matrix(matrix)
+    matrix.eliminate_zeros()
+    keep = np.flatnonzero(np.diff(matrix.indptr))
+    return biom.Table(matrix[keep], list(obs_ids[keep]), list(sample_ids))
+
+
+def functional_tables(table, annotation, threads=1):
+    '''KEGG ortholog, module and pathway tables of a strain table
+
+    The abundance of each ortholog is that of every annotated strain
+    weighted by its copy number, and module and pathway abundances sum the
+    orthologs they contain. Strains without annotation are ignored. Blocks
+    of samples are multiplied on ``threads`` threads.
+    '''
+    from scipy import sparse
+
+    labels = [annotation.kos, annotation.modules, annotation.pathways]
+    sample_ids = table.ids()
+    rows = annotation.strains.get_indexer(table.ids(axis='observation'))
+    known = np.flatnonzero(rows >= 0)
+    if not len(known) or not len(sample_ids):
+        return tuple(_table(sparse.csr_matrix((len(ids), len(sample_ids))),
+                            ids, sample_ids) for ids in labels)
+    counts = table.matrix_data.tocsr()[known]
+    # KO x strain, restricted to the strains of the table
+    weights = annotation.strain_kos[rows[known]].T.tocsr()
+
+    def _profile(start):
+        block = counts[:, start:start + _BLOCK_SAMPLES]
+        kos = weights @ block
+        return (kos, annotation.ko_modules.T @ kos,
+                annotation.ko_pathways.T @ kos)
+
+    starts = range(0, counts.shape[1], _BLOCK_SAMPLES)
+    with concurrent.futures.ThreadPoolExecutor(threads) as pool:
+        blocks = list(pool.map(_profile, starts))
+    return tuple(_table(sparse.hstack([b[i] for b in blocks]), ids,
+                        sample_ids) for i, ids in enumerate(labels))
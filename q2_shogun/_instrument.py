@@ -0,0 +1,112 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import contextlib
+import datetime
+import json
+import os
+import resource
+import threading
+import time
+
+
+REPORT_ENV = 'Q2_SHOGUN_REPORT'
+
+# ru_inblock and ru_oublock count 512-byte blocks on Linux
+_BLOCK_SIZE = 512
+
+_lock = threading.Lock()
+_runs = []
+
+
+def _usage():
+    return (time.perf_counter(), resource.getrusage(resource.RUSAGE_SELF),
+            resource.getrusage(resource.RUSAGE_CHILDREN))
+
+
+def _measure(name, start, end):
+    (t0, self0, child0), (t1, self1, child1) = start, end
+    return {
+        'stage': name,
+        'wall_seconds': t1 - t0,
+        'user_seconds': self1.ru_utime - self0.ru_utime,
+        'system_seconds': self1.ru_stime - self0.ru_stime,
+        'children_user_seconds': child1.ru_utime - child0.ru_utime,
+        'children_system_seconds': child1.ru_stime - child0.ru_stime,
+        # maxrss is a high-water mark, so it is reported as of stage end
+        'peak_rss_kib': self1.ru_maxrss,
+        'children_peak_rss_kib': child1.ru_maxrss,
+        'read_bytes': _BLOCK_SIZE * (
+            self1.ru_inblock - self0.ru_inblock +
+            child1.ru_inblock - child0.ru_inblock),
+        'written_bytes': _BLOCK_SIZE * (
+            self1.ru_oublock - self0.ru_oublock +
+            child1.ru_oublock - child0.ru_oublock),
+    }
+
+
+@contextlib.contextmanager
+def stage(name):
+    '''Record time and resource use of a stage of the running action
+
+    Child CPU time and peak RSS only include child processes that have
+    been waited for, which is the case for every external command run by
+    this plugin once its stage ends. Stages running concurrently in
+    threads see each other's usage.
+    '''
+    if not _runs:
+        yield
+        return
+    start = _usage()
+    try:
+        yield
+    finally:
+        measured = _measure(name, start, _usage())
+        with _lock:
+            if _runs:
+                _runs[-1]['stages'].append(measured)
+
+
+def record(**values):
+    '''Add ``values`` to the report of the running action'''
+    with _lock:
+        if _runs:
+            _runs[-1].update(values)
+
+
+def _report_path(fp, action):
+    if os.path.isdir(fp):
+        stamp = datetime.datetime.now().strftime('%Y%m%dT%H%M%S')
+        return os.path.join(fp, '%s-%s-%d.json' % (action, stamp,
+                                                   os.getpid()))
+    return fp
+
+
+@contextlib.contextmanager
+def report(action, **parameters):
+    '''Collect per-stage measurements for an action run
+
+    When ``Q2_SHOGUN_REPORT`` is set, the measurements are written to it
+    as JSON. If it names an existing directory, each run writes its own
+    file there.
+    '''
+    run = {'action': action, 'parameters': parameters,
+           'started': datetime.datetime.now().isoformat(), 'stages': []}
+    start = _usage()
+    with _lock:
+        _runs.append(run)
+    try:
+        yield run
+    finally:
+        run['total'] = _measure(action, start, _usage())
+        with _lock:
+            _runs.remove(run)
+        fp = os.environ.get(REPORT_ENV)
+        if fp:
+            with open(_report_path(fp, action), 'w') as fh:
+                json.dump(run, fh, indent=2)
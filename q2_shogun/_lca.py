@@ -0,0 +1,272 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import collections
+import concurrent.futures
+import hashlib
+import itertools
+import re
+
+import numpy as np
+import pandas as pd
+
+
+# number of reads handed to a worker at a time
+_CHUNK_READS = 100000
+
+_NM = re.compile(r'\tNM:i:(\d+)')
+_CIGAR_QUERY = re.compile(r'(\d+)[MIS=X]')
+
+
+class LineageIndex:
+    '''Reference lineages encoded as integer arrays
+
+    Every lineage prefix (e.g. ``k__Bacteria;p__Firmicutes``) is interned
+    once in ``labels``. ``lineages[i, r]`` holds the code of the rank ``r``
+    prefix of reference ``i``, or -1 where its lineage is shorter, so two
+    references agree down to rank ``r`` exactly when their codes at ``r``
+    are equal. Reference IDs are looked up by binary search in the sorted
+    ``ids``, whose rows are given by ``id_rows``; all arrays may be
+    memory-mapped. ``source`` is the ``taxonomy_fingerprint`` of the
+    taxonomy the index was compiled from.
+    '''
+
+    def __init__(self, labels, lineages, ids, id_rows, source=None):
+        self.labels = np.asarray(labels, dtype=object)
+        self.lineages = lineages
+        self.ids = ids
+        self.id_rows = id_rows
+        self.source = source
+
+    @classmethod
+    def from_taxonomy(cls, taxonomy):
+        ranks = taxonomy.astype(str).str.split(';')
+        depth = ranks.str.len().max() if len(ranks) else 0
+        prefixes = [ranks.str[:r + 1].str.join(';').where(
+                    ranks.str.len() > r) for r in range(depth)]
+        codes, labels = pd.factorize(
+            pd.concat(prefixes, ignore_index=True), use_na_sentinel=True)
+        lineages = codes.reshape(depth, len(taxonomy)).T.astype(np.int32)
+        ids = np.asarray(taxonomy.index, dtype=str)
+        order = np.argsort(ids, kind='stable')
+        return cls(labels, lineages, ids[order], order.astype(np.int64),
+                   taxonomy_fingerprint(taxonomy))
+
+    def rows(self, ref_ids):
+        '''Row of each reference ID, or -1 for unknown references'''
+        query = np.asarray(ref_ids, dtype=str)
+        if not len(self.ids):
+            return np.full(len(query), -1)
+        pos = np.minimum(np.searchsorted(self.ids, query), len(self.ids) - 1)
+        return np.where(self.ids[pos] == query, self.id_rows[pos], -1)
+
+
+def taxonomy_fingerprint(taxonomy):
+    '''Content fingerprint of a taxonomy, by reference ID and lineage'''
+    taxonomy = pd.Series(taxonomy.astype(str).values,
+                         index=taxonomy.index.astype(str))
+    hashes = pd.util.hash_pandas_object(taxonomy, index=True)
+    return hashlib.sha256(hashes.values.tobytes()).hexdigest()
+
+
+def parse_sam(lines):
+    '''Extract query names, reference names and percent identity
+
+    Header lines and unmapped records are skipped. Identity is
+    ``1 - NM / query length``, which is the quantity bowtie2's minimum
+    score bounds under SHOGUN's scoring.
+    '''
+    qnames, rnames, identity = [], [], []
+    for line in lines:
+        if line.startswith('@'):
+            continue
+        fields = line.split('\t', 11)
+        if int(fields[1]) & 4:
+            continue
+        qnames.append(fields[0])
+        rnames.append(fields[2])
+        length = len(fields[9]) if fields[9] != '*' else sum(
+            int(n) for n in _CIGAR_QUERY.findall(fields[5]))
+        nm = _NM.search(line)
+        identity.append(1. - int(nm.group(1)) / length if nm else 1.)
+    return (np.array(qnames, dtype=object), np.array(rnames, dtype=object),
+            np.array(identity, dtype=float))
+
+
+def consensus(qnames, ref_rows, index, taxacut):
+    '''Assign each read the deepest lineage its hits agree on
+
+    Hits of a read must be contiguous, with the top hit first. At each rank
+    the fraction of a read's hits sharing the top hit's lineage must be at
+    least ``taxacut`` for the assignment to descend to that rank; with
+    ``taxacut`` of 1.0 this is the strict lowest common ancestor. Returns
+    the query name and label code of every assigned read.
+    '''
+    if not len(qnames):
+        return qnames, np.empty(0, dtype=np.int32)
+    starts = np.flatnonzero(np.r_[True, qnames[1:] != qnames[:-1]])
+    n_hits = np.diff(np.r_[starts, len(qnames)])
+
+    codes = index.lineages[ref_rows]
+    top = codes[starts]
+    read_of_hit = np.repeat(np.arange(len(starts)), n_hits)
+    agree = ((codes == top[read_of_hit]) & (codes >= 0)).astype(np.int32)
+    fraction = np.add.reduceat(agree, starts, axis=0) / n_hits[:, None]
+    # depth of the first rank that fails the cut, or that the top hit's
+    # lineage does not reach, which even a taxacut of 0 must not pass
+    accepted = np.cumprod((fraction >= taxacut - 1e-12) & (top >= 0),
+                          axis=1)
+    depth = accepted.sum(axis=1)
+
+    assigned = depth > 0
+    labels = top[assigned, depth[assigned] - 1]
+    return qnames[starts[assigned]], labels
+
+
+def _count(samples, labels, weights):
+    '''Total weight of each (sample, label code) pair'''
+    if not len(samples):
+        return {}
+    return pd.Series(weights).groupby([samples, labels]).sum().to_dict()
+
+
+def _assign_chunk(lines, index, grid, members=None):
+    '''Assign a chunk of reads once for each (taxacut, percent_id) of grid
+
+    Returns the counts of every (sample, label code) pair for each pair of
+    grid, so that what is kept per chunk is bounded by the number of
+    samples and labels rather than reads.
+    '''
+    qnames, rnames, identity = parse_sam(lines)
+    rows = index.rows(rnames)
+    results = []
+    for taxacut, percent_id in grid:
+        keep = (rows >= 0) & (identity >= percent_id - 1e-12)
+        reads, labels = consensus(qnames[keep], rows[keep], index, taxacut)
+        if members is None:
+            samples = np.array([q.rsplit('_', 1)[0] for q in reads],
+                               dtype=object)
+            weights = np.ones(len(reads))
+        else:
+            # reads were collapsed to unique sequences before alignment
+            counts = [members[q] for q in reads]
+            labels = np.repeat(labels, [len(c) for c in counts])
+            samples = np.array([s for c in counts for s in c], dtype=object)
+            weights = np.array([n for c in counts for n in c.values()],
+                               dtype=float)
+        results.append(_count(samples, labels, weights))
+    return results
+
+
+def _read_chunks(lines, chunk_reads):
+    '''Group SAM lines into chunks that never split a read's hits'''
+    chunk, reads, last = [], 0, None
+    for line in lines:
+        if line.startswith('@'):
+            continue
+        qname = line[:line.find('\t')]
+        if qname != last:
+            if reads == chunk_reads:
+                yield chunk
+                chunk, reads = [], 0
+            reads += 1
+            last = qname
+        chunk.append(line)
+    if chunk:
+        yield chunk
+
+
+_WORKER_INDEX = None
+_WORKER_MEMBERS = None
+
+
+def _init_worker(index, members):
+    global _WORKER_INDEX, _WORKER_MEMBERS
+    _WORKER_INDEX = index
+    _WORKER_MEMBERS = members
+
+
+def _assign_chunk_in_worker(lines, grid):
+    return _assign_chunk(lines, _WORKER_INDEX, grid, _WORKER_MEMBERS)
+
+
+def assign_lca(lines, index, taxacut=1.0, percent_id=0.0, workers=1,
+               chunk_reads=_CHUNK_READS, members=None):
+    '''Build a taxonomy table from SAM lines by consensus assignment
+
+    ``lines`` may be any iterable of SAM lines, such as an open file or the
+    stdout of a running aligner. Chunks of reads are assigned by up to
+    ``workers`` processes, with a bounded number of chunks in flight. If
+    the reads were collapsed with ``collapse_fasta``, ``members`` holds the
+    per-sample counts of the reads behind each unique sequence, and its
+    assignment is counted that many times in each sample.
+    '''
+    table, = assign_lca_grid(lines, index, [(taxacut, percent_id)],
+                             workers=workers, chunk_reads=chunk_reads,
+                             members=members)
+    return table
+
+
+def assign_lca_grid(lines, index, grid, workers=1, chunk_reads=_CHUNK_READS,
+                    members=None):
+    '''Build one taxonomy table per (taxacut, percent_id) pair of ``grid``
+
+    As ``assign_lca``, but the SAM lines are read and parsed only once, and
+    only consensus is repeated for each pair.
+    '''
+    chunks = _read_chunks(lines, chunk_reads)
+    totals = [collections.Counter() for _ in grid]
+
+    def _merge(counts):
+        for total, chunk_counts in zip(totals, counts):
+            total.update(chunk_counts)
+
+    if workers == 1:
+        for chunk in chunks:
+            _merge(_assign_chunk(chunk, index, grid, members))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(
+                workers, initializer=_init_worker,
+                initargs=(index, members)) as pool:
+            pending = set()
+            for chunk in itertools.chain(chunks, [None]):
+                if chunk is not None:
+                    pending.add(pool.submit(_assign_chunk_in_worker, chunk,
+                                            grid))
+                if len(pending) >= 2 * workers or chunk is None:
+                    done, pending = concurrent.futures.wait(
+                        pending, return_when=(
+                            concurrent.futures.ALL_COMPLETED
+                            if chunk is None else
+                            concurrent.futures.FIRST_COMPLETED))
+                    for future in done:
+                        _merge(future.result())
+
+    return [_lca_table(total, index) for total in totals]
+
+
+def _lca_table(counts, index):
+    import biom
+    from scipy import sparse
+
+    samples = np.array([s for s, _ in counts], dtype=object)
+    labels = np.array([c for _, c in counts], dtype=int)
+    weights = np.array(list(counts.values()), dtype=float)
+    # sort IDs so the table does not depend on the order chunks finished
+    sample_codes, sample_ids = pd.factorize(samples, sort=True)
+    label_codes, label_ids = pd.factorize(labels)
+    order = np.argsort(index.labels[label_ids])
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    label_codes, label_ids = rank[label_codes], label_ids[order]
+    matrix = sparse.coo_matrix(
+        (weights, (label_codes, sample_codes)),
+        shape=(len(label_ids), len(sample_ids))).tocsr()
+    matrix.sum_duplicates()
+    return biom.Table(matrix, list(index.labels[label_ids]),
+                      list(sample_ids))
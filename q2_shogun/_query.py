@@ -0,0 +1,128 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import contextlib
+import gzip
+import os
+import shutil
+import subprocess
+import threading
+
+
+# FASTA of short reads compresses about fourfold with gzip
+COMPRESSION_RATIO = 4
+
+_GZIP_MAGIC = b'\x1f\x8b'
+# gzip header flag marking an extra field, where BGZF blocks keep their size
+_FEXTRA = 4
+
+
+class QueryFASTA:
+    '''Query sequences in a FASTA file that may be gzip or bgzip compressed
+
+    This is the view actions taking compressed queries receive; it behaves
+    as the path of the file.
+    '''
+
+    def __init__(self, path):
+        self.path = str(path)
+
+    def __str__(self):
+        return self.path
+
+    def __fspath__(self):
+        return self.path
+
+
+def _header(fp):
+    with open(str(fp), 'rb') as fh:
+        return fh.read(14)
+
+
+def is_gzip(fp):
+    '''Whether the file at ``fp`` is gzip (or bgzip) compressed'''
+    return _header(fp)[:2] == _GZIP_MAGIC
+
+
+def is_bgzf(fp):
+    '''Whether the file at ``fp`` is blocked gzip, as written by bgzip'''
+    header = _header(fp)
+    return header[:2] == _GZIP_MAGIC and bool(header[3] & _FEXTRA) and \
+        header[12:14] == b'BC'
+
+
+def query_size(fp):
+    '''Estimated size in bytes of the uncompressed query at ``fp``'''
+    size = os.path.getsize(str(fp))
+    return COMPRESSION_RATIO * size if is_gzip(fp) else size
+
+
+def decompress_command(fp, threads):
+    '''Command decompressing ``fp`` to stdout on ``threads`` threads
+
+    bgzip decompresses the independent blocks of a BGZF file in parallel;
+    pigz decompresses plain gzip on a thread of its own while others read,
+    write and checksum. None if neither is installed.
+    '''
+    if is_bgzf(fp) and shutil.which('bgzip'):
+        return ['bgzip', '-d', '-c', '-@', str(threads), str(fp)]
+    if shutil.which('pigz'):
+        return ['pigz', '-d', '-c', '-p', str(threads), str(fp)]
+    return None
+
+
+def _decompress(fp, fifo, threads, opened, errors):
+    try:
+        try:
+            cmd = decompress_command(fp, threads)
+            out = open(fifo, 'wb')
+        finally:
+            opened.set()
+        with out:
+            if cmd is None:
+                with gzip.open(str(fp), 'rb') as src:
+                    shutil.copyfileobj(src, out)
+            else:
+                subprocess.run(cmd, stdout=out, check=True)
+    except (OSError, EOFError, subprocess.CalledProcessError) as e:
+        errors.append(e)
+
+
+@contextlib.contextmanager
+def query_pipe(query, outdir, threads=1, name='query.fna'):
+    '''Yield a path from which the uncompressed query can be read once
+
+    A compressed query is decompressed into a named pipe in ``outdir``
+    while it is read, so that it is never written out uncompressed. Other
+    queries are yielded as they are.
+    '''
+    if not is_gzip(query):
+        yield str(query)
+        return
+    fifo = os.path.join(outdir, name)
+    os.mkfifo(fifo)
+    opened = threading.Event()
+    errors = []
+    writer = threading.Thread(target=_decompress,
+                              args=(query, fifo, threads, opened, errors),
+                              daemon=True)
+    writer.start()
+    try:
+        yield fifo
+    finally:
+        if writer.is_alive():
+            # a reader that never opened the pipe, e.g. a command that
+            # failed, would leave the writer blocked in open(); once it is
+            # open, closing the read end breaks the pipe
+            fd = os.open(fifo, os.O_RDONLY | os.O_NONBLOCK)
+            opened.wait()
+            os.close(fd)
+        writer.join()
+        os.remove(fifo)
+    if errors:
+        raise errors[0]
@@ -0,0 +1,124 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import os
+
+
+AUTO = 'auto'
+
+_CGROUP_ROOT = '/sys/fs/cgroup'
+_PROC_CGROUP = '/proc/self/cgroup'
+_MEMINFO = '/proc/meminfo'
+# cgroup v1 reports "no limit" as a huge page-aligned number
+_NO_LIMIT = 2 ** 60
+
+
+def _read(fp):
+    try:
+        with open(fp) as fh:
+            return fh.read().strip()
+    except OSError:
+        return None
+
+
+def _cgroup_dirs(controller):
+    '''cgroup directories constraining this process for ``controller``
+
+    The process' own cgroup and all its ancestors are returned, as limits
+    set on any of them apply. Both cgroup v1 and v2 (including the
+    "unified" hierarchy of hybrid setups) are covered.
+    '''
+    dirs = []
+    for line in (_read(_PROC_CGROUP) or '').splitlines():
+        _, controllers, path = line.split(':', 2)
+        if not controllers:
+            bases = [_CGROUP_ROOT, os.path.join(_CGROUP_ROOT, 'unified')]
+        elif controller in controllers.split(','):
+            bases = [os.path.join(_CGROUP_ROOT, controllers)]
+        else:
+            continue
+        path = path.strip('/')
+        while True:
+            dirs.extend(os.path.join(base, path) for base in bases)
+            if not path:
+                break
+            path = os.path.dirname(path)
+    return [d for d in dirs if os.path.isdir(d)]
+
+
+def cgroup_cpu_limit():
+    '''CPUs allowed by cgroup CPU quotas, or None if unlimited'''
+    limits = []
+    for d in _cgroup_dirs('cpu'):
+        cpu_max = _read(os.path.join(d, 'cpu.max'))
+        if cpu_max:
+            quota, period = cpu_max.split()[:2]
+            if quota != 'max':
+                limits.append(int(quota) / int(period))
+        quota = _read(os.path.join(d, 'cpu.cfs_quota_us'))
+        period = _read(os.path.join(d, 'cpu.cfs_period_us'))
+        if quota and period and int(quota) > 0:
+            limits.append(int(quota) / int(period))
+    return min(limits) if limits else None
+
+
+def available_cpus():
+    '''CPUs this process may use, given its affinity and cgroup quota'''
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    quota = cgroup_cpu_limit()
+    if quota is not None:
+        # round down so that the quota is never exceeded
+        cpus = min(cpus, int(quota))
+    return max(1, cpus)
+
+
+def available_memory():
+    '''Bytes of memory available, given cgroup limits, or None if unknown'''
+    available = []
+    meminfo = _read(_MEMINFO) or ''
+    for line in meminfo.splitlines():
+        if line.startswith('MemAvailable:'):
+            available.append(int(line.split()[1]) * 1024)
+    for d in _cgroup_dirs('memory'):
+        for limit, usage in [('memory.max', 'memory.current'),
+                             ('memory.limit_in_bytes',
+                              'memory.usage_in_bytes')]:
+            limit = _read(os.path.join(d, limit))
+            if limit and limit != 'max' and int(limit) < _NO_LIMIT:
+                usage = _read(os.path.join(d, usage)) or 0
+                available.append(max(0, int(limit) - int(usage)))
+    return min(available) if available else None
+
+
+def resolve_threads(threads):
+    '''Thread count to use for ``threads``, which may be "auto"'''
+    if threads != AUTO:
+        return threads
+    threads = available_cpus()
+    print('Using %d threads (threads="auto").' % threads)
+    return threads
+
+
+def resolve_workers(workers, tasks, threads, worker_bytes=0):
+    '''Number of concurrent workers for ``tasks``, ``workers`` may be "auto"
+
+    Automatic sizing runs as many workers as there are threads and tasks,
+    as long as each can be given ``worker_bytes`` of memory.
+    '''
+    if workers != AUTO:
+        return max(1, min(workers, tasks))
+    workers = min(tasks, threads)
+    memory = available_memory()
+    if worker_bytes and memory is not None:
+        workers = min(workers, memory // worker_bytes)
+    workers = max(1, workers)
+    print('Using %d workers (workers="auto").' % workers)
+    return workers
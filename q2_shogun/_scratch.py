@@ -0,0 +1,126 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import errno
+import os
+import shutil
+import stat
+import tempfile
+
+
+SCRATCH_ENV = 'Q2_SHOGUN_TMPDIR'
+INDEX_SCRATCH_ENV = 'Q2_SHOGUN_INDEX_TMPDIR'
+
+# a SAM record repeats the read and adds at least as much again in fields,
+# so alignments take at least twice the space of the query FASTA
+SAM_BYTES_PER_QUERY_BYTE = 2
+
+
+def scratch_root(index=False):
+    '''Directory for temporary files
+
+    Intermediates go to ``Q2_SHOGUN_TMPDIR``. Staged databases go to
+    ``Q2_SHOGUN_INDEX_TMPDIR``, e.g. a tmpfs or local SSD, falling back to
+    ``Q2_SHOGUN_TMPDIR``. Without either, the system temporary directory
+    (``TMPDIR``) is used.
+    '''
+    root = (index and os.environ.get(INDEX_SCRATCH_ENV)) or \
+        os.environ.get(SCRATCH_ENV) or tempfile.gettempdir()
+    os.makedirs(root, exist_ok=True)
+    return root
+
+
+def scratch_dir(index=False):
+    '''Temporary directory in the configured scratch location'''
+    return tempfile.TemporaryDirectory(prefix='q2-shogun-',
+                                       dir=scratch_root(index))
+
+
+def path_size(path):
+    '''Size in bytes of a file or directory tree'''
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, name))
+                   for root, _, files in os.walk(path) for name in files)
+    return os.path.getsize(path)
+
+
+def _usage(*roots):
+    '''Bytes of disk taken by the files under ``roots`` alone
+
+    Files are counted once however many of their hardlinks are under
+    ``roots``, and only if all of them are: symlinks and files hardlinked
+    from elsewhere, such as staged artifact files, take no space of their
+    own.
+    '''
+    links, sizes = {}, {}
+    for root in roots:
+        for path, _, files in os.walk(root):
+            for name in files:
+                st = os.lstat(os.path.join(path, name))
+                if stat.S_ISREG(st.st_mode):
+                    inode = st.st_dev, st.st_ino
+                    links[inode] = links.get(inode, 0) + 1
+                    sizes[inode] = st.st_size, st.st_nlink
+    return sum(size for inode, (size, nlink) in sizes.items()
+               if links[inode] == nlink)
+
+
+class Intermediates:
+    '''Delete intermediate files as soon as their last consumer is done
+
+    Files and directories are registered as they are produced and removed
+    once consumed. The space taken under ``roots`` is measured at every
+    step, before anything is removed, so that ``peak`` is the highest
+    scratch usage observed; as intermediates only grow until consumed,
+    this is the peak of the run. Without ``roots`` nothing is measured.
+    '''
+
+    def __init__(self, *roots):
+        self.roots = roots
+        self.peak = 0
+        self._pending = set()
+
+    def observe(self):
+        '''Measure scratch usage now'''
+        self.peak = max(self.peak, _usage(*self.roots))
+
+    def produced(self, *paths):
+        self._pending.update(paths)
+        self.observe()
+
+    def consumed(self, *paths):
+        self.observe()
+        for path in paths:
+            self._pending.remove(path)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+
+
+def copy_bytes(paths, dest):
+    '''Bytes of ``paths`` that cannot be linked into ``dest``
+
+    Hardlinks and reflinks only work within a filesystem, so files on
+    another device will have to be copied.
+    '''
+    dest_dev = os.stat(dest).st_dev
+    return sum(path_size(str(p)) for p in paths
+               if os.stat(str(p)).st_dev != dest_dev)
+
+
+def check_free_space(path, required, purpose):
+    '''Fail early if ``path`` has less than ``required`` bytes free'''
+    free = shutil.disk_usage(path).free
+    if free < required:
+        raise OSError(
+            errno.ENOSPC,
+            'Not enough free space in %s for %s: at least %.1f GiB needed, '
+            '%.1f GiB available. Point %s or %s at a larger volume.' % (
+                path, purpose, required / 2 ** 30, free / 2 ** 30,
+                SCRATCH_ENV, INDEX_SCRATCH_ENV))
@@ -6,98 +6,1228 @@
 # The full license is in the file LICENSE, distributed with this software.
 # ----------------------------------------------------------------------------
 
+import collections
+import concurrent.futures
+import contextlib
+import glob
+import gzip
+import hashlib
+import itertools
+import json
 import os
-import subprocess
-import tempfile
 import shutil
+import subprocess
+import time
 
-import yaml
+# biom, pandas and the q2_types formats annotate the actions, which QIIME 2
+# inspects when the plugin loads; anything only needed to run an action is
+# imported where it is used
 import biom
+import numpy as np
 import pandas as pd
-from qiime2.util import duplicate
 from q2_types.feature_data import DNAFASTAFormat
 
 from q2_types.bowtie2 import Bowtie2IndexDirFmt
 
+from ._align import (bowtie2_build_command, bowtie2_command, bowtie2_index,
+                     bowtie2_partitions, collapse_fasta, concatenate_sam,
+                     expand_sam, index_size, merge_partition_sams,
+                     partition_fasta, split_fasta)
+from ._format import ShogunAlignmentDirFmt, ShogunDatabaseDirFmt
+from ._cache import (DirectoryCache, fingerprint, size_fingerprint,
+                     DATABASE_CACHE_ENV, DATABASE_CACHE_SIZE_ENV,
+                     RESULT_CACHE_ENV, RESULT_CACHE_SIZE_ENV)
+from ._function import (StrainFunctions, functional_tables,
+                        read_shogun_functions)
+from ._instrument import record, report, stage
+from ._lca import (LineageIndex, assign_lca, assign_lca_grid,
+                   taxonomy_fingerprint)
+from ._query import QueryFASTA, is_gzip, query_pipe, query_size
+from ._resources import available_memory, resolve_threads, resolve_workers
+from ._scratch import (check_free_space, copy_bytes, scratch_dir,
+                       Intermediates, INDEX_SCRATCH_ENV,
+                       SAM_BYTES_PER_QUERY_BYTE)
+from ._staging import Stager
+from ._table import merge_tables, read_taxatable
+
+
+FUNCTIONAL_LEVELS = ['kegg', 'module', 'pathway']
+
+# fraction of threads (one in this many) given to native assignment when
+# it runs alongside bowtie2
+STREAMING_ASSIGN_SHARE = 4
+
+# alignments are compressed as fast as bowtie2 writes them, so favour speed
+# over ratio
+ALIGNMENT_COMPRESSION_LEVEL = 1
+
+# metadata key of the fingerprint of a database's taxonomy
+_TAXONOMY_SOURCE = 'taxonomy_fingerprint'
+
+_FUNCTIONAL_SUFFIXES = {'kegg': '.strain.kegg.txt',
+                        'module': '.strain.kegg.modules.txt',
+                        'pathway': '.strain.kegg.pathways.txt'}
+
+
+def _announce_command(cmd):
+    print("Running external command line application. This may print "
+          "messages to stdout and/or stderr.")
+    print("The command being run is below. This command cannot "
+          "be manually re-run as it will depend on temporary files that "
+          "no longer exist.")
+    print("\nCommand:", end=' ')
+    print(" ".join(cmd), end='\n\n')
+
 
 def _run_command(cmd, verbose=True):
     if verbose:
-        print("Running external command line application. This may print "
-              "messages to stdout and/or stderr.")
-        print("The command being run is below. This command cannot "
-              "be manually re-run as it will depend on temporary files that "
-              "no longer exist.")
-        print("\nCommand:", end=' ')
-        print(" ".join(cmd), end='\n\n')
+        _announce_command(cmd)
     subprocess.run(cmd, check=True)
 
 
-def setup_database_dir(tmpdir, database, refseqs, reftaxa):
+def _run_concurrently(cmds, verbose=True, poll_interval=0.5):
+    '''Run commands side by side, e.g. both ends of a named pipe
+
+    If any command fails the others are killed, since a process blocked on
+    a pipe whose other end died would otherwise never exit.
+    '''
+    procs = []
+    try:
+        for cmd in cmds:
+            if verbose:
+                _announce_command(cmd)
+            procs.append(subprocess.Popen(cmd))
+        while True:
+            codes = [proc.poll() for proc in procs]
+            for cmd, code in zip(cmds, codes):
+                if code:
+                    raise subprocess.CalledProcessError(code, cmd)
+            if all(code == 0 for code in codes):
+                return
+            time.sleep(poll_interval)
+    finally:
+        for proc in procs:
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+
+
+def setup_database_dir(tmpdir, database, refseqs, reftaxa,
+                       allow_symlink=True, taxonomy=True,
+                       taxonomy_source=None):
+    '''Stage reference inputs as a SHOGUN database in ``tmpdir``
+
+    Without ``taxonomy`` the taxonomy file is left empty, for runs whose
+    taxonomy is assigned in-process rather than by SHOGUN.
+    ``taxonomy_source`` is recorded in the metadata, see
+    ``write_database_metadata``.
+    '''
     BOWTIE_PATH = 'bowtie2'
-    duplicate(str(refseqs), os.path.join(tmpdir, 'refseqs.fna'))
-    reftaxa.to_csv(os.path.join(tmpdir, 'taxa.tsv'), sep='\t')
-    shutil.copytree(str(database), os.path.join(tmpdir, BOWTIE_PATH),
-                    copy_function=duplicate)
+    stager = Stager(allow_symlink=allow_symlink)
+    with stage('stage-database'):
+        stager.stage(str(refseqs), os.path.join(tmpdir, 'refseqs.fna'))
+        if taxonomy:
+            reftaxa.to_csv(os.path.join(tmpdir, 'taxa.tsv'), sep='\t')
+        else:
+            open(os.path.join(tmpdir, 'taxa.tsv'), 'w').close()
+        stager.stage_tree(str(database), os.path.join(tmpdir, BOWTIE_PATH))
+    print('Staged reference database files: %s.' % stager.summary())
+    write_database_metadata(
+        tmpdir, [os.path.join(BOWTIE_PATH, database.get_basename())],
+        taxonomy_source)
+
+
+def write_database_metadata(dbdir, indexes, taxonomy_source=None):
+    '''Write the metadata.yaml of a SHOGUN database
+
+    A database with several bowtie2 indexes lists them as partitions;
+    SHOGUN itself only knows databases with a single index.
+    ``taxonomy_source``, the ``taxonomy_fingerprint`` of the taxonomy, is
+    kept for checking taxonomy indexes against, as SHOGUN ignores keys it
+    does not know.
+    '''
+    import yaml
+
     params = {
         'general': {
             'taxonomy': 'taxa.tsv',
             'fasta': 'refseqs.fna'
-        },
-        'bowtie2': os.path.join(BOWTIE_PATH, database.get_basename())
+        }
     }
-    with open(os.path.join(tmpdir, 'metadata.yaml'), 'w') as fh:
+    if len(indexes) == 1:
+        params['bowtie2'], = indexes
+    else:
+        params['bowtie2_partitions'] = list(indexes)
+    if taxonomy_source is not None:
+        params[_TAXONOMY_SOURCE] = taxonomy_source
+    with open(os.path.join(dbdir, 'metadata.yaml'), 'w') as fh:
         yaml.dump(params, fh, default_flow_style=False)
 
 
+def setup_taxonomy_dir(dbdir, reftaxa):
+    '''Stage the part of a SHOGUN database that taxonomy assignment reads'''
+    import yaml
+
+    os.mkdir(dbdir)
+    reftaxa.to_csv(os.path.join(dbdir, 'taxa.tsv'), sep='\t')
+    with open(os.path.join(dbdir, 'metadata.yaml'), 'w') as fh:
+        yaml.dump({'general': {'taxonomy': 'taxa.tsv'}}, fh,
+                  default_flow_style=False)
+    return dbdir
+
+
+def _reference_extra(database, reftaxa):
+    taxa_hash = pd.util.hash_pandas_object(reftaxa, index=True)
+    return [database.get_basename(), taxa_hash.values.tobytes()]
+
+
+def reference_fingerprint(database, refseqs, reftaxa):
+    '''Content fingerprint of the reference inputs'''
+    return fingerprint(database, refseqs,
+                       extra=_reference_extra(database, reftaxa))
+
+
+def read_taxonomy_source(dbdir):
+    '''Taxonomy fingerprint recorded in a database's metadata, or None'''
+    import yaml
+
+    with open(os.path.join(dbdir, 'metadata.yaml')) as fh:
+        return yaml.safe_load(fh).get(_TAXONOMY_SOURCE)
+
+
+def read_database_taxonomy(dbdir):
+    '''Reference taxonomy of a SHOGUN database directory'''
+    import yaml
+
+    with open(os.path.join(dbdir, 'metadata.yaml')) as fh:
+        fp = os.path.join(dbdir, yaml.safe_load(fh)['general']['taxonomy'])
+    taxonomy = pd.read_csv(fp, sep='\t', header=None, index_col=0,
+                           dtype=str)[1]
+    # databases staged by this plugin have a header, SHOGUN's do not
+    if len(taxonomy) and taxonomy.iloc[0] == 'Taxon':
+        taxonomy = taxonomy.iloc[1:]
+    taxonomy.index.name, taxonomy.name = 'Feature ID', 'Taxon'
+    return taxonomy
+
+
+def profile_signature(reference, taxacut, percent_id, assigner):
+    '''Identify the reference and parameters a taxa table depends on
+
+    The signature is stored as the ID of tables produced by nobunaga, so
+    that samples are only ever appended to a table profiled the same way.
+    ``reference`` is the cheap signature of the reference, see
+    ``Reference.signature``, as hashing its full content on every run
+    would cost as much as staging it.
+    SHOGUN's assigner ignores ``taxacut``. It keeps every hit bowtie2
+    reports, whose identity threshold is ``percent_id`` rounded to two
+    decimals, while the native assigner filters at ``percent_id`` itself,
+    so the two never share a signature.
+    '''
+    if assigner == 'shogun':
+        taxacut = 1.0
+    params = json.dumps({'reference': reference, 'taxacut': taxacut,
+                         'percent_id': percent_id, 'assigner': assigner},
+                        sort_keys=True)
+    return 'q2-shogun:' + hashlib.sha256(params.encode()).hexdigest()
+
+
+def _database_cache():
+    return DirectoryCache.from_environment(DATABASE_CACHE_ENV,
+                                           DATABASE_CACHE_SIZE_ENV)
+
+
+@contextlib.contextmanager
+def database_dir(database, refseqs, reftaxa, key=None, taxonomy=True):
+    '''Yield a SHOGUN database directory for the reference inputs
+
+    When ``Q2_SHOGUN_DATABASE_CACHE`` names a directory, staged databases
+    are kept there between runs (bounded by
+    ``Q2_SHOGUN_DATABASE_CACHE_SIZE``, if set) and reused whenever the same
+    reference is supplied again. Otherwise the database is staged in a
+    temporary directory under ``Q2_SHOGUN_INDEX_TMPDIR``, where it is
+    copied rather than symlinked, as it is only put there to be read from
+    that volume. ``key`` is the reference fingerprint, if already known.
+    Without ``taxonomy``, a temporary database leaves out the taxonomy;
+    cached databases are shared, so they always include it.
+    '''
+    cache = _database_cache()
+    if cache is None:
+        on_index_volume = bool(os.environ.get(INDEX_SCRATCH_ENV))
+        with scratch_dir(index=True) as path:
+            if on_index_volume:
+                check_free_space(path, copy_bytes([database, refseqs], path),
+                                 'the staged reference database')
+            setup_database_dir(path, database, refseqs, reftaxa,
+                               allow_symlink=not on_index_volume,
+                               taxonomy=taxonomy)
+            yield path
+        return
+
+    def _stage(path):
+        # cached entries outlive the artifacts they were staged from, so
+        # they must not point back into them
+        check_free_space(path, copy_bytes([database, refseqs], path),
+                         'the cached reference database')
+        setup_database_dir(path, database, refseqs, reftaxa,
+                           allow_symlink=False)
+
+    if key is None:
+        with stage('fingerprint-database'):
+            key = reference_fingerprint(database, refseqs, reftaxa)
+    with cache.acquire(key, _stage) as path:
+        yield path
+
+
+def _either(separate, shogun_database):
+    '''Require either a SHOGUN database or all of the separate inputs'''
+    given = [value is not None for value in separate.values()]
+    if any(given) if shogun_database is not None else not all(given):
+        raise ValueError('Provide either shogun_database or all of %s, '
+                         'but not both.' % ', '.join(separate))
+
+
+class Reference:
+    '''Reference inputs of an action
+
+    Either a prebuilt SHOGUN database, which already has the layout SHOGUN
+    expects and is used in place, or reference reads, taxonomy and a
+    bowtie2 index, which are staged into one for every run.
+    '''
+
+    def __init__(self, reference_reads=None, reference_taxonomy=None,
+                 database=None, shogun_database=None):
+        _either({'reference_reads': reference_reads,
+                 'reference_taxonomy': reference_taxonomy,
+                 'database': database}, shogun_database)
+        self.reads = reference_reads
+        self._taxonomy = reference_taxonomy
+        self.database = database
+        self.shogun_database = shogun_database
+        self._fingerprint = None
+        self._signature = None
+        self._taxonomy_source = None
+
+    @property
+    def taxonomy(self):
+        if self._taxonomy is None:
+            self._taxonomy = read_database_taxonomy(
+                str(self.shogun_database))
+        return self._taxonomy
+
+    def fingerprint(self):
+        '''Content fingerprint of the reference'''
+        if self._fingerprint is None:
+            with stage('fingerprint-database'):
+                if self.shogun_database is not None:
+                    self._fingerprint = fingerprint(self.shogun_database)
+                else:
+                    self._fingerprint = reference_fingerprint(
+                        self.database, self.reads, self._taxonomy)
+        return self._fingerprint
+
+    def taxonomy_source(self):
+        '''``taxonomy_fingerprint`` of the reference taxonomy
+
+        Databases built by this plugin record it, so their taxonomy need
+        not be read.
+        '''
+        if self._taxonomy_source is None:
+            if self.shogun_database is not None:
+                self._taxonomy_source = read_taxonomy_source(
+                    str(self.shogun_database))
+            if self._taxonomy_source is None:
+                self._taxonomy_source = taxonomy_fingerprint(self.taxonomy)
+        return self._taxonomy_source
+
+    def signature(self):
+        '''Cheap signature of the reference, which reads no index content
+
+        The names and sizes of the reference files, and the taxonomy, which
+        is small; of a SHOGUN database, its metadata rather than taxonomy.
+        '''
+        if self._signature is None:
+            if self.shogun_database is not None:
+                with open(os.path.join(str(self.shogun_database),
+                                       'metadata.yaml')) as fh:
+                    metadata = fh.read()
+                self._signature = size_fingerprint(self.shogun_database,
+                                                   extra=[metadata])
+            else:
+                self._signature = size_fingerprint(
+                    self.database, self.reads,
+                    extra=[self.database.get_basename(),
+                           self.taxonomy_source()])
+        return self._signature
+
+    def bowtie2_index(self):
+        '''Prefix of the bowtie2 index, which bowtie2 can read in place'''
+        if self.shogun_database is not None:
+            return bowtie2_index(str(self.shogun_database))
+        return os.path.join(str(self.database), self.database.get_basename())
+
+    def partitions(self):
+        '''Prefixes of the bowtie2 indexes of the reference partitions'''
+        if self.shogun_database is not None:
+            return bowtie2_partitions(str(self.shogun_database))
+        return [self.bowtie2_index()]
+
+    def index_bytes(self):
+        '''Size of the bowtie2 index, i.e. the memory an aligner needs'''
+        return index_size(self.bowtie2_index())
+
+    @property
+    def temporary(self):
+        '''Whether ``directory`` stages the reference for this run alone'''
+        return self.shogun_database is None and _database_cache() is None
+
+    @contextlib.contextmanager
+    def directory(self, taxonomy=True):
+        '''Yield a SHOGUN database directory of the reference
+
+        Without ``taxonomy``, SHOGUN will not be asked to assign taxonomy,
+        so the taxonomy need not be staged.
+        '''
+        if self.shogun_database is not None:
+            yield str(self.shogun_database)
+            return
+        with database_dir(self.database, self.reads, self._taxonomy,
+                          key=self._fingerprint, taxonomy=taxonomy) as path:
+            yield path
+
+
 def load_table(tab_fp):
     '''Convert classic OTU table to biom feature table'''
-    with open(tab_fp, 'r') as tab:
-        return biom.table.Table.from_tsv(tab, None, None, None)
+    with stage('load-table'):
+        return read_taxatable(tab_fp)
+
+
+def check_alignment_space(tmpdir, *queries, alignments=1, query_copies=0):
+    '''Fail before aligning if scratch cannot hold the alignments
+
+    ``alignments`` is the number of full-size SAM files of the queries that
+    exist at once, and ``query_copies`` the number of uncompressed copies
+    of the queries written alongside them.
+    '''
+    required = (SAM_BYTES_PER_QUERY_BYTE * alignments + query_copies) * sum(
+        query_size(query) for query in queries)
+    check_free_space(tmpdir, required, 'alignments')
+
+
+def align_query(query, dbdir, outdir, taxacut, threads, percent_id,
+                shards=1, intermediates=None):
+    '''Align query sequences with ``shogun align``, returning the SAM path
+
+    With ``shards`` > 1 the query is split into that many parts that are
+    aligned by concurrent ``shogun align`` processes sharing the ``threads``
+    budget, and their alignments are concatenated. A compressed query is
+    decompressed through a pipe and cannot be split. The shards are
+    registered with ``intermediates``, if given, so that it observes them.
+    '''
+    if intermediates is None:
+        intermediates = Intermediates()
+
+    def _align(query_fp, out):
+        cmd = ['shogun', 'align', '-i', str(query_fp), '-d', dbdir,
+               '-o', out, '-a', 'bowtie2', '-x', str(taxacut),
+               '-t', str(max(1, threads // shards)), '-p', str(percent_id)]
+        with stage('align'):
+            _run_command(cmd)
+        return os.path.join(out, 'alignment.bowtie2.sam')
+
+    if shards == 1:
+        with query_pipe(query, outdir, threads) as query_fp:
+            return _align(query_fp, outdir)
+
+    shard_dir = os.path.join(outdir, 'shards')
+    os.mkdir(shard_dir)
+    outs = []
+    with stage('split-query'):
+        shard_fps = split_fasta(str(query), shards, shard_dir)
+    intermediates.produced(shard_dir)
+    for i, fp in enumerate(shard_fps):
+        outs.append((fp, os.path.join(shard_dir, str(i))))
+        os.mkdir(outs[-1][1])
+    with concurrent.futures.ThreadPoolExecutor(len(outs)) as pool:
+        sams = list(pool.map(lambda args: _align(*args), outs))
+    with stage('concatenate-alignments'):
+        sam = concatenate_sam(
+            sams, os.path.join(outdir, 'alignment.bowtie2.sam'))
+    # the shard SAMs and the concatenated one all exist now
+    intermediates.observe()
+    intermediates.consumed(shard_dir)
+    return sam
+
+
+def align_partitions(query, indexes, outdir, threads, percent_id,
+                     intermediates=None):
+    '''Align query sequences against reference partitions, merging hits
+
+    Each partition is aligned as ``shogun align`` would, and the best hits
+    of every read across partitions are kept as if a single index had been
+    searched. As many partitions are aligned at a time as available memory
+    holds indexes of, sharing ``threads``; if available memory is unknown
+    they are aligned one at a time. Returns the path of the merged SAM.
+    The partition SAMs are registered with ``intermediates``, if given.
+    '''
+    if intermediates is None:
+        intermediates = Intermediates()
+    memory = available_memory()
+    at_once = 1
+    if memory is not None:
+        largest = max(index_size(index) for index in indexes)
+        at_once = max(1, min(len(indexes), threads, memory // largest))
+    print('Aligning against %d of %d reference partitions at a time.' % (
+        at_once, len(indexes)))
+    sams = [os.path.join(outdir, 'partition-%d.sam' % i)
+            for i in range(len(indexes))]
+
+    def _align(i):
+        # each partition reads the query from a pipe of its own
+        with query_pipe(query, outdir, name='query-%d.fna' % i) as query_fp:
+            cmd = bowtie2_command(indexes[i], query_fp, sams[i],
+                                  max(1, threads // at_once), percent_id,
+                                  all_reads=True)
+            with stage('align-partition-%d' % i):
+                _run_command(cmd)
+
+    with concurrent.futures.ThreadPoolExecutor(at_once) as pool:
+        list(pool.map(_align, range(len(indexes))))
+    intermediates.produced(*sams)
+    sam = os.path.join(outdir, 'alignment.bowtie2.sam')
+    with stage('merge-alignments'):
+        merge_partition_sams(sams, sam)
+    # the partition SAMs and the merged one all exist now
+    intermediates.observe()
+    intermediates.consumed(*sams)
+    return sam
+
+
+def run_assign_taxonomy(sam, dbdir, outdir):
+    '''Run ``shogun assign_taxonomy`` on a SAM file, returning the TSV'''
+    taxatable = os.path.join(outdir, 'taxatable.tsv')
+    cmd = ['shogun', 'assign_taxonomy', '-i', sam, '-d', dbdir,
+           '-o', taxatable, '-a', 'bowtie2']
+    with stage('assign-taxonomy'):
+        _run_command(cmd)
+    return taxatable
+
+
+def assign_taxonomy(sam, dbdir, outdir):
+    '''Run ``shogun assign_taxonomy`` on a SAM file, returning the table'''
+    return load_table(run_assign_taxonomy(sam, dbdir, outdir))
+
+
+def assign_native(lines, index, taxacut, percent_id, threads,
+                  members=None):
+    '''Assign taxonomy in-process with the native LCA engine'''
+    with stage('assign-native'):
+        return assign_lca(lines, index, taxacut=taxacut,
+                          percent_id=percent_id, workers=threads,
+                          members=members)
+
+
+def collapse_query(query, outdir, threads=1):
+    '''Write the distinct sequences of a query for alignment
 
+    Returns the path of the collapsed query and the per-sample counts of
+    the reads behind each of its sequences.
+    '''
+    collapsed = os.path.join(outdir, 'unique.fna')
+    with stage('collapse-duplicates'), \
+            query_pipe(query, outdir, threads) as query_fp:
+        members = collapse_fasta(query_fp, collapsed)
+    reads = sum(n for counts in members.values() for n in counts.values())
+    print('Aligning %d unique of %d query sequences.' % (len(members), reads))
+    return collapsed, members
 
-def nobunaga(query: DNAFASTAFormat, reference_reads: DNAFASTAFormat,
-             reference_taxonomy: pd.Series, database: Bowtie2IndexDirFmt,
+
+def expand_alignments(sam, members, outdir):
+    '''Alignments of every read from those of collapsed reads'''
+    with stage('expand-alignments'):
+        return expand_sam(sam, members,
+                          os.path.join(outdir, 'alignment.expanded.sam'))
+
+
+def align_and_assign_streaming(query, dbdir, outdir, threads, percent_id):
+    '''Align and assign taxonomy with no SAM file written to disk
+
+    bowtie2 writes its alignments into a named pipe that ``shogun
+    assign_taxonomy`` consumes while the alignment is still running.
+    '''
+    sam = os.path.join(outdir, 'alignment.bowtie2.sam')
+    os.mkfifo(sam)
+    taxatable = os.path.join(outdir, 'taxatable.tsv')
+    with stage('align-and-assign'), \
+            query_pipe(query, outdir, threads) as query_fp:
+        _run_concurrently([
+            bowtie2_command(bowtie2_index(dbdir), query_fp, sam, threads,
+                            percent_id),
+            ['shogun', 'assign_taxonomy', '-i', sam, '-d', dbdir,
+             '-o', taxatable, '-a', 'bowtie2']])
+    return load_table(taxatable)
+
+
+def align_compressed(query, index, out_fp, threads, percent_id):
+    '''Align with bowtie2, gzipping the alignments as they are written'''
+    cmd = bowtie2_command(index, str(query), None, threads, percent_id)
+    _announce_command(cmd)
+    with stage('align'), \
+            subprocess.Popen(cmd, stdout=subprocess.PIPE) as proc, \
+            gzip.open(out_fp, 'wb',
+                      compresslevel=ALIGNMENT_COMPRESSION_LEVEL) as out:
+        try:
+            shutil.copyfileobj(proc.stdout, out)
+        except BaseException:
+            proc.kill()
+            raise
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+
+
+def _alignment_fp(alignment):
+    return str(alignment.path / 'alignment.sam.gz')
+
+
+def decompress_alignment(alignment, outdir):
+    '''Write the SAM file of an alignment artifact to ``outdir``'''
+    sam = os.path.join(outdir, 'alignment.bowtie2.sam')
+    with stage('decompress-alignment'), \
+            gzip.open(_alignment_fp(alignment), 'rb') as src, \
+            open(sam, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    return sam
+
+
+def align_and_assign_native_streaming(query, dbdir, outdir, index, taxacut,
+                                      threads, percent_id, members=None):
+    '''Assign taxonomy in-process from bowtie2's stdout as it aligns
+
+    bowtie2 and the assigner run side by side and share ``threads``; as
+    alignment dominates, the assigner gets a quarter of them.
+    '''
+    workers = max(1, threads // STREAMING_ASSIGN_SHARE)
+    with query_pipe(query, outdir, threads) as query_fp:
+        cmd = bowtie2_command(bowtie2_index(dbdir), query_fp, None,
+                              max(1, threads - workers), percent_id)
+        _announce_command(cmd)
+        with stage('align-and-assign'), \
+                subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                 text=True) as proc:
+            try:
+                table = assign_native(proc.stdout, index, taxacut,
+                                      percent_id, workers, members)
+            except BaseException:
+                proc.kill()
+                raise
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+    return table
+
+
+def tool_versions():
+    '''Versions of SHOGUN and bowtie2, which results depend on'''
+    versions = []
+    for tool in ('shogun', 'bowtie2'):
+        try:
+            out = subprocess.run([tool, '--version'], capture_output=True,
+                                 text=True).stdout
+        except FileNotFoundError:
+            out = ''
+        lines = out.strip().splitlines()
+        # bowtie2 prefixes its version with the path of its binary
+        versions.append('%s %s' % (tool, lines[0].rsplit('version', 1)[-1]
+                                   .strip() if lines else 'unavailable'))
+    return versions
+
+
+def _write_tables(path, tables):
+    # HDF5 keeps the table ID, and with it the profile signature
+    for i, table in enumerate(tables):
+        with biom.util.biom_open(os.path.join(path, '%d.biom' % i),
+                                 'w') as fh:
+            table.to_hdf5(fh, 'q2-shogun')
+
+
+def _read_tables(path):
+    count = len(glob.glob(os.path.join(path, '*.biom')))
+    return tuple(biom.load_table(os.path.join(path, '%d.biom' % i))
+                 for i in range(count))
+
+
+def memoize(action, compute, query, reference, parameters,
+            taxonomy_index=None):
+    '''Tables returned by ``compute()``, or those of an identical earlier run
+
+    When ``Q2_SHOGUN_RESULT_CACHE`` names a directory, results are kept
+    there (bounded by ``Q2_SHOGUN_RESULT_CACHE_SIZE``, if set), keyed by
+    the full content of the query and reference, ``parameters`` and the
+    SHOGUN and bowtie2 versions. A run identical to one in progress waits
+    for it and then reuses its results. ``compute`` returns a tuple of
+    tables.
+    '''
+    cache = DirectoryCache.from_environment(RESULT_CACHE_ENV,
+                                            RESULT_CACHE_SIZE_ENV)
+    if cache is None:
+        return compute()
+    with stage('fingerprint-inputs'):
+        # the reference fingerprint covers every byte of the reference, as
+        # results must never be reused for a different one
+        extra = [action, json.dumps(parameters, sort_keys=True),
+                 reference.fingerprint()] + tool_versions()
+        if taxonomy_index is not None:
+            extra += ['\n'.join(map(str, taxonomy_index.labels)),
+                      '\n'.join(map(str, taxonomy_index.ids)),
+                      np.ascontiguousarray(taxonomy_index.lineages).tobytes()]
+        key = fingerprint(str(query), extra=extra)
+    computed = []
+
+    def _build(path):
+        computed.append(compute())
+        with stage('store-results'):
+            _write_tables(path, computed[0])
+
+    with cache.acquire(key, _build) as path:
+        if computed:
+            return computed[0]
+        print('Reusing the results of an identical earlier run.')
+        with stage('load-results'):
+            return _read_tables(path)
+
+
+def _taxonomy_index(assigner, taxonomy_index, taxonomy, source):
+    # ``taxonomy`` and its fingerprint ``source`` are callables, as a bundled
+    # taxonomy is only read if needed
+    if taxonomy_index is not None and assigner != 'native':
+        raise ValueError('A taxonomy index is only used by the native '
+                         'assigner; set assigner to "native" to use it.')
+    if assigner != 'native':
+        return None
+    if taxonomy_index is None:
+        return LineageIndex.from_taxonomy(taxonomy())
+    # references missing from the index would be silently dropped
+    with stage('check-taxonomy-index'):
+        matches = taxonomy_index.source == source()
+    if not matches:
+        raise ValueError('The taxonomy index was not compiled from the '
+                         'reference taxonomy, or by an older version of '
+                         'this plugin. Compile it again with '
+                         'compile-taxonomy from the reference taxonomy.')
+    return taxonomy_index
+
+
+def _nobunaga(query, reference, taxacut, threads, percent_id, shards,
+              streaming, assigner, taxonomy_index, collapse_duplicates):
+    if streaming and shards > 1:
+        raise ValueError('Streaming alignments cannot be combined with '
+                         'sharded alignment (shards > 1).')
+    if streaming and collapse_duplicates and assigner != 'native':
+        raise ValueError('Collapsing duplicate reads can only be combined '
+                         'with streaming alignments when using the native '
+                         'assigner.')
+    if shards > 1 and is_gzip(query):
+        raise ValueError('A compressed query cannot be split into shards, '
+                         'as that would write it out uncompressed.')
+    partitions = reference.partitions()
+    if len(partitions) > 1 and (streaming or shards > 1):
+        raise ValueError('A partitioned reference database cannot be '
+                         'combined with streaming or sharded alignment.')
+    taxonomy_index = _taxonomy_index(assigner, taxonomy_index,
+                                     lambda: reference.taxonomy,
+                                     reference.taxonomy_source)
+
+    with scratch_dir() as tmpdir, \
+            reference.directory(taxonomy=assigner != 'native') as dbdir:
+        intermediates = Intermediates(
+            tmpdir, *([dbdir] if reference.temporary else []))
+
+        if not streaming:
+            if len(partitions) > 1:
+                # one all-reads SAM per partition, and the merged one
+                check_alignment_space(tmpdir, query,
+                                      alignments=len(partitions) + 1)
+            elif shards > 1:
+                # shard FASTAs and SAMs, and the concatenated SAM
+                check_alignment_space(tmpdir, query, alignments=2,
+                                      query_copies=1)
+            else:
+                check_alignment_space(tmpdir, query)
+        members = None
+        # files only read by the aligner
+        aligner_inputs = []
+        if collapse_duplicates:
+            query, members = collapse_query(query, tmpdir, threads)
+            aligner_inputs.append(query)
+        if streaming:
+            intermediates.produced(*aligner_inputs)
+            if assigner == 'native':
+                table = align_and_assign_native_streaming(
+                    query, dbdir, tmpdir, taxonomy_index, taxacut, threads,
+                    percent_id, members)
+            else:
+                table = align_and_assign_streaming(query, dbdir, tmpdir,
+                                                   threads, percent_id)
+            intermediates.consumed(*aligner_inputs)
+        else:
+            table = _align_and_assign(query, reference, dbdir, tmpdir,
+                                      intermediates, aligner_inputs,
+                                      partitions, taxacut, threads,
+                                      percent_id, shards, assigner,
+                                      taxonomy_index, members)
+        print('Peak scratch usage: %.2f GiB.' % (intermediates.peak / 2 ** 30))
+        record(peak_scratch_bytes=intermediates.peak)
+        return table
+
+
+def _align_and_assign(query, reference, dbdir, tmpdir, intermediates,
+                      aligner_inputs, partitions, taxacut, threads,
+                      percent_id, shards, assigner, taxonomy_index, members):
+    if reference.temporary:
+        # taxonomy assignment only reads the staged taxonomy
+        aligner_inputs += [os.path.join(dbdir, 'bowtie2'),
+                           os.path.join(dbdir, 'refseqs.fna')]
+    intermediates.produced(*aligner_inputs)
+
+    # run aligner
+    if len(partitions) > 1:
+        sam = align_partitions(query, partitions, tmpdir, threads,
+                               percent_id, intermediates)
+    else:
+        sam = align_query(query, dbdir, tmpdir, taxacut, threads,
+                          percent_id, shards, intermediates)
+    intermediates.produced(sam)
+    intermediates.consumed(*aligner_inputs)
+
+    # assign taxonomy and output taxatable as feature table
+    if assigner == 'native':
+        with open(sam) as fh:
+            table = assign_native(fh, taxonomy_index, taxacut,
+                                  percent_id, threads, members)
+        intermediates.consumed(sam)
+        return table
+    if members is not None:
+        expanded = expand_alignments(sam, members, tmpdir)
+        intermediates.produced(expanded)
+        intermediates.consumed(sam)
+        sam = expanded
+    taxatable = run_assign_taxonomy(sam, dbdir, tmpdir)
+    intermediates.produced(taxatable)
+    intermediates.consumed(sam)
+    table = load_table(taxatable)
+    intermediates.consumed(taxatable)
+    return table
+
+
+def nobunaga(query: QueryFASTA, reference_reads: DNAFASTAFormat = None,
+             reference_taxonomy: pd.Series = None,
+             database: Bowtie2IndexDirFmt = None,
              taxacut: float = 0.8,
-             threads: int = 1, percent_id: float = 0.98) -> biom.Table:
-    with tempfile.TemporaryDirectory() as tmpdir:
-        setup_database_dir(tmpdir,
-                           database, reference_reads, reference_taxonomy)
-
-        # run aligner
-        cmd = ['shogun', 'align', '-i', str(query), '-d', tmpdir,
-               '-o', tmpdir, '-a', 'bowtie2', '-x', str(taxacut),
-               '-t', str(threads), '-p', str(percent_id)]
+             threads: int = 1, percent_id: float = 0.98,
+             shards: int = 1, streaming: bool = False,
+             assigner: str = 'shogun',
+             taxonomy_index: LineageIndex = None,
+             collapse_duplicates: bool = False,
+             shogun_database: ShogunDatabaseDirFmt = None) -> biom.Table:
+    reference = Reference(reference_reads, reference_taxonomy, database,
+                          shogun_database)
+    threads = resolve_threads(threads)
+    with report('nobunaga', taxacut=taxacut, threads=threads,
+                percent_id=percent_id, shards=shards, streaming=streaming,
+                assigner=assigner, collapse_duplicates=collapse_duplicates):
+        def _profile():
+            table = _nobunaga(query, reference, taxacut, threads,
+                              percent_id, shards, streaming, assigner,
+                              taxonomy_index, collapse_duplicates)
+            table.table_id = profile_signature(reference.signature(),
+                                               taxacut, percent_id, assigner)
+            return (table,)
+
+        table, = memoize('nobunaga', _profile, query, reference, {
+            'taxacut': taxacut, 'percent_id': percent_id, 'shards': shards,
+            'streaming': streaming, 'assigner': assigner,
+            'collapse_duplicates': collapse_duplicates}, taxonomy_index)
+        return table
+
+
+def _query_samples(query):
+    '''Sample IDs of the reads in a FASTA file'''
+    with open(str(query)) as fh:
+        return {line[1:].split(None, 1)[0].rsplit('_', 1)[0]
+                for line in fh if line.startswith('>')}
+
+
+def nobunaga_append(table: biom.Table, query: DNAFASTAFormat,
+                    reference_reads: DNAFASTAFormat = None,
+                    reference_taxonomy: pd.Series = None,
+                    database: Bowtie2IndexDirFmt = None,
+                    taxacut: float = 0.8,
+                    threads: int = 1, percent_id: float = 0.98,
+                    shards: int = 1, streaming: bool = False,
+                    assigner: str = 'shogun',
+                    taxonomy_index: LineageIndex = None,
+                    collapse_duplicates: bool = False,
+                    shogun_database: ShogunDatabaseDirFmt = None
+                    ) -> biom.Table:
+    reference = Reference(reference_reads, reference_taxonomy, database,
+                          shogun_database)
+    threads = resolve_threads(threads)
+    with report('nobunaga_append', taxacut=taxacut, threads=threads,
+                percent_id=percent_id, shards=shards, streaming=streaming,
+                assigner=assigner, collapse_duplicates=collapse_duplicates,
+                samples=len(table.ids())):
+        signature = profile_signature(reference.signature(), taxacut,
+                                      percent_id, assigner)
+        if table.table_id != signature:
+            raise ValueError(
+                'The existing table was not profiled by nobunaga against '
+                'the same reference with the same taxacut, percent_id and '
+                'assigner. Profile all samples with nobunaga instead.')
+        with stage('check-samples'):
+            repeated = _query_samples(query) & set(table.ids())
+        if repeated:
+            raise ValueError('Samples are already present in the existing '
+                             'table: %s' % ', '.join(sorted(repeated)))
+
+        new = _nobunaga(query, reference, taxacut, threads, percent_id,
+                        shards, streaming, assigner, taxonomy_index,
+                        collapse_duplicates)
+        with stage('merge-tables'):
+            merged = merge_tables([table, new])
+        merged.table_id = signature
+        return merged
+
+
+def _sweep_key(taxacut, percent_id):
+    return 'taxacut-%g_percent-id-%g' % (taxacut, percent_id)
+
+
+def _check_sweep_values(name, values):
+    if not values:
+        raise ValueError('Provide at least one value of %s to sweep.' % name)
+    invalid = [value for value in values if not 0 < value <= 1]
+    if invalid:
+        raise ValueError('Values of %s must be greater than 0 and at most 1, '
+                         'not %s.' % (name, ', '.join(map(str, invalid))))
+
+
+def nobunaga_sweep(query: DNAFASTAFormat, taxacuts: list, percent_ids: list,
+                   reference_reads: DNAFASTAFormat = None,
+                   reference_taxonomy: pd.Series = None,
+                   database: Bowtie2IndexDirFmt = None, threads: int = 1,
+                   taxonomy_index: LineageIndex = None,
+                   shogun_database: ShogunDatabaseDirFmt = None) -> dict:
+    _check_sweep_values('taxacuts', taxacuts)
+    _check_sweep_values('percent_ids', percent_ids)
+    reference = Reference(reference_reads, reference_taxonomy, database,
+                          shogun_database)
+    threads = resolve_threads(threads)
+    grid = sorted(set(itertools.product(taxacuts, percent_ids)))
+    keys = [_sweep_key(*point) for point in grid]
+    if len(set(keys)) < len(keys):
+        raise ValueError('Values of taxacuts or percent_ids are too close '
+                         'to tell apart in the names of the output tables; '
+                         'use values that differ in their first six '
+                         'significant digits.')
+    with report('nobunaga_sweep', taxacuts=list(taxacuts),
+                percent_ids=list(percent_ids), threads=threads):
+        taxonomy_index = _taxonomy_index('native', taxonomy_index,
+                                         lambda: reference.taxonomy,
+                                         reference.taxonomy_source)
+        partitions = reference.partitions()
+        # hits of stricter grid points are a subset of the loosest's
+        loosest = min(percent_ids)
+        with scratch_dir() as tmpdir:
+            check_alignment_space(tmpdir, query, alignments=len(partitions) +
+                                  (len(partitions) > 1))
+            if len(partitions) > 1:
+                sam = align_partitions(query, partitions, tmpdir, threads,
+                                       loosest)
+            else:
+                sam = os.path.join(tmpdir, 'alignment.bowtie2.sam')
+                with stage('align'):
+                    _run_command(bowtie2_command(partitions[0], str(query),
+                                                 sam, threads, loosest))
+            with open(sam) as fh, stage('assign-native'):
+                tables = assign_lca_grid(fh, taxonomy_index, grid,
+                                         workers=threads)
+        reference_id = reference.signature()
+        for (taxacut, percent_id), table in zip(grid, tables):
+            table.table_id = profile_signature(reference_id, taxacut,
+                                               percent_id, 'native')
+        return dict(zip(keys, tables))
+
+
+def nobunaga_batch(queries: DNAFASTAFormat,
+                   reference_reads: DNAFASTAFormat = None,
+                   reference_taxonomy: pd.Series = None,
+                   database: Bowtie2IndexDirFmt = None, taxacut: float = 0.8,
+                   threads: int = 1, percent_id: float = 0.98,
+                   workers: int = 1,
+                   shogun_database: ShogunDatabaseDirFmt = None
+                   ) -> biom.Table:
+    reference = Reference(reference_reads, reference_taxonomy, database,
+                          shogun_database)
+    threads = resolve_threads(threads)
+    # every worker's aligner holds its own copy of the index in memory, and
+    # aligns all of its queries in one run so that it is loaded only once
+    workers = resolve_workers(workers, len(queries), threads,
+                              reference.index_bytes())
+    with report('nobunaga_batch', taxacut=taxacut, threads=threads,
+                percent_id=percent_id, workers=workers,
+                queries=len(queries)):
+        # fail before hours of alignment rather than when merging tables
+        with stage('check-samples'):
+            seen = collections.Counter()
+            for query in queries:
+                seen.update(_query_samples(query))
+        repeated = sorted(sample for sample, n in seen.items() if n > 1)
+        if repeated:
+            raise ValueError('Sample IDs are present in more than one query: '
+                             '%s' % ', '.join(repeated))
+        with scratch_dir() as tmpdir, reference.directory() as dbdir:
+
+            check_alignment_space(tmpdir, *queries)
+            index = bowtie2_index(dbdir)
+
+            # sample IDs are disjoint, so the alignments of several queries
+            # can be assigned together
+            def _profile(i):
+                outdir = os.path.join(tmpdir, 'worker-%d' % i)
+                os.mkdir(outdir)
+                sam = os.path.join(outdir, 'alignment.bowtie2.sam')
+                query_fps = ','.join(str(query)
+                                     for query in queries[i::workers])
+                with stage('align'):
+                    _run_command(bowtie2_command(
+                        index, query_fps, sam, max(1, threads // workers),
+                        percent_id))
+                return assign_taxonomy(sam, dbdir, outdir)
+
+            with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+                tables = list(pool.map(_profile, range(workers)))
+
+            table = merge_tables(tables)
+        table.table_id = profile_signature(reference.signature(),
+                                           taxacut, percent_id, 'shogun')
+        return table
+
+
+def compile_taxonomy(reference_taxonomy: pd.Series) -> LineageIndex:
+    return LineageIndex.from_taxonomy(reference_taxonomy)
+
+
+def build_database(reference_reads: DNAFASTAFormat,
+                   reference_taxonomy: pd.Series, threads: int = 1,
+                   partitions: int = 1) -> ShogunDatabaseDirFmt:
+    threads = resolve_threads(threads)
+    bundle = ShogunDatabaseDirFmt()
+    dbdir = str(bundle.path)
+    with report('build_database', threads=threads, partitions=partitions):
+        stager = Stager(allow_symlink=False)
+        with stage('stage-database'):
+            stager.stage(str(reference_reads),
+                         os.path.join(dbdir, 'refseqs.fna'))
+            reference_taxonomy.to_csv(os.path.join(dbdir, 'taxa.tsv'),
+                                      sep='\t')
+        os.mkdir(os.path.join(dbdir, 'bowtie2'))
+        with scratch_dir() as tmpdir:
+            fps = [os.path.join(dbdir, 'refseqs.fna')]
+            if partitions > 1:
+                with stage('partition-reference'):
+                    fps = partition_fasta(fps[0], partitions, tmpdir)
+            indexes = [os.path.join('bowtie2', 'refseqs') if len(fps) == 1
+                       else os.path.join('bowtie2', 'refseqs.%d' % i)
+                       for i in range(len(fps))]
+            # partitions are indexed one at a time, so that peak memory is
+            # that of indexing the largest
+            for i, (fp, index) in enumerate(zip(fps, indexes)):
+                start = time.perf_counter()
+                with stage('build-index-%d' % i):
+                    _run_command(bowtie2_build_command(
+                        fp, os.path.join(dbdir, index), threads))
+                print('Built bowtie2 index %s in %.1f seconds.' % (
+                    index, time.perf_counter() - start))
+        write_database_metadata(
+            dbdir, indexes, taxonomy_fingerprint(reference_taxonomy))
+    return bundle
+
+
+def bundle_database(reference_reads: DNAFASTAFormat,
+                    reference_taxonomy: pd.Series,
+                    database: Bowtie2IndexDirFmt) -> ShogunDatabaseDirFmt:
+    bundle = ShogunDatabaseDirFmt()
+    with report('bundle_database'):
+        # artifacts must own their files, so nothing is symlinked
+        setup_database_dir(
+            str(bundle.path), database, reference_reads, reference_taxonomy,
+            allow_symlink=False,
+            taxonomy_source=taxonomy_fingerprint(reference_taxonomy))
+    return bundle
+
+
+def align(query: DNAFASTAFormat, database: Bowtie2IndexDirFmt = None,
+          threads: int = 1, percent_id: float = 0.98,
+          shogun_database: ShogunDatabaseDirFmt = None
+          ) -> ShogunAlignmentDirFmt:
+    _either({'database': database}, shogun_database)
+    if shogun_database is not None:
+        index = bowtie2_index(str(shogun_database))
+    else:
+        index = os.path.join(str(database), database.get_basename())
+    alignment = ShogunAlignmentDirFmt()
+    threads = resolve_threads(threads)
+    with report('align', threads=threads, percent_id=percent_id):
+        # bowtie2 reads the index in place, so nothing needs staging
+        align_compressed(query, index, _alignment_fp(alignment), threads,
+                         percent_id)
+    return alignment
+
+
+def assign(alignment: ShogunAlignmentDirFmt,
+           reference_taxonomy: pd.Series = None, taxacut: float = 0.8,
+           threads: int = 1, percent_id: float = 0.98,
+           assigner: str = 'shogun',
+           taxonomy_index: LineageIndex = None,
+           shogun_database: ShogunDatabaseDirFmt = None) -> biom.Table:
+    _either({'reference_taxonomy': reference_taxonomy}, shogun_database)
+
+    def _taxonomy():
+        if shogun_database is None:
+            return reference_taxonomy
+        return read_database_taxonomy(str(shogun_database))
+
+    def _source():
+        recorded = None if shogun_database is None else \
+            read_taxonomy_source(str(shogun_database))
+        return recorded or taxonomy_fingerprint(_taxonomy())
+
+    taxonomy_index = _taxonomy_index(assigner, taxonomy_index, _taxonomy,
+                                     _source)
+    threads = resolve_threads(threads)
+    with report('assign', taxacut=taxacut, threads=threads,
+                percent_id=percent_id, assigner=assigner):
+        if assigner == 'native':
+            with gzip.open(_alignment_fp(alignment), 'rt') as fh:
+                return assign_native(fh, taxonomy_index, taxacut,
+                                     percent_id, threads)
+        with scratch_dir() as tmpdir:
+            sam = decompress_alignment(alignment, tmpdir)
+            if shogun_database is not None:
+                dbdir = str(shogun_database)
+            else:
+                dbdir = setup_taxonomy_dir(os.path.join(tmpdir, 'database'),
+                                           reference_taxonomy)
+            return assign_taxonomy(sam, dbdir, tmpdir)
+
+
+def run_functional(taxatable, dbdir, outdir, levels):
+    '''Run ``shogun functional`` at strain level for the requested levels
+
+    SHOGUN derives module and pathway tables from the KEGG ortholog table
+    in the same run, so they cannot be skipped individually, but tables
+    that were not requested are never parsed. Returns one table per entry
+    of FUNCTIONAL_LEVELS, or None for levels not requested.
+    '''
+    if not levels:
+        return [None] * len(FUNCTIONAL_LEVELS)
+    os.mkdir(outdir)
+    cmd = ['shogun', 'functional', '-i', taxatable, '-d', dbdir,
+           '-o', outdir, '-l', 'strain']
+    with stage('functional'):
         _run_command(cmd)
+    tables = []
+    for level in FUNCTIONAL_LEVELS:
+        if level not in levels:
+            tables.append(None)
+            continue
+        # output names are prefixed with the name of the input table
+        fp, = glob.glob(os.path.join(outdir,
+                                     '*' + _FUNCTIONAL_SUFFIXES[level]))
+        tables.append(load_table(fp))
+    return tables
+
+
+def shogun_functional_tables(sam, dbdir, outdir, levels):
+    '''Strain and functional tables of alignments, as in ``minipipe``
 
-        # assign taxonomy
-        taxatable = os.path.join(tmpdir, 'taxatable.tsv')
-        cmd = ['shogun', 'assign_taxonomy', '-i',
-               os.path.join(tmpdir, 'alignment.bowtie2.sam'), '-d', tmpdir,
-               '-o', taxatable, '-a', 'bowtie2']
+    Runs the steps of ``shogun pipeline`` that feed the requested tables;
+    the pipeline itself would also redistribute and profile at genus and
+    species level. Functional levels that were not requested are returned
+    as empty tables.
+    '''
+    taxatable = run_assign_taxonomy(sam, dbdir, outdir)
+
+    strain_table = os.path.join(outdir, 'taxatable.strain.txt')
+    cmd = ['shogun', 'redistribute', '-i', taxatable, '-d', dbdir,
+           '-l', 'strain', '-o', strain_table]
+    with stage('redistribute'):
         _run_command(cmd)
 
-        # output taxatable as feature table
-        return load_table(taxatable)
+    functional = run_functional(taxatable, dbdir,
+                                os.path.join(outdir, 'functional'), levels)
+    return (load_table(strain_table),) + tuple(
+        biom.Table(np.zeros((0, 0)), [], []) if table is None else table
+        for table in functional)
+
+
+def functional_profile(alignment: ShogunAlignmentDirFmt,
+                       reference_reads: DNAFASTAFormat = None,
+                       reference_taxonomy: pd.Series = None,
+                       database: Bowtie2IndexDirFmt = None,
+                       functional_levels: list = FUNCTIONAL_LEVELS,
+                       shogun_database: ShogunDatabaseDirFmt = None) -> (
+                           biom.Table, biom.Table, biom.Table, biom.Table):
+    reference = Reference(reference_reads, reference_taxonomy, database,
+                          shogun_database)
+    with report('functional_profile',
+                functional_levels=list(functional_levels)), \
+            scratch_dir() as tmpdir, reference.directory() as dbdir:
+        sam = decompress_alignment(alignment, tmpdir)
+        return shogun_functional_tables(sam, dbdir, tmpdir,
+                                        set(functional_levels))
+
+
+def compile_functions(shogun_database: ShogunDatabaseDirFmt
+                      ) -> StrainFunctions:
+    with report('compile_functions'), stage('compile-functions'):
+        return read_shogun_functions(str(shogun_database))
 
 
-def minipipe(query: DNAFASTAFormat, reference_reads: DNAFASTAFormat,
-             reference_taxonomy: pd.Series, database: Bowtie2IndexDirFmt,
+def profile_functions(table: biom.Table,
+                      functional_annotation: StrainFunctions,
+                      threads: int = 1) -> (
+                          biom.Table, biom.Table, biom.Table):
+    threads = resolve_threads(threads)
+    with report('profile_functions', threads=threads,
+                samples=len(table.ids())), stage('profile-functions'):
+        return functional_tables(table, functional_annotation, threads)
+
+
+def minipipe(query: QueryFASTA, reference_reads: DNAFASTAFormat = None,
+             reference_taxonomy: pd.Series = None,
+             database: Bowtie2IndexDirFmt = None,
              taxacut: float = 0.8,
-             threads: int = 1, percent_id: float = 0.98) -> (
+             threads: int = 1, percent_id: float = 0.98,
+             functional_levels: list = FUNCTIONAL_LEVELS,
+             shogun_database: ShogunDatabaseDirFmt = None) -> (
                      biom.Table, biom.Table, biom.Table, biom.Table):
-    with tempfile.TemporaryDirectory() as tmpdir:
-        setup_database_dir(tmpdir,
-                           database, reference_reads, reference_taxonomy)
-
-        # run pipeline
-        cmd = ['shogun', 'pipeline', '-i', str(query), '-d', tmpdir,
-               '-o', tmpdir, '-a', 'bowtie2', '-x', str(taxacut),
-               '-t', str(threads), '-p', str(percent_id)]
-        _run_command(cmd)
+    reference = Reference(reference_reads, reference_taxonomy, database,
+                          shogun_database)
+    # shogun align cannot align against a partitioned database
+    reference.bowtie2_index()
+    threads = resolve_threads(threads)
+    with report('minipipe', taxacut=taxacut, threads=threads,
+                percent_id=percent_id,
+                functional_levels=list(functional_levels)):
+
+        def _profile():
+            with scratch_dir() as tmpdir, reference.directory() as dbdir:
+                check_alignment_space(tmpdir, query)
+
+                sam = align_query(query, dbdir, tmpdir, taxacut, threads,
+                                  percent_id)
+                return shogun_functional_tables(sam, dbdir, tmpdir,
+                                                set(functional_levels))
 
-        # output selected results as feature tables
-        tables = ['taxatable.strain.txt',
-                  'taxatable.strain.kegg.txt',
-                  'taxatable.strain.kegg.modules.txt',
-                  'taxatable.strain.kegg.pathways.txt']
-        return tuple(load_table(os.path.join(tmpdir, t)) for t in tables)
+        return memoize('minipipe', _profile, query, reference, {
+            'taxacut': taxacut, 'percent_id': percent_id,
+            'functional_levels': sorted(set(functional_levels))})
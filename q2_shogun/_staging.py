@@ -0,0 +1,96 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import collections
+import errno
+import fcntl
+import os
+import shutil
+
+
+# ioctl request number of FICLONE from <linux/fs.h>
+_FICLONE = 0x40049409
+
+# errors meaning "this method cannot work here", as opposed to real failures
+# such as a missing source file
+_UNSUPPORTED = {errno.EXDEV, errno.EPERM, errno.EACCES, errno.EINVAL,
+                errno.ENOTTY, errno.EOPNOTSUPP, errno.ENOSYS, errno.EMLINK}
+
+METHODS = ('reflink', 'hardlink', 'symlink', 'copy')
+
+
+def _reflink(src, dst):
+    with open(src, 'rb') as in_, open(dst, 'wb') as out:
+        try:
+            fcntl.ioctl(out.fileno(), _FICLONE, in_.fileno())
+        except OSError:
+            out.close()
+            os.remove(dst)
+            raise
+
+
+def _hardlink(src, dst):
+    os.link(src, dst)
+
+
+def _symlink(src, dst):
+    os.symlink(os.path.abspath(src), dst)
+
+
+def _copy(src, dst):
+    shutil.copyfile(src, dst)
+
+
+_FUNCTIONS = {'reflink': _reflink, 'hardlink': _hardlink,
+              'symlink': _symlink, 'copy': _copy}
+
+
+def _devices(src, dst):
+    '''Devices of ``src`` and of the directory ``dst`` is placed in'''
+    return (os.stat(src).st_dev,
+            os.stat(os.path.dirname(os.path.abspath(dst))).st_dev)
+
+
+class Stager:
+    '''Place files using the cheapest method the filesystem supports
+
+    Methods are tried in the order reflink, hardlink, symlink and byte copy.
+    A method that fails because the filesystem does not support it is not
+    tried again for later files between the same source and destination
+    devices; ``unsupported`` holds these methods by pair of devices.
+    Symlinks are only allowed when the staged files will not outlive their
+    sources.
+    '''
+
+    def __init__(self, allow_symlink=True):
+        self.methods = [m for m in METHODS
+                        if allow_symlink or m != 'symlink']
+        self.used = collections.Counter()
+        self.unsupported = collections.defaultdict(set)
+
+    def stage(self, src, dst):
+        unsupported = self.unsupported[_devices(src, dst)]
+        for method in self.methods:
+            if method in unsupported:
+                continue
+            try:
+                _FUNCTIONS[method](src, dst)
+            except OSError as e:
+                if e.errno not in _UNSUPPORTED or method == 'copy':
+                    raise
+                unsupported.add(method)
+            else:
+                self.used[method] += 1
+                return dst
+
+    def stage_tree(self, src, dst):
+        return shutil.copytree(src, dst, copy_function=self.stage)
+
+    def summary(self):
+        return ', '.join('%d by %s' % (self.used[m], m)
+                         for m in METHODS if self.used[m])
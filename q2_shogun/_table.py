@@ -0,0 +1,115 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import csv
+
+import numpy as np
+import pandas as pd
+
+
+# number of cells parsed per dense chunk
+_CHUNK_CELLS = 2 ** 22
+
+
+def _find_header(fh):
+    '''Locate the header of a classic (QIIME 1 style) table
+
+    Mirrors ``biom.Table.from_tsv``: the header is the last comment line
+    before the data or, lacking comments, the first non-empty line. Returns
+    the sample IDs and the number of lines preceding the data.
+    '''
+    header = None
+    lineno = 0
+    for lineno, line in enumerate(fh, 1):
+        if not line.strip():
+            continue
+        if not line.startswith('#'):
+            if header is None:
+                return line.rstrip().split('\t')[1:], lineno
+            return header, lineno - 1
+        header = line.strip().split('\t')[1:]
+    return header or [], lineno
+
+
+def read_taxatable(fp, chunk_cells=_CHUNK_CELLS):
+    '''Parse a SHOGUN taxatable TSV into a sparse biom Table
+
+    Rows are read in chunks of roughly ``chunk_cells`` values, and only the
+    nonzero entries of each chunk are retained, so the dense table is never
+    held in memory at once.
+    '''
+    import biom
+    from scipy import sparse
+
+    with open(fp) as fh:
+        sample_ids, skip = _find_header(fh)
+    n_samples = len(sample_ids)
+    dtype = {i: np.float64 for i in range(1, n_samples + 1)}
+    dtype[0] = str
+    obs_ids, rows, cols, data = [], [], [], []
+    n_obs = 0
+    try:
+        reader = pd.read_csv(
+            fp, sep='\t', header=None, skiprows=skip, index_col=0,
+            dtype=dtype, quoting=csv.QUOTE_NONE, na_filter=False,
+            skip_blank_lines=True,
+            chunksize=max(1, chunk_cells // max(n_samples, 1)))
+        for chunk in reader:
+            values = chunk.to_numpy()
+            r, c = np.nonzero(values)
+            rows.append(r + n_obs)
+            cols.append(c)
+            data.append(values[r, c])
+            obs_ids.extend(chunk.index)
+            n_obs += len(chunk)
+    except pd.errors.EmptyDataError:
+        # header only, no observations
+        pass
+
+    if n_obs:
+        rows, cols, data = (np.concatenate(x) for x in (rows, cols, data))
+    matrix = sparse.coo_matrix((data, (rows, cols)),
+                               shape=(n_obs, n_samples)).tocsr()
+    return biom.Table(matrix, obs_ids, sample_ids)
+
+
+def merge_tables(tables):
+    '''Merge tables with disjoint samples into a single sparse Table
+
+    Observations are aligned on their IDs, so tables may describe
+    different (overlapping) sets of features.
+    '''
+    import biom
+    from scipy import sparse
+
+    sample_ids = []
+    for table in tables:
+        sample_ids.extend(table.ids())
+    sample_index = pd.Index(sample_ids)
+    if not sample_index.is_unique:
+        duplicates = sorted(set(sample_index[sample_index.duplicated()]))
+        raise ValueError('Sample IDs are present in more than one table: '
+                         '%s' % ', '.join(duplicates))
+
+    obs_index = pd.Index(np.concatenate(
+        [table.ids(axis='observation') for table in tables] or [[]]))
+    obs_index = obs_index.unique()
+    rows, cols, data = [], [], []
+    offset = 0
+    for table in tables:
+        coo = table.matrix_data.tocoo()
+        positions = obs_index.get_indexer(table.ids(axis='observation'))
+        rows.append(positions[coo.row])
+        cols.append(coo.col + offset)
+        data.append(coo.data)
+        offset += len(table.ids())
+    if tables:
+        rows, cols, data = (np.concatenate(x) for x in (rows, cols, data))
+    matrix = sparse.coo_matrix((data, (rows, cols)),
+                               shape=(len(obs_index), offset)).tocsr()
+    return biom.Table(matrix, list(obs_index), sample_ids)
@@ -0,0 +1,95 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import numpy as np
+
+from .plugin_setup import plugin
+from q2_types.feature_data import DNAFASTAFormat
+
+from ._format import (DNAFASTAGzFormat, FunctionalAnnotationDirFmt,
+                      TaxonomyIndexDirFmt)
+from ._function import StrainFunctions
+from ._lca import LineageIndex
+from ._query import QueryFASTA
+
+
+def _write_labels(fp, labels):
+    with fp.open('w') as fh:
+        for label in labels:
+            fh.write('%s\n' % label)
+
+
+def _read_labels(fp):
+    with fp.open() as fh:
+        return fh.read().splitlines()
+
+
+@plugin.register_transformer
+def _1(index: LineageIndex) -> TaxonomyIndexDirFmt:
+    ff = TaxonomyIndexDirFmt()
+    _write_labels(ff.path / 'labels.txt', index.labels)
+    np.save(str(ff.path / 'lineages.npy'), index.lineages)
+    np.save(str(ff.path / 'ids.npy'), index.ids)
+    np.save(str(ff.path / 'id-rows.npy'), index.id_rows)
+    if index.source is not None:
+        _write_labels(ff.path / 'source.txt', [index.source])
+    return ff
+
+
+@plugin.register_transformer
+def _2(ff: TaxonomyIndexDirFmt) -> LineageIndex:
+    labels = _read_labels(ff.path / 'labels.txt')
+
+    def _load(name):
+        return np.load(str(ff.path / name), mmap_mode='r')
+
+    source = None
+    if (ff.path / 'source.txt').exists():
+        source, = _read_labels(ff.path / 'source.txt')
+    return LineageIndex(labels, _load('lineages.npy'), _load('ids.npy'),
+                        _load('id-rows.npy'), source)
+
+
+@plugin.register_transformer
+def _3(annotation: StrainFunctions) -> FunctionalAnnotationDirFmt:
+    from scipy import sparse
+
+    ff = FunctionalAnnotationDirFmt()
+    for name in ('strains', 'kos', 'modules', 'pathways'):
+        _write_labels(ff.path / ('%s.txt' % name), getattr(annotation, name))
+    for name in ('strain_kos', 'ko_modules', 'ko_pathways'):
+        sparse.save_npz(str(ff.path / ('%s.npz' % name.replace('_', '-'))),
+                        getattr(annotation, name))
+    return ff
+
+
+@plugin.register_transformer
+def _4(ff: FunctionalAnnotationDirFmt) -> StrainFunctions:
+    from scipy import sparse
+
+    def _labels(name):
+        return _read_labels(ff.path / ('%s.txt' % name))
+
+    def _matrix(name):
+        return sparse.load_npz(str(ff.path / ('%s.npz' % name)))
+
+    return StrainFunctions(
+        _labels('strains'), _labels('kos'), _matrix('strain-kos'),
+        _labels('modules'), _matrix('ko-modules'), _labels('pathways'),
+        _matrix('ko-pathways'))
+
+
+@plugin.register_transformer
+def _5(ff: DNAFASTAFormat) -> QueryFASTA:
+    return QueryFASTA(ff)
+
+
+@plugin.register_transformer
+def _6(ff: DNAFASTAGzFormat) -> QueryFASTA:
+    # decompressed while it is aligned, see query_pipe
+    return QueryFASTA(ff)
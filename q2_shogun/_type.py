@@ -0,0 +1,18 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+from qiime2.plugin import SemanticType
+from q2_types.feature_data import FeatureData
+
+
+TaxonomyIndex = SemanticType('TaxonomyIndex')
+ShogunAlignment = SemanticType('ShogunAlignment')
+FunctionalAnnotation = SemanticType('FunctionalAnnotation')
+ShogunDatabase = SemanticType('ShogunDatabase')
+CompressedSequence = SemanticType('CompressedSequence',
+                                  variant_of=FeatureData.field['type'])
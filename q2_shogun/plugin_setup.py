@@ -6,13 +6,27 @@
 # The full license is in the file LICENSE, distributed with this software.
 # ----------------------------------------------------------------------------
 
-from qiime2.plugin import Plugin, Citations, Float, Int, Range
+import importlib
+
+from qiime2.plugin import (Plugin, Citations, Bool, Choices, Collection,
+                           Float, Int, List, Range, Str)
 
 from q2_types.feature_data import FeatureData, Sequence, Taxonomy
 from q2_types.feature_table import FeatureTable, Frequency
 from q2_types.bowtie2 import Bowtie2Index
 
-from ._shogun import minipipe, nobunaga
+from ._format import (DNAFASTAGzDirFmt, DNAFASTAGzFormat,
+                      FunctionalAnnotationDirFmt, LabelsFormat,
+                      NumpyArrayFormat, SAMGzFormat, ShogunAlignmentDirFmt,
+                      ShogunDatabaseDirFmt, ShogunDatabaseFileFormat,
+                      ShogunMetadataFormat, SparseMatrixFormat,
+                      TaxonomyIndexDirFmt, TaxonomyLabelsFormat)
+from ._shogun import (align, assign, build_database, bundle_database,
+                      compile_functions, compile_taxonomy, functional_profile,
+                      minipipe, nobunaga, nobunaga_append, nobunaga_batch,
+                      nobunaga_sweep, profile_functions, FUNCTIONAL_LEVELS)
+from ._type import (CompressedSequence, FunctionalAnnotation,
+                    ShogunAlignment, ShogunDatabase, TaxonomyIndex)
 import q2_shogun
 
 
@@ -29,27 +43,142 @@ plugin = Plugin(
     citations=[citations['Hillmann320986']]
 )
 
+plugin.register_formats(NumpyArrayFormat, TaxonomyLabelsFormat,
+                        TaxonomyIndexDirFmt, SAMGzFormat,
+                        ShogunAlignmentDirFmt, LabelsFormat,
+                        SparseMatrixFormat, FunctionalAnnotationDirFmt,
+                        ShogunMetadataFormat, ShogunDatabaseFileFormat,
+                        ShogunDatabaseDirFmt, DNAFASTAGzFormat,
+                        DNAFASTAGzDirFmt)
+plugin.register_semantic_types(TaxonomyIndex, ShogunAlignment,
+                               FunctionalAnnotation, ShogunDatabase,
+                               CompressedSequence)
+plugin.register_semantic_type_to_format(
+    TaxonomyIndex, artifact_format=TaxonomyIndexDirFmt)
+plugin.register_semantic_type_to_format(
+    ShogunAlignment, artifact_format=ShogunAlignmentDirFmt)
+plugin.register_semantic_type_to_format(
+    FunctionalAnnotation, artifact_format=FunctionalAnnotationDirFmt)
+plugin.register_semantic_type_to_format(
+    ShogunDatabase, artifact_format=ShogunDatabaseDirFmt)
+plugin.register_semantic_type_to_format(
+    FeatureData[CompressedSequence], artifact_format=DNAFASTAGzDirFmt)
+
+# queries may also be gzip or bgzip-compressed, and are then decompressed
+# through a pipe as they are aligned
+_query = FeatureData[Sequence | CompressedSequence]
+_query_description = ('query sequences, which may be gzip or '
+                      'bgzip-compressed (FeatureData[CompressedSequence]). '
+                      'Compressed queries are decompressed while they are '
+                      'aligned and never written out uncompressed.')
+
+# the reference is given either as a prebuilt SHOGUN database or as its
+# three parts
+_reference_inputs = {'reference_reads': FeatureData[Sequence],
+                     'reference_taxonomy': FeatureData[Taxonomy],
+                     'database': Bowtie2Index,
+                     'shogun_database': ShogunDatabase}
+
+_shogun_database_description = (
+    'prebuilt SHOGUN database, such as the output of bundle-database or an '
+    'imported SHOGUN database directory. It is used in place, without '
+    'staging, instead of `reference_reads`, `reference_taxonomy` and '
+    '`database`.')
+
+_reference_input_descriptions = {
+    'reference_reads': ('reference sequences. Required unless '
+                        '`shogun_database` is given.'),
+    'reference_taxonomy': ('reference taxonomy labels. Required unless '
+                           '`shogun_database` is given.'),
+    'database': ('bowtie2 index artifact. Required unless '
+                 '`shogun_database` is given.'),
+    'shogun_database': _shogun_database_description}
+
+# "auto" sizes thread and worker counts from CPU affinity, cgroup CPU
+# quota and available memory
+_count = Int % Range(1, None) | Str % Choices(['auto'])
+
+_parameters = {'taxacut': Float % Range(0.0, 1.0, inclusive_end=True),
+               'threads': _count,
+               'percent_id': Float % Range(0.0, 1.0, inclusive_end=True)}
+
+_assigner_description = (
+    'Taxonomy assignment engine. "shogun" runs SHOGUN\'s assign_taxonomy, '
+    'which assigns the strict lowest common ancestor of all hits. "native" '
+    'assigns in-process on `threads` cores and applies `taxacut` consensus; '
+    'with `taxacut` of 1.0 it assigns as "shogun" does, but filters hits at '
+    'the exact `percent_id`, where bowtie2, and so "shogun", round it to '
+    'two decimals. Tables of the two cannot be appended to each other.')
+
+_collapse_duplicates_description = (
+    'Align each distinct query sequence only once and count it for every '
+    'read that shares it. Alignment time falls with the fraction of '
+    'duplicate reads. Results can differ slightly from an uncollapsed run: '
+    'bowtie2 breaks ties between equally good hits, and picks which hits '
+    'to report for reads with more than 16, pseudo-randomly per read name, '
+    'so duplicates aligned separately may report different hits. With '
+    '`streaming`, requires the native assigner.')
+
+_taxonomy_index_description = (
+    'precompiled index of `reference_taxonomy`, used by the native assigner '
+    'instead of encoding the taxonomy on every run.')
+
+_functional_outputs = [('taxa_table', FeatureTable[Frequency]),
+                       ('kegg_table', FeatureTable[Frequency]),
+                       ('module_table', FeatureTable[Frequency]),
+                       ('pathway_table', FeatureTable[Frequency])]
+
+_functional_levels_description = (
+    'Functional tables to compute. Functional annotation is skipped '
+    'entirely if none are requested, and the outputs of levels that are not '
+    'requested are empty tables.')
+
+_functional_output_descriptions = {
+    'taxa_table': 'Frequency table of taxonomic composition.',
+    'kegg_table': ('Frequency table of KEGG ortholog composition '
+                   '(empty unless "kegg" is requested).'),
+    'module_table': ('Frequency table of KEGG module composition '
+                     '(empty unless "module" is requested).'),
+    'pathway_table': ('Frequency table of KEGG pathway composition '
+                      '(empty unless "pathway" is requested).')}
+
+_parameter_descriptions = {
+    'taxacut': ('Minimum fraction of assignments must match top '
+                'hit to be accepted as consensus assignment. Must '
+                'be in range (0.0, 1.0].'),
+    'threads': ('Number of threads to use, or "auto" to use every CPU '
+                'available to the job, as limited by CPU affinity (e.g. '
+                'Slurm) and cgroup CPU quotas (e.g. Kubernetes).'),
+    'percent_id': ('Reject match if percent identity to query is '
+                   'lower. Must be in range [0.0, 1.0].')
+}
+
+
 plugin.methods.register_function(
     function=nobunaga,
-    inputs={'query': FeatureData[Sequence],
-            'reference_reads': FeatureData[Sequence],
-            'reference_taxonomy': FeatureData[Taxonomy],
-            'database': Bowtie2Index},
-    parameters={'taxacut': Float % Range(0.0, 1.0, inclusive_end=True),
-                'threads': Int % Range(1, None),
-                'percent_id': Float % Range(0.0, 1.0, inclusive_end=True)},
+    inputs={'query': _query, **_reference_inputs,
+            'taxonomy_index': TaxonomyIndex},
+    parameters={**_parameters, 'shards': Int % Range(1, None),
+                'streaming': Bool,
+                'assigner': Str % Choices(['shogun', 'native']),
+                'collapse_duplicates': Bool},
     outputs=[('taxa_table', FeatureTable[Frequency])],
-    input_descriptions={'query': 'query sequences.',
-                        'reference_reads': 'reference sequences.',
-                        'reference_taxonomy': 'reference taxonomy labels.',
-                        'database': 'bowtie2 index artifact.'},
+    input_descriptions={'query': _query_description,
+                        **_reference_input_descriptions,
+                        'taxonomy_index': _taxonomy_index_description},
     parameter_descriptions={
-        'taxacut': ('Minimum fraction of assignments must match top '
-                    'hit to be accepted as consensus assignment. Must '
-                    'be in range (0.0, 1.0].'),
-        'threads': 'Number of threads to use.',
-        'percent_id': ('Reject match if percent identity to query is '
-                       'lower. Must be in range [0.0, 1.0].')
+        **_parameter_descriptions,
+        'shards': ('Split the query sequences into this many parts and '
+                   'align them concurrently, dividing `threads` between '
+                   'them. Results are identical to an unsharded run. '
+                   'Compressed queries cannot be sharded.'),
+        'streaming': ('Stream alignments from bowtie2 directly into taxonomy '
+                      'assignment through a pipe instead of writing them to '
+                      'a temporary SAM file first. This lowers peak scratch '
+                      'disk usage and overlaps the two steps. Cannot be '
+                      'combined with `shards`.'),
+        'assigner': _assigner_description,
+        'collapse_duplicates': _collapse_duplicates_description
     },
     output_descriptions={
         'taxa_table': 'Frequency table of taxonomic composition.'},
@@ -60,39 +189,311 @@ plugin.methods.register_function(
 )
 
 
+plugin.methods.register_function(
+    function=nobunaga_append,
+    inputs={'table': FeatureTable[Frequency],
+            'query': FeatureData[Sequence], **_reference_inputs,
+            'taxonomy_index': TaxonomyIndex},
+    parameters={**_parameters, 'shards': Int % Range(1, None),
+                'streaming': Bool,
+                'assigner': Str % Choices(['shogun', 'native']),
+                'collapse_duplicates': Bool},
+    outputs=[('taxa_table', FeatureTable[Frequency])],
+    input_descriptions={'table': ('taxa table produced by nobunaga or '
+                                  'nobunaga-batch with the same reference '
+                                  'and `taxacut` and `percent_id`.'),
+                        'query': ('query sequences of the new samples, '
+                                  'none of which may be in `table`.'),
+                        **_reference_input_descriptions,
+                        'taxonomy_index': _taxonomy_index_description},
+    parameter_descriptions={
+        **_parameter_descriptions,
+        'shards': 'See nobunaga.',
+        'streaming': 'See nobunaga.',
+        'assigner': _assigner_description,
+        'collapse_duplicates': _collapse_duplicates_description
+    },
+    output_descriptions={
+        'taxa_table': ('Frequency table of taxonomic composition of the '
+                       'samples in `table` and `query`.')},
+    name='Add samples to a SHOGUN taxonomy profile',
+    description=('Profile new query sequences as nobunaga does and add them '
+                 'to an existing taxa table. Only the new sequences are '
+                 'aligned, and the reference and parameters must match '
+                 'those the existing table was profiled with, so the result '
+                 'is identical to profiling all samples at once.'),
+    citations=[citations['langmead2012fast']]
+)
+
+
+# a cut or identity of 0 accepts anything, which is not worth sweeping
+_sweep_value = Float % Range(0.0, 1.0, inclusive_start=False,
+                             inclusive_end=True)
+
+plugin.methods.register_function(
+    function=nobunaga_sweep,
+    inputs={'query': FeatureData[Sequence], **_reference_inputs,
+            'taxonomy_index': TaxonomyIndex},
+    parameters={'taxacuts': List[_sweep_value],
+                'percent_ids': List[_sweep_value],
+                'threads': _count},
+    outputs=[('taxa_tables', Collection[FeatureTable[Frequency]])],
+    input_descriptions={'query': 'query sequences.',
+                        **_reference_input_descriptions,
+                        'taxonomy_index': _taxonomy_index_description},
+    parameter_descriptions={
+        'taxacuts': 'Values of `taxacut` to profile with.',
+        'percent_ids': 'Values of `percent_id` to profile with.',
+        'threads': _parameter_descriptions['threads']},
+    output_descriptions={
+        'taxa_tables': ('Frequency table of taxonomic composition for each '
+                        'combination of `taxacuts` and `percent_ids`, keyed '
+                        'as "taxacut-<taxacut>_percent-id-<percent_id>".')},
+    name='SHOGUN taxonomy profiles over a parameter grid',
+    description=('Profile query sequences as nobunaga does with the native '
+                 'assigner, for every combination of `taxacuts` and '
+                 '`percent_ids`. The query is aligned once, at the lowest '
+                 'percent identity, and the alignments are read once, '
+                 'filtered and assigned for every combination, so a sweep '
+                 'costs about as much as a single profile. Each table '
+                 'matches nobunaga\'s for its parameters unless a read has '
+                 'more than 16 hits at the lowest percent identity. Tables '
+                 'can be extended with nobunaga-append.'),
+    citations=[citations['langmead2012fast']]
+)
+
+
+plugin.methods.register_function(
+    function=nobunaga_batch,
+    inputs={'queries': List[FeatureData[Sequence]], **_reference_inputs},
+    parameters={**_parameters, 'workers': _count},
+    outputs=[('taxa_table', FeatureTable[Frequency])],
+    input_descriptions={'queries': ('query sequences. Sample IDs must not '
+                                    'be repeated across artifacts.'),
+                        **_reference_input_descriptions},
+    parameter_descriptions={
+        **_parameter_descriptions,
+        'workers': ('Number of aligners the query artifacts are divided '
+                    'between, which run concurrently and divide `threads` '
+                    'between them. Each aligns all of its queries in a '
+                    'single run, loading the bowtie2 index once. "auto" '
+                    'runs as many as there are threads, as long as '
+                    'available memory can hold a copy of the bowtie2 index '
+                    'for each.')
+    },
+    output_descriptions={
+        'taxa_table': ('Frequency table of taxonomic composition of all '
+                       'query artifacts.')},
+    name='SHOGUN bowtie2 taxonomy profiler for multiple query artifacts',
+    description=('Profile several query sequence artifacts taxonomically '
+                 'against a reference database that is staged and loaded '
+                 'by bowtie2 only once, and merge the results into a '
+                 'single feature table.'),
+    citations=[citations['langmead2012fast']]
+)
+
+
+plugin.methods.register_function(
+    function=compile_taxonomy,
+    inputs={'reference_taxonomy': FeatureData[Taxonomy]},
+    parameters={},
+    outputs=[('taxonomy_index', TaxonomyIndex)],
+    input_descriptions={
+        'reference_taxonomy': 'reference taxonomy labels.'},
+    output_descriptions={
+        'taxonomy_index': ('integer-encoded lineages of the reference '
+                           'taxonomy.')},
+    name='Precompile a reference taxonomy',
+    description=('Encode a reference taxonomy as interned lineage labels, '
+                 'per-reference integer lineage arrays and a sorted '
+                 'memory-mappable ID lookup, for use by the native '
+                 'assigner of nobunaga.')
+)
+
+
 plugin.methods.register_function(
     function=minipipe,
-    inputs={'query': FeatureData[Sequence],
-            'reference_reads': FeatureData[Sequence],
+    inputs={'query': _query, **_reference_inputs},
+    parameters={**_parameters,
+                'functional_levels': List[Str % Choices(FUNCTIONAL_LEVELS)]},
+    outputs=_functional_outputs,
+    input_descriptions={'query': _query_description,
+                        **_reference_input_descriptions},
+    parameter_descriptions={
+        **_parameter_descriptions,
+        'functional_levels': _functional_levels_description
+    },
+    output_descriptions=_functional_output_descriptions,
+    name='SHOGUN bowtie2 taxonomy and functional profiler',
+    description=('Profile query sequences functionally and taxonomically '
+                 'via alignment with bowtie2, followed by LCA taxonomy '
+                 'assignment and functional annotation.'),
+    citations=[citations['langmead2012fast']]
+)
+
+plugin.methods.register_function(
+    function=build_database,
+    inputs={'reference_reads': FeatureData[Sequence],
+            'reference_taxonomy': FeatureData[Taxonomy]},
+    parameters={'threads': _count, 'partitions': Int % Range(1, None)},
+    outputs=[('shogun_database', ShogunDatabase)],
+    input_descriptions={'reference_reads': 'reference sequences.',
+                        'reference_taxonomy': 'reference taxonomy labels.'},
+    parameter_descriptions={
+        'threads': _parameter_descriptions['threads'],
+        'partitions': ('Split the reference into this many partitions of '
+                       'similar size and index each separately, so that '
+                       'no index needs more memory than one partition. '
+                       'Partitions are indexed one after another, each on '
+                       '`threads` threads. nobunaga aligns against every '
+                       'partition and merges the best hits of each read.')},
+    output_descriptions={
+        'shogun_database': ('SHOGUN database of the reference, to be given '
+                            'as `shogun_database`.')},
+    name='Build a SHOGUN database',
+    description=('Index reference sequences with multithreaded '
+                 'bowtie2-build and bundle them with their taxonomy as a '
+                 'SHOGUN database. The time taken to build each index is '
+                 'printed and recorded as a stage of the '
+                 'Q2_SHOGUN_REPORT.'),
+    citations=[citations['langmead2012fast']]
+)
+
+plugin.methods.register_function(
+    function=bundle_database,
+    inputs={'reference_reads': FeatureData[Sequence],
             'reference_taxonomy': FeatureData[Taxonomy],
             'database': Bowtie2Index},
-    parameters={'taxacut': Float % Range(0.0, 1.0, inclusive_end=True),
-                'threads': Int % Range(1, None),
-                'percent_id': Float % Range(0.0, 1.0, inclusive_end=True)},
-    outputs=[('taxa_table', FeatureTable[Frequency]),
-             ('kegg_table', FeatureTable[Frequency]),
-             ('module_table', FeatureTable[Frequency]),
-             ('pathway_table', FeatureTable[Frequency])],
-    input_descriptions={'query': 'query sequences.',
-                        'reference_reads': 'reference sequences.',
+    parameters={},
+    outputs=[('shogun_database', ShogunDatabase)],
+    input_descriptions={'reference_reads': 'reference sequences.',
                         'reference_taxonomy': 'reference taxonomy labels.',
-                        'database': 'bowtie2 index artifact.'},
+                        'database': 'bowtie2 index of `reference_reads`.'},
+    output_descriptions={
+        'shogun_database': ('SHOGUN database of the reference, with its '
+                            'metadata.yaml.')},
+    name='Bundle a reference into a SHOGUN database',
+    description=('Lay out reference sequences, taxonomy and bowtie2 index '
+                 'as a SHOGUN database once, so that actions given it as '
+                 '`shogun_database` use it in place instead of staging the '
+                 'reference on every run.')
+)
+
+plugin.methods.register_function(
+    function=align,
+    inputs={'query': FeatureData[Sequence], 'database': Bowtie2Index,
+            'shogun_database': ShogunDatabase},
+    parameters={'threads': _parameters['threads'],
+                'percent_id': _parameters['percent_id']},
+    outputs=[('alignment', ShogunAlignment)],
+    input_descriptions={'query': 'query sequences.',
+                        'database': _reference_input_descriptions['database'],
+                        'shogun_database': _shogun_database_description},
     parameter_descriptions={
-        'taxacut': ('Minimum fraction of assignments must match top '
-                    'hit to be accepted as consensus assignment. Must '
-                    'be in range (0.0, 1.0].'),
-        'threads': 'Number of threads to use.',
+        'threads': _parameter_descriptions['threads'],
+        'percent_id': _parameter_descriptions['percent_id']},
+    output_descriptions={
+        'alignment': 'gzip-compressed SAM alignments of the query.'},
+    name='Align query sequences with bowtie2',
+    description=('Align query sequences against a reference database the '
+                 'way SHOGUN does, keeping the alignments so that taxonomy '
+                 'assignment and functional profiling can be run on them '
+                 'any number of times with `assign` and '
+                 '`functional-profile` without aligning again.'),
+    citations=[citations['langmead2012fast']]
+)
+
+
+plugin.methods.register_function(
+    function=assign,
+    inputs={'alignment': ShogunAlignment,
+            'reference_taxonomy': FeatureData[Taxonomy],
+            'taxonomy_index': TaxonomyIndex,
+            'shogun_database': ShogunDatabase},
+    parameters={**_parameters,
+                'assigner': Str % Choices(['shogun', 'native'])},
+    outputs=[('taxa_table', FeatureTable[Frequency])],
+    input_descriptions={
+        'alignment': 'alignments produced by `align`.',
+        'reference_taxonomy': _reference_input_descriptions[
+            'reference_taxonomy'],
+        'taxonomy_index': _taxonomy_index_description,
+        'shogun_database': _shogun_database_description},
+    parameter_descriptions={
+        **_parameter_descriptions,
         'percent_id': ('Reject match if percent identity to query is '
-                       'lower. Must be in range [0.0, 1.0].')
-    },
+                       'lower. Only used by the native assigner, and only '
+                       'stricter than the `percent_id` of `align` has an '
+                       'effect. Must be in range [0.0, 1.0].'),
+        'assigner': _assigner_description},
+    output_descriptions={
+        'taxa_table': 'Frequency table of taxonomic composition.'},
+    name='Assign taxonomy to SHOGUN alignments',
+    description=('LCA taxonomy assignment of alignments produced by '
+                 '`align`.')
+)
+
+
+plugin.methods.register_function(
+    function=functional_profile,
+    inputs={'alignment': ShogunAlignment, **_reference_inputs},
+    parameters={
+        'functional_levels': List[Str % Choices(FUNCTIONAL_LEVELS)]},
+    outputs=_functional_outputs,
+    input_descriptions={'alignment': 'alignments produced by `align`.',
+                        **_reference_input_descriptions},
+    parameter_descriptions={
+        'functional_levels': _functional_levels_description},
+    output_descriptions=_functional_output_descriptions,
+    name='SHOGUN functional profile of alignments',
+    description=('Profile alignments produced by `align` functionally and '
+                 'taxonomically, as minipipe does for query sequences.')
+)
+
+plugin.methods.register_function(
+    function=compile_functions,
+    inputs={'shogun_database': ShogunDatabase},
+    parameters={},
+    outputs=[('functional_annotation', FunctionalAnnotation)],
+    input_descriptions={
+        'shogun_database': ('SHOGUN database whose metadata names its '
+                            'functional annotation files (`function`).')},
+    output_descriptions={
+        'functional_annotation': ('KEGG ortholog copy numbers of the '
+                                  'reference strains and the orthologs in '
+                                  'each KEGG module and pathway.')},
+    name='Compile the functional annotation of a SHOGUN database',
+    description=('Compile the KEGG annotation files that `shogun '
+                 'functional` reads from a SHOGUN database into sparse '
+                 'matrices, for use by profile-functions.')
+)
+
+
+plugin.methods.register_function(
+    function=profile_functions,
+    inputs={'table': FeatureTable[Frequency],
+            'functional_annotation': FunctionalAnnotation},
+    parameters={'threads': _parameters['threads']},
+    outputs=_functional_outputs[1:],
+    input_descriptions={
+        'table': ('strain-level taxa table, such as the `taxa_table` of '
+                  'minipipe.'),
+        'functional_annotation': ('KEGG ortholog copy numbers of the '
+                                  'reference strains and the orthologs in '
+                                  'each KEGG module and pathway.')},
+    parameter_descriptions={
+        'threads': _parameter_descriptions['threads']},
     output_descriptions={
-        'taxa_table': 'Frequency table of taxonomic composition.',
         'kegg_table': 'Frequency table of KEGG ortholog composition.',
         'module_table': 'Frequency table of KEGG module composition.',
         'pathway_table': 'Frequency table of KEGG pathway composition.'},
-    name='SHOGUN bowtie2 taxonomy and functional profiler',
-    description=('Profile query sequences functionally and taxonomically '
-                 'via alignment with bowtie2, followed by LCA taxonomy '
-                 'assignment and functional annotation.'),
-    citations=[citations['langmead2012fast']]
+    name='Functional profile of a strain table',
+    description=('Profile a strain-level taxa table functionally without '
+                 'SHOGUN, as sparse matrix products with a precompiled '
+                 'annotation. Ortholog abundances are strain abundances '
+                 'weighted by copy number, and module and pathway '
+                 'abundances sum their orthologs, as in SHOGUN\'s '
+                 'functional tables.')
 )
+
+importlib.import_module('q2_shogun._transformer')
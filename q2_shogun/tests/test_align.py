@@ -0,0 +1,170 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import os
+import tempfile
+import unittest
+
+from q2_shogun._align import (bowtie2_build_command, bowtie2_command,
+                              bowtie2_index, bowtie2_partitions,
+                              collapse_fasta, concatenate_sam, expand_sam,
+                              merge_partition_sams, partition_fasta,
+                              split_fasta)
+
+
+class FileTestCase(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.tmp = self._tmp.name
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _write(self, name, content):
+        fp = os.path.join(self.tmp, name)
+        with open(fp, 'w') as fh:
+            fh.write(content)
+        return fp
+
+    def _read(self, fp):
+        with open(fp) as fh:
+            return fh.read()
+
+
+class TestSharding(FileTestCase):
+    def test_split_fasta(self):
+        fp = self._write('query.fna', '>s1_0\nACGT\nAC\n>s1_1\nGG\n>s2_0\nT\n')
+        shards = split_fasta(fp, 2, self.tmp)
+        self.assertEqual([self._read(s) for s in shards],
+                         ['>s1_0\nACGT\nAC\n>s2_0\nT\n', '>s1_1\nGG\n'])
+
+    def test_split_fasta_more_shards_than_records(self):
+        fp = self._write('query.fna', '>s1_0\nACGT\n>s1_1\nGG\n')
+        shards = split_fasta(fp, 4, self.tmp)
+        self.assertEqual(len(shards), 2)
+        self.assertEqual(sorted(os.listdir(self.tmp)),
+                         ['query.fna', 'shard-0.fna', 'shard-1.fna'])
+
+    def test_concatenate_sam(self):
+        header = '@HD\tVN:1.0\n@SQ\tSN:ref\tLN:10\n'
+        a = self._write('a.sam', header + 's1_0\t0\tref\n')
+        b = self._write('b.sam', header + 's1_1\t0\tref\ns2_0\t0\tref\n')
+        out = concatenate_sam([a, b], os.path.join(self.tmp, 'out.sam'))
+        self.assertEqual(self._read(out), header + 's1_0\t0\tref\n'
+                         's1_1\t0\tref\ns2_0\t0\tref\n')
+
+    def test_concatenate_headerless_sam(self):
+        a = self._write('a.sam', 's1_0\t0\tref\n')
+        b = self._write('b.sam', 's1_1\t0\tref\n')
+        out = concatenate_sam([a, b], os.path.join(self.tmp, 'out.sam'))
+        self.assertEqual(self._read(out), 's1_0\t0\tref\ns1_1\t0\tref\n')
+
+
+class TestCollapse(FileTestCase):
+    def test_collapse_fasta(self):
+        fp = self._write('query.fna', '>s1_0 desc\nACGT\nAC\n>s1_1\nGG\n'
+                                      '>s2_0\nacgtac\n>s2_1\nGG\n')
+        out = os.path.join(self.tmp, 'unique.fna')
+        counts = collapse_fasta(fp, out)
+        self.assertEqual(counts, {'s1_0': {'s1': 1, 's2': 1},
+                                  's1_1': {'s1': 1, 's2': 1}})
+        self.assertEqual(list(counts), ['s1_0', 's1_1'])
+        self.assertEqual(self._read(out), '>s1_0\nACGTAC\n>s1_1\nGG\n')
+
+    def test_expand_sam(self):
+        sam = self._write('a.sam', '@HD\tVN:1.0\ns1_0\t0\tr1\n'
+                                   's1_0\t256\tr2\ns2_4\t0\tr1\n')
+        out = expand_sam(sam, {'s1_0': {'s1': 1, 's2': 2}, 's2_4': {'s2': 1}},
+                         os.path.join(self.tmp, 'out.sam'))
+        self.assertEqual(self._read(out),
+                         '@HD\tVN:1.0\n'
+                         's1_0.0\t0\tr1\ns2_0.0\t0\tr1\ns2_0.1\t0\tr1\n'
+                         's1_0.0\t256\tr2\ns2_0.0\t256\tr2\n'
+                         's2_0.1\t256\tr2\n'
+                         's2_1.0\t0\tr1\n')
+
+
+class TestPartition(FileTestCase):
+    def test_partition_fasta(self):
+        fp = self._write('refseqs.fna',
+                         '>r1 strain 1\nACGTACGT\nAC\n>r2\nGG\n>r3\nTTT\n'
+                         '>r4\nA\n')
+        partitions = partition_fasta(fp, 2, self.tmp)
+        self.assertEqual([self._read(p) for p in partitions],
+                         ['>r1\nACGTACGTAC\n', '>r2\nGG\n>r3\nTTT\n>r4\nA\n'])
+
+    def test_partition_fasta_more_partitions_than_records(self):
+        fp = self._write('refseqs.fna', '>r1\nACGT\n')
+        partitions = partition_fasta(fp, 3, self.tmp)
+        self.assertEqual(len(partitions), 1)
+        self.assertFalse(os.path.exists(
+            os.path.join(self.tmp, 'partition-1.fna')))
+
+    def test_merge_partition_sams(self):
+        first = self._write('0.sam', (
+            'q1\t0\tr1\t1\t42\t4M\t*\t0\t0\tACGT\tIIII\tAS:i:-2\n'
+            'q1\t256\tr2\t1\t255\t4M\t*\t0\t0\tACGT\tIIII\tAS:i:-3\n'
+            'q2\t4\t*\t0\t0\t*\t*\t0\t0\tGGGG\tIIII\tYT:Z:UU\n'
+            'q3\t4\t*\t0\t0\t*\t*\t0\t0\tTTTT\tIIII\tYT:Z:UU\n'))
+        second = self._write('1.sam', (
+            'q1\t16\tr3\t1\t42\t4M\t*\t0\t0\tACGT\tIIII\tAS:i:0\n'
+            'q2\t0\tr4\t1\t42\t4M\t*\t0\t0\tGGGG\tIIII\tAS:i:-1\n'
+            'q3\t4\t*\t0\t0\t*\t*\t0\t0\tTTTT\tIIII\tYT:Z:UU\n'))
+        out = merge_partition_sams([first, second],
+                                   os.path.join(self.tmp, 'merged.sam'),
+                                   hits=2)
+        records = [line.split('\t')[:3]
+                   for line in self._read(out).splitlines()]
+        self.assertEqual(records, [['q1', '16', 'r3'], ['q1', '256', 'r1'],
+                                   ['q2', '0', 'r4']])
+
+    def test_merge_partition_sams_out_of_step(self):
+        first = self._write('0.sam', (
+            'q1\t4\t*\t0\t0\t*\t*\t0\t0\tACGT\tIIII\n'))
+        second = self._write('1.sam', (
+            'q2\t4\t*\t0\t0\t*\t*\t0\t0\tACGT\tIIII\n'))
+        with self.assertRaisesRegex(ValueError, 'same order'):
+            merge_partition_sams([first, second],
+                                 os.path.join(self.tmp, 'merged.sam'))
+
+
+class TestBowtie2(unittest.TestCase):
+    def test_bowtie2_index(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(os.path.join(tmp, 'metadata.yaml'), 'w') as fh:
+                fh.write('bowtie2: bowtie2/genomes\n')
+            self.assertEqual(bowtie2_index(tmp),
+                             os.path.join(tmp, 'bowtie2', 'genomes'))
+            with open(os.path.join(tmp, 'metadata.yaml'), 'w') as fh:
+                fh.write('bowtie2_partitions: [bowtie2/genomes.0, '
+                         'bowtie2/genomes.1]\n')
+            with self.assertRaisesRegex(ValueError, 'partitioned into 2'):
+                bowtie2_index(tmp)
+            self.assertEqual(bowtie2_partitions(tmp), [
+                os.path.join(tmp, 'bowtie2', 'genomes.%d' % i)
+                for i in range(2)])
+
+    def test_bowtie2_build_command(self):
+        self.assertEqual(bowtie2_build_command('refseqs.fna', 'db/refseqs', 8),
+                         ['bowtie2-build', '--threads', '8', 'refseqs.fna',
+                          'db/refseqs'])
+
+    def test_bowtie2_command(self):
+        cmd = bowtie2_command('db/genomes', 'q.fna', 'out.sam', 4, 0.95)
+        self.assertEqual(cmd[:5], ['bowtie2', '--no-unal', '-x',
+                                   'db/genomes', '-S'])
+        self.assertIn('L,0,-0.05', cmd)
+        self.assertEqual(cmd[cmd.index('-p') + 1], '4')
+        cmd = bowtie2_command('db/genomes', 'q.fna', 'out.sam', 4, 0.95,
+                              all_reads=True)
+        self.assertIn('--reorder', cmd)
+        self.assertNotIn('--no-unal', cmd)
+
+
+if __name__ == '__main__':
+    unittest.main()
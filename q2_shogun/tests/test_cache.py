@@ -0,0 +1,151 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from q2_shogun._cache import (DATABASE_CACHE_ENV, _DIGESTS, DirectoryCache,
+                              file_digest, fingerprint, parse_size,
+                              size_fingerprint)
+
+
+class TestFingerprint(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.tmp = self._tmp.name
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _tree(self, name, content):
+        path = os.path.join(self.tmp, name)
+        os.makedirs(path)
+        with open(os.path.join(path, 'index.1.bt2'), 'w') as fh:
+            fh.write(content)
+        return path
+
+    def test_location_independent(self):
+        self.assertEqual(fingerprint(self._tree('a', 'ACGT')),
+                         fingerprint(self._tree('b', 'ACGT')))
+
+    def test_content_dependent(self):
+        self.assertNotEqual(fingerprint(self._tree('a', 'ACGT')),
+                            fingerprint(self._tree('b', 'ACGA')))
+
+    def test_extra(self):
+        path = self._tree('a', 'ACGT')
+        self.assertNotEqual(fingerprint(path, extra=['x']),
+                            fingerprint(path, extra=[b'y']))
+
+    def test_full_content(self):
+        # large files differing in a single byte in the middle
+        a = self._tree('a', 'A' * 2 ** 21 + 'C' + 'A' * 2 ** 21)
+        b = self._tree('b', 'A' * (2 ** 22 + 1))
+        self.assertNotEqual(fingerprint(a), fingerprint(b))
+
+    def test_size_fingerprint(self):
+        self.assertEqual(size_fingerprint(self._tree('a', 'ACGT')),
+                         size_fingerprint(self._tree('b', 'ACGA')))
+        self.assertNotEqual(size_fingerprint(self._tree('c', 'ACG')),
+                            size_fingerprint(self._tree('d', 'ACGT')))
+        with mock.patch('q2_shogun._cache.file_digest',
+                        side_effect=AssertionError('read')):
+            size_fingerprint(os.path.join(self.tmp, 'a'))
+
+    def test_digests_kept_in_cache(self):
+        path = self._tree('a', 'ACGT')
+        fp = os.path.join(path, 'index.1.bt2')
+        cache = os.path.join(self.tmp, 'cache')
+        with mock.patch.dict(os.environ, {DATABASE_CACHE_ENV: cache}), \
+                mock.patch('q2_shogun._cache._digests', {}):
+            digest = file_digest(fp)
+            self.assertEqual(len(os.listdir(os.path.join(cache, _DIGESTS))),
+                             1)
+        with mock.patch.dict(os.environ, {DATABASE_CACHE_ENV: cache}), \
+                mock.patch('q2_shogun._cache._digests', {}), \
+                mock.patch('q2_shogun._cache.open', create=True,
+                           side_effect=open) as opened:
+            self.assertEqual(file_digest(fp), digest)
+            # read from the cache, not hashed again
+            opened.assert_called_once()
+            self.assertNotEqual(opened.call_args[0][0], fp)
+        with open(fp, 'w') as fh:
+            fh.write('ACGA')
+        os.utime(fp, ns=(0, 0))
+        with mock.patch.dict(os.environ, {DATABASE_CACHE_ENV: cache}):
+            self.assertNotEqual(file_digest(fp), digest)
+
+    def test_parse_size(self):
+        self.assertEqual(parse_size('1024'), 1024)
+        self.assertEqual(parse_size('2K'), 2048)
+        self.assertEqual(parse_size('1.5G'), 3 * 2 ** 29)
+        with self.assertRaisesRegex(ValueError, 'size in bytes'):
+            parse_size('lots')
+
+
+class TestDirectoryCache(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = self._tmp.name
+        self.builds = []
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _build(self, size):
+        def build(path):
+            self.builds.append(os.path.basename(path))
+            with open(os.path.join(path, 'data'), 'wb') as fh:
+                fh.write(b'0' * size)
+        return build
+
+    def test_hit_skips_build(self):
+        cache = DirectoryCache(self.root)
+        with cache.acquire('a', self._build(10)) as path:
+            first = path
+        with cache.acquire('a', self._build(10)) as path:
+            self.assertEqual(path, first)
+            self.assertTrue(os.path.exists(os.path.join(path, 'data')))
+        self.assertEqual(self.builds, ['a'])
+
+    def test_failed_build_is_not_cached(self):
+        def fail(path):
+            raise RuntimeError('boom')
+
+        cache = DirectoryCache(self.root)
+        with self.assertRaisesRegex(RuntimeError, 'boom'):
+            with cache.acquire('a', fail):
+                pass
+        with cache.acquire('a', self._build(10)):
+            pass
+        self.assertEqual(self.builds, ['a'])
+
+    def test_lru_eviction(self):
+        cache = DirectoryCache(self.root, max_bytes=25)
+        for key in 'abc':
+            with cache.acquire(key, self._build(10)):
+                pass
+            # make access order unambiguous despite coarse mtimes
+            os.utime(os.path.join(self.root, key, '.complete'),
+                     (len(self.builds), len(self.builds)))
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'a')))
+        self.assertTrue(os.path.exists(os.path.join(self.root, 'b')))
+        self.assertTrue(os.path.exists(os.path.join(self.root, 'c')))
+
+    def test_entry_in_use_is_not_evicted(self):
+        cache = DirectoryCache(self.root, max_bytes=15)
+        with cache.acquire('a', self._build(10)) as held:
+            with cache.acquire('b', self._build(10)):
+                pass
+            self.assertTrue(os.path.exists(os.path.join(held, 'data')))
+
+
+if __name__ == '__main__':
+    unittest.main()
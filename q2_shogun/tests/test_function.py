@@ -0,0 +1,117 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import biom
+import numpy as np
+
+from q2_shogun import _function
+from q2_shogun._function import (StrainFunctions, functional_tables,
+                                 read_shogun_functions)
+
+
+def annotation():
+    # KO copy numbers of three strains, K3 is in no strain of the table
+    return StrainFunctions(
+        ['k__A;t__1', 'k__A;t__2', 'k__B;t__3'], ['K1', 'K2', 'K3'],
+        np.array([[1, 2, 0], [0, 1, 0], [0, 0, 4]]),
+        ['M1', 'M2'], np.array([[1, 0], [1, 1], [0, 1]]),
+        ['P1'], np.array([[1], [0], [1]]))
+
+
+class TestFunctionalTables(unittest.TestCase):
+    def setUp(self):
+        self.table = biom.Table(np.array([[2., 0., 1.], [1., 3., 0.],
+                                          [5., 5., 5.]]),
+                                ['k__A;t__1', 'k__A;t__2', 'k__Z;t__9'],
+                                ['s1', 's2', 's3'])
+
+    def test_functional_tables(self):
+        kos, modules, pathways = functional_tables(self.table, annotation())
+        self.assertEqual(kos, biom.Table(np.array([[2., 0., 1.],
+                                                   [5., 3., 2.]]),
+                                         ['K1', 'K2'], ['s1', 's2', 's3']))
+        self.assertEqual(modules, biom.Table(np.array([[7., 3., 3.],
+                                                       [5., 3., 2.]]),
+                                             ['M1', 'M2'],
+                                             ['s1', 's2', 's3']))
+        self.assertEqual(pathways, biom.Table(np.array([[2., 0., 1.]]),
+                                              ['P1'], ['s1', 's2', 's3']))
+
+    def test_threads(self):
+        expected = functional_tables(self.table, annotation())
+        with mock.patch.object(_function, '_BLOCK_SAMPLES', 1):
+            observed = functional_tables(self.table, annotation(),
+                                         threads=3)
+        self.assertEqual(observed, expected)
+
+    def test_no_samples(self):
+        table = biom.Table(np.zeros((1, 0)), ['k__A;t__1'], [])
+        for observed in functional_tables(table, annotation()):
+            self.assertEqual(observed.shape, (0, 0))
+
+    def test_shape_mismatch(self):
+        with self.assertRaisesRegex(ValueError, 'does not match'):
+            StrainFunctions(['t1'], ['K1'], np.ones((1, 2)), [],
+                            np.zeros((1, 0)), [], np.zeros((1, 0)))
+
+
+class TestReadShogunFunctions(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.dbdir = self._tmp.name
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _write(self, name, content):
+        fp = os.path.join(self.dbdir, name)
+        os.makedirs(os.path.dirname(fp), exist_ok=True)
+        with open(fp, 'w') as fh:
+            fh.write(content)
+
+    def test_read(self):
+        # the annotation of annotation(), as SHOGUN lays it out
+        self._write('metadata.yaml', 'general:\n  taxonomy: taxa.tsv\n'
+                    'function: function/ko\n')
+        self._write('function/ko-strain2ko.tsv',
+                    '\tK1\tK2\tK3\n'
+                    'k__A;t__1\t1\t2\t0\n'
+                    'k__A;t__2\t0\t1\t0\n'
+                    'k__B;t__3\t0\t0\t4\n')
+        self._write('function/ko-module-annotations.txt',
+                    'K1\tM00001\tGlycolysis\n'
+                    'K2\tM00001;M00002\n'
+                    'K3\tM00002\n'
+                    'K9\tM00003\n')
+        self._write('function/ko-pathway-annotations.txt',
+                    'K1\tmap00010\n'
+                    'K3\tmap00010\tmap00010\n')
+        observed = read_shogun_functions(self.dbdir)
+        self.assertEqual(list(observed.modules), ['M00001', 'M00002'])
+        self.assertEqual(list(observed.pathways), ['map00010'])
+        expected = annotation()
+        for name in ('strain_kos', 'ko_modules', 'ko_pathways'):
+            np.testing.assert_array_equal(
+                getattr(observed, name).toarray(),
+                getattr(expected, name).toarray())
+        self.assertEqual(list(observed.strains), list(expected.strains))
+        self.assertEqual(list(observed.kos), list(expected.kos))
+
+    def test_no_function(self):
+        self._write('metadata.yaml', 'general:\n  taxonomy: taxa.tsv\n')
+        with self.assertRaisesRegex(ValueError, 'no functional'):
+            read_shogun_functions(self.dbdir)
+
+
+if __name__ == '__main__':
+    unittest.main()
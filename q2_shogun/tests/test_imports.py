@@ -0,0 +1,64 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import subprocess
+import sys
+import unittest
+
+
+# packages that are only imported once an action runs
+DEFERRED = {'biom', 'h5py', 'scipy', 'yaml'}
+
+# modules the plugin imports that do not annotate actions
+HELPERS = ['q2_shogun._align', 'q2_shogun._cache', 'q2_shogun._function',
+           'q2_shogun._instrument', 'q2_shogun._lca', 'q2_shogun._query',
+           'q2_shogun._resources', 'q2_shogun._scratch',
+           'q2_shogun._staging', 'q2_shogun._table']
+
+FRAMEWORK = ['qiime2.plugin', 'q2_types.feature_data',
+             'q2_types.feature_table', 'q2_types.bowtie2']
+
+
+def importtime(*modules):
+    '''Cumulative import time in microseconds of every module imported by
+    importing ``modules`` in a fresh interpreter, from ``-X importtime``'''
+    stderr = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c',
+         'import ' + ', '.join(modules)],
+        capture_output=True, text=True, check=True).stderr
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def packages(names):
+    return {name.split('.')[0] for name in names}
+
+
+class TestImportTime(unittest.TestCase):
+    def test_helpers_defer_heavy_imports(self):
+        times = importtime(*HELPERS)
+        self.assertIn('q2_shogun._lca', times)
+        self.assertEqual(packages(times) & DEFERRED, set())
+
+    def test_plugin_adds_no_heavy_imports(self):
+        # the framework loads its own modules anyway while enumerating
+        # plugins, so only what the plugin adds on top of them counts
+        framework = importtime(*FRAMEWORK)
+        plugin = importtime(*FRAMEWORK, 'q2_shogun.plugin_setup')
+        added = packages(set(plugin) - set(framework))
+        self.assertIn('q2_shogun', added)
+        self.assertEqual(added & (DEFERRED | {'numpy', 'pandas'}), set())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from q2_shogun._instrument import REPORT_ENV, report, stage
+
+
+class TestReport(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.tmp = self._tmp.name
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _run(self):
+        with report('nobunaga', threads=2) as run:
+            with stage('align'):
+                subprocess.run([sys.executable, '-c', 'sum(range(10**6))'],
+                               check=True)
+            with stage('load-table'):
+                pass
+        return run
+
+    def test_stages(self):
+        with mock.patch.dict(os.environ, {REPORT_ENV: ''}):
+            run = self._run()
+        self.assertEqual([s['stage'] for s in run['stages']],
+                         ['align', 'load-table'])
+        align = run['stages'][0]
+        self.assertGreater(align['wall_seconds'], 0)
+        self.assertGreater(align['children_user_seconds'] +
+                           align['children_system_seconds'], 0)
+        self.assertGreater(align['children_peak_rss_kib'], 0)
+        self.assertEqual(run['parameters'], {'threads': 2})
+        self.assertEqual(run['total']['stage'], 'nobunaga')
+
+    def test_report_file(self):
+        fp = os.path.join(self.tmp, 'report.json')
+        with mock.patch.dict(os.environ, {REPORT_ENV: fp}):
+            self._run()
+        with open(fp) as fh:
+            self.assertEqual(len(json.load(fh)['stages']), 2)
+
+    def test_report_dir(self):
+        with mock.patch.dict(os.environ, {REPORT_ENV: self.tmp}):
+            self._run()
+        reports, = os.listdir(self.tmp)
+        self.assertTrue(reports.startswith('nobunaga-'))
+
+    def test_stage_outside_report(self):
+        with stage('align'):
+            pass
+
+
+if __name__ == '__main__':
+    unittest.main()
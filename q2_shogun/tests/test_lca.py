@@ -0,0 +1,130 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import unittest
+
+import biom
+import numpy as np
+import pandas as pd
+
+from q2_shogun._lca import (LineageIndex, assign_lca, assign_lca_grid,
+                            parse_sam, taxonomy_fingerprint)
+
+
+TAXONOMY = pd.Series({'r1': 'k__A;p__B;c__C',
+                      'r2': 'k__A;p__B;c__D',
+                      'r3': 'k__A;p__E',
+                      'r4': 'k__Z;p__Y;c__X'})
+
+
+def _record(qname, rname, nm=0, flag=0):
+    return '%s\t%d\t%s\t1\t42\t4M\t*\t0\t0\tACGT\tIIII\tAS:i:0\tNM:i:%d\n' % (
+        qname, flag, rname, nm)
+
+
+SAM = ['@HD\tVN:1.0\n',
+       _record('s1_0', 'r1'), _record('s1_0', 'r2', flag=256),
+       _record('s1_1', 'r1', nm=1),
+       _record('s2_0', 'r1'), _record('s2_0', 'r4'),
+       _record('s2_1', 'r3'), _record('s2_1', 'unknown'),
+       _record('s2_2', 'r1'), _record('s2_2', 'r1'), _record('s2_2', 'r2')]
+
+
+class TestLineageIndex(unittest.TestCase):
+    def test_from_taxonomy(self):
+        index = LineageIndex.from_taxonomy(TAXONOMY)
+        labels = index.labels[index.lineages]
+        self.assertEqual(list(labels[2, :2]), ['k__A', 'k__A;p__E'])
+        self.assertEqual(index.lineages[2, 2], -1)
+        # shared prefixes share codes
+        self.assertEqual(list(index.lineages[0, :2]),
+                         list(index.lineages[1, :2]))
+        self.assertNotEqual(index.lineages[0, 2], index.lineages[1, 2])
+        self.assertEqual(list(index.rows(['r3', 'nope'])), [2, -1])
+
+    def test_source(self):
+        index = LineageIndex.from_taxonomy(TAXONOMY)
+        self.assertEqual(index.source, taxonomy_fingerprint(TAXONOMY))
+        edited = TAXONOMY.copy()
+        edited['r4'] = 'k__Z;p__Y;c__W'
+        self.assertNotEqual(taxonomy_fingerprint(edited), index.source)
+        self.assertNotEqual(taxonomy_fingerprint(TAXONOMY[:3]), index.source)
+
+
+class TestAssignLCA(unittest.TestCase):
+    def setUp(self):
+        self.index = LineageIndex.from_taxonomy(TAXONOMY)
+
+    def assertTableEqual(self, observed, data, obs_ids, sample_ids):
+        expected = biom.Table(np.array(data), obs_ids, sample_ids)
+        observed = observed.sort_order(obs_ids, axis='observation')
+        observed = observed.sort_order(sample_ids)
+        self.assertEqual(observed, expected)
+
+    def test_parse_sam(self):
+        qnames, rnames, identity = parse_sam(SAM[:4])
+        self.assertEqual(list(qnames), ['s1_0', 's1_0', 's1_1'])
+        self.assertEqual(list(rnames), ['r1', 'r2', 'r1'])
+        np.testing.assert_allclose(identity, [1., 1., .75])
+
+    def test_strict_lca(self):
+        obs_ids = ['k__A;p__B', 'k__A;p__B;c__C', 'k__A;p__E']
+        for workers in (1, 2):
+            for chunk_reads in (1, 100):
+                table = assign_lca(SAM, self.index, taxacut=1.0,
+                                   workers=workers, chunk_reads=chunk_reads)
+                self.assertTableEqual(table, [[1, 1], [1, 0], [0, 1]],
+                                      obs_ids, ['s1', 's2'])
+
+    def test_taxacut(self):
+        # s2_2 descends to c__C with 2 of 3 hits, s1_0 does not with 1 of 2
+        table = assign_lca(SAM, self.index, taxacut=0.6)
+        self.assertTableEqual(table, [[1, 0], [1, 1], [0, 1]],
+                              ['k__A;p__B', 'k__A;p__B;c__C', 'k__A;p__E'],
+                              ['s1', 's2'])
+
+    def test_taxacut_zero(self):
+        # lineages of r1 and r3 have three and two ranks
+        sam = [_record('s1_0', 'r3'),
+               _record('s1_1', 'r3'), _record('s1_1', 'r1'),
+               _record('s1_2', 'r1'), _record('s1_2', 'r4')]
+        table = assign_lca(sam, self.index, taxacut=0.0)
+        self.assertTableEqual(table, [[2], [1]],
+                              ['k__A;p__E', 'k__A;p__B;c__C'], ['s1'])
+
+    def test_percent_id(self):
+        table = assign_lca(SAM[:4], self.index, percent_id=0.9)
+        self.assertTableEqual(table, [[1]], ['k__A;p__B'], ['s1'])
+
+    def test_collapsed_reads(self):
+        sam = [_record('s1_0', 'r1'), _record('s1_0', 'r2'),
+               _record('s1_1', 'r3')]
+        members = {'s1_0': {'s1': 1, 's2': 2}, 's1_1': {'s1': 1}}
+        for workers in (1, 2):
+            table = assign_lca(sam, self.index, workers=workers,
+                               members=members)
+            self.assertTableEqual(table, [[1, 2], [1, 0]],
+                                  ['k__A;p__B', 'k__A;p__E'], ['s1', 's2'])
+
+    def test_grid(self):
+        grid = [(1.0, 0.0), (0.6, 0.0), (1.0, 0.9)]
+        for workers in (1, 2):
+            tables = assign_lca_grid(SAM, self.index, grid, workers=workers,
+                                     chunk_reads=1)
+            for table, (taxacut, percent_id) in zip(tables, grid):
+                expected = assign_lca(SAM, self.index, taxacut=taxacut,
+                                      percent_id=percent_id)
+                self.assertEqual(table, expected)
+
+    def test_empty(self):
+        table = assign_lca(SAM[:1], self.index)
+        self.assertTrue(table.is_empty())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import gzip
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from q2_shogun._query import (COMPRESSION_RATIO, QueryFASTA,
+                              decompress_command, is_bgzf, is_gzip,
+                              query_pipe, query_size)
+
+
+FASTA = '>S1_0\nACGTACGT\n>S2_0\nTTGCA\n' * 100
+
+
+class TestQueryPipe(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.tmp = self._tmp.name
+        self.plain = os.path.join(self.tmp, 'query.fasta')
+        with open(self.plain, 'w') as fh:
+            fh.write(FASTA)
+        self.compressed = os.path.join(self.tmp, 'query.fasta.gz')
+        with gzip.open(self.compressed, 'wt') as fh:
+            fh.write(FASTA)
+        self.outdir = os.path.join(self.tmp, 'out')
+        os.mkdir(self.outdir)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_detect(self):
+        self.assertFalse(is_gzip(self.plain))
+        self.assertTrue(is_gzip(QueryFASTA(self.compressed)))
+        self.assertFalse(is_bgzf(self.compressed))
+        self.assertEqual(query_size(self.plain), len(FASTA))
+        self.assertEqual(query_size(self.compressed), COMPRESSION_RATIO *
+                         os.path.getsize(self.compressed))
+
+    def test_decompress_command(self):
+        bgzf = os.path.join(self.tmp, 'query.fasta.bgz')
+        with open(bgzf, 'wb') as fh:
+            # gzip header with the BGZF extra subfield
+            fh.write(b'\x1f\x8b\x08\x04' + bytes(6) + b'\x06\x00BC')
+        self.assertTrue(is_bgzf(bgzf))
+        with mock.patch('q2_shogun._query.shutil.which', return_value='x'):
+            self.assertEqual(decompress_command(bgzf, 4)[:2], ['bgzip', '-d'])
+            self.assertEqual(decompress_command(self.compressed, 4),
+                             ['pigz', '-d', '-c', '-p', '4', self.compressed])
+        with mock.patch('q2_shogun._query.shutil.which', return_value=None):
+            self.assertIsNone(decompress_command(bgzf, 4))
+
+    def test_plain_query(self):
+        with query_pipe(self.plain, self.outdir) as fp:
+            self.assertEqual(fp, self.plain)
+
+    def _read_pipe(self):
+        with query_pipe(self.compressed, self.outdir, threads=2) as fp:
+            self.assertEqual(os.path.dirname(fp), self.outdir)
+            with open(fp) as fh:
+                self.assertEqual(fh.read(), FASTA)
+        self.assertEqual(os.listdir(self.outdir), [])
+
+    def test_compressed_query(self):
+        self._read_pipe()
+
+    def test_compressed_query_without_tools(self):
+        with mock.patch('q2_shogun._query.shutil.which', return_value=None):
+            self._read_pipe()
+
+    def test_pipe_never_read(self):
+        # e.g. an aligner that failed before opening its input
+        with self.assertRaisesRegex(RuntimeError, 'aligner'):
+            with query_pipe(self.compressed, self.outdir):
+                raise RuntimeError('aligner failed')
+        self.assertEqual(os.listdir(self.outdir), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
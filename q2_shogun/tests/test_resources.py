@@ -0,0 +1,83 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from q2_shogun import _resources
+from q2_shogun._resources import (available_cpus, available_memory,
+                                  cgroup_cpu_limit, resolve_threads,
+                                  resolve_workers)
+
+
+class TestResources(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.tmp = self._tmp.name
+        root = os.path.join(self.tmp, 'cgroup')
+        os.mkdir(root)
+        self._write('meminfo', 'MemTotal: 8000 kB\nMemAvailable: 4000 kB\n')
+        self._write('proc-cgroup', '0::/\n')
+        for name, value in [('_CGROUP_ROOT', root),
+                            ('_PROC_CGROUP', os.path.join(self.tmp,
+                                                          'proc-cgroup')),
+                            ('_MEMINFO', os.path.join(self.tmp, 'meminfo'))]:
+            patcher = mock.patch.object(_resources, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _write(self, path, content):
+        fp = os.path.join(self.tmp, path)
+        os.makedirs(os.path.dirname(fp), exist_ok=True)
+        with open(fp, 'w') as fh:
+            fh.write(content)
+
+    def test_unlimited(self):
+        self._write('cgroup/cpu.max', 'max 100000\n')
+        self.assertIsNone(cgroup_cpu_limit())
+        self.assertEqual(available_memory(), 4000 * 1024)
+
+    def test_cgroup_v2(self):
+        self._write('proc-cgroup', '0::/job\n')
+        self._write('cgroup/job/cpu.max', '250000 100000\n')
+        self._write('cgroup/job/memory.max', '3072000\n')
+        self._write('cgroup/job/memory.current', '1024000\n')
+        self.assertEqual(cgroup_cpu_limit(), 2.5)
+        self.assertEqual(available_memory(), 2048000)
+        with mock.patch('os.sched_getaffinity', return_value={0, 1, 2, 3}):
+            self.assertEqual(available_cpus(), 2)
+
+    def test_cgroup_v1(self):
+        self._write('proc-cgroup', '2:cpu,cpuacct:/job\n1:memory:/job\n')
+        self._write('cgroup/cpu,cpuacct/job/cpu.cfs_quota_us', '-1\n')
+        self._write('cgroup/cpu,cpuacct/cpu.cfs_quota_us', '50000\n')
+        self._write('cgroup/cpu,cpuacct/cpu.cfs_period_us', '100000\n')
+        self._write('cgroup/memory/job/memory.limit_in_bytes',
+                    '%d\n' % 2 ** 63)
+        self.assertEqual(cgroup_cpu_limit(), 0.5)
+        self.assertEqual(available_memory(), 4000 * 1024)
+        # a fractional CPU still runs one thread
+        self.assertEqual(available_cpus(), 1)
+
+    def test_resolve(self):
+        self.assertEqual(resolve_threads(3), 3)
+        with mock.patch('os.sched_getaffinity', return_value={0, 1, 2}):
+            self.assertEqual(resolve_threads('auto'), 3)
+        self.assertEqual(resolve_workers(4, 2, 8), 2)
+        # memory for 3 index copies
+        self.assertEqual(resolve_workers('auto', 10, 8, 1300 * 1024), 3)
+        self.assertEqual(resolve_workers('auto', 10, 8, 10 ** 12), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
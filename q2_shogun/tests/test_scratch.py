@@ -0,0 +1,109 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from q2_shogun._scratch import (INDEX_SCRATCH_ENV, SCRATCH_ENV,
+                                Intermediates, check_free_space, copy_bytes,
+                                scratch_dir, scratch_root)
+
+
+class TestScratch(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.tmp = self._tmp.name
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_scratch_root(self):
+        scratch = os.path.join(self.tmp, 'scratch')
+        index = os.path.join(self.tmp, 'index')
+        with mock.patch.dict(os.environ, {SCRATCH_ENV: scratch}):
+            self.assertEqual(scratch_root(), scratch)
+            self.assertEqual(scratch_root(index=True), scratch)
+            with mock.patch.dict(os.environ, {INDEX_SCRATCH_ENV: index}):
+                self.assertEqual(scratch_root(), scratch)
+                self.assertEqual(scratch_root(index=True), index)
+        self.assertTrue(os.path.isdir(index))
+
+    def test_scratch_dir(self):
+        with mock.patch.dict(os.environ, {SCRATCH_ENV: self.tmp}):
+            with scratch_dir() as path:
+                self.assertEqual(os.path.dirname(path), self.tmp)
+            self.assertFalse(os.path.exists(path))
+
+    def test_copy_bytes_same_device(self):
+        fp = os.path.join(self.tmp, 'index.1.bt2')
+        with open(fp, 'w') as fh:
+            fh.write('ACGT')
+        self.assertEqual(copy_bytes([fp], self.tmp), 0)
+
+    def test_check_free_space(self):
+        check_free_space(self.tmp, 0, 'alignments')
+        with self.assertRaisesRegex(OSError, 'space.*for alignments'):
+            check_free_space(self.tmp, 2 ** 60, 'alignments')
+
+    def test_intermediates(self):
+        query = os.path.join(self.tmp, 'query.fna')
+        staged = os.path.join(self.tmp, 'staged.fna')
+        sam = os.path.join(self.tmp, 'alignment.sam')
+        with open(query, 'w') as fh:
+            fh.write('A' * 100)
+        # hardlinks of a file take its space once
+        os.link(query, staged)
+        intermediates = Intermediates(self.tmp)
+        intermediates.produced(query, staged)
+        self.assertEqual(intermediates.peak, 100)
+        with open(sam, 'w') as fh:
+            fh.write('A' * 300)
+        intermediates.produced(sam)
+        intermediates.consumed(query, staged)
+        self.assertFalse(os.path.exists(query))
+        self.assertEqual(intermediates.peak, 400)
+        shards = os.path.join(self.tmp, 'shards')
+        os.mkdir(shards)
+        with open(os.path.join(shards, 'shard-0.sam'), 'w') as fh:
+            fh.write('A' * 50)
+        intermediates.produced(shards)
+        intermediates.consumed(sam, shards)
+        self.assertEqual(os.listdir(self.tmp), [])
+        self.assertEqual(intermediates.peak, 400)
+
+    def test_intermediates_linked_from_elsewhere(self):
+        artifact = os.path.join(self.tmp, 'artifact.fna')
+        scratch = os.path.join(self.tmp, 'scratch')
+        os.mkdir(scratch)
+        with open(artifact, 'w') as fh:
+            fh.write('A' * 100)
+        staged = os.path.join(scratch, 'refseqs.fna')
+        os.link(artifact, staged)
+        intermediates = Intermediates(scratch)
+        intermediates.produced(staged)
+        self.assertEqual(intermediates.peak, 0)
+        # once every link is in scratch, the file is scratch's alone
+        os.remove(artifact)
+        intermediates.observe()
+        self.assertEqual(intermediates.peak, 100)
+
+    def test_intermediates_without_roots(self):
+        fp = os.path.join(self.tmp, 'alignment.sam')
+        with open(fp, 'w') as fh:
+            fh.write('A' * 300)
+        intermediates = Intermediates()
+        intermediates.produced(fp)
+        intermediates.consumed(fp)
+        self.assertFalse(os.path.exists(fp))
+        self.assertEqual(intermediates.peak, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,13 +6,32 @@
 # The full license is in the file LICENSE, distributed with this software.
 # ----------------------------------------------------------------------------
 
+import gzip
+import json
+import os
 import unittest
+from unittest import mock
 from warnings import filterwarnings
 
 import qiime2
 import biom
+import numpy as np
+import pandas as pd
 from qiime2.plugins import shogun
+from qiime2.plugin import ValidationError
 from qiime2.plugin.testing import TestPluginBase
+from q2_types.bowtie2 import Bowtie2IndexDirFmt
+from q2_types.feature_data import DNAFASTAFormat
+
+from q2_shogun._format import (DNAFASTAGzFormat, FunctionalAnnotationDirFmt,
+                               NumpyArrayFormat, SAMGzFormat,
+                               ShogunDatabaseDirFmt, TaxonomyIndexDirFmt)
+from q2_shogun._function import StrainFunctions
+from q2_shogun._lca import LineageIndex
+from q2_shogun._scratch import INDEX_SCRATCH_ENV
+from q2_shogun._shogun import (FUNCTIONAL_LEVELS, _check_sweep_values,
+                               _run_command, database_dir, run_functional,
+                               shogun_functional_tables)
 
 filterwarnings("ignore", category=UserWarning)
 filterwarnings("ignore", category=RuntimeWarning)
@@ -33,14 +52,11 @@ class TestShogun(TestPluginBase):
         self.taxonomy = _load('taxonomy.qza')
         self.taxatable = _load('taxatable.qza')
 
-    def test_nobunaga(self):
-        taxa = shogun.actions.nobunaga(
-            query=self.query, reference_reads=self.refseqs,
-            reference_taxonomy=self.taxonomy, database=self.database)
-        observed_taxa_table = taxa.taxa_table.view(biom.Table).\
+    def assertTaxaTableEqual(self, observed, expected):
+        observed_taxa_table = observed.view(biom.Table).\
             sort(axis='observation').sort(axis='sample')
 
-        expected_taxa_table = self.taxatable.view(biom.Table).\
+        expected_taxa_table = expected.view(biom.Table).\
             sort(axis='observation').sort(axis='sample')
 
         observed_feature_ids = set(observed_taxa_table.ids(axis='observation'))
@@ -54,6 +70,535 @@ class TestShogun(TestPluginBase):
         report = observed_taxa_table.descriptive_equality(expected_taxa_table)
         self.assertIn('Tables appear equal', report, report)
 
+    def test_nobunaga(self):
+        taxa = shogun.actions.nobunaga(
+            query=self.query, reference_reads=self.refseqs,
+            reference_taxonomy=self.taxonomy, database=self.database)
+        self.assertTaxaTableEqual(taxa.taxa_table, self.taxatable)
+
+    def test_nobunaga_sharded(self):
+        taxa = shogun.actions.nobunaga(
+            query=self.query, reference_reads=self.refseqs,
+            reference_taxonomy=self.taxonomy, database=self.database,
+            threads=2, shards=3)
+        self.assertTaxaTableEqual(taxa.taxa_table, self.taxatable)
+
+    def test_nobunaga_streaming(self):
+        taxa = shogun.actions.nobunaga(
+            query=self.query, reference_reads=self.refseqs,
+            reference_taxonomy=self.taxonomy, database=self.database,
+            streaming=True)
+        self.assertTaxaTableEqual(taxa.taxa_table, self.taxatable)
+
+    def test_nobunaga_reports_peak_scratch(self):
+        fp = os.path.join(self.temp_dir.name, 'report.json')
+        with mock.patch.dict(os.environ, {'Q2_SHOGUN_REPORT': fp}):
+            for options in ({'shards': 3, 'threads': 2},
+                            {'streaming': True},
+                            {'streaming': True, 'assigner': 'native'}):
+                shogun.actions.nobunaga(
+                    query=self.query, reference_reads=self.refseqs,
+                    reference_taxonomy=self.taxonomy, database=self.database,
+                    **options)
+                with open(fp) as fh:
+                    peak = json.load(fh)['peak_scratch_bytes']
+                # sharded runs hold the query and its alignments at once
+                if 'shards' in options:
+                    self.assertGreater(peak, 2 * os.path.getsize(
+                        str(self.query.view(DNAFASTAFormat))))
+
+    def test_nobunaga_streaming_sharded(self):
+        with self.assertRaisesRegex(ValueError, 'Streaming.*shards'):
+            shogun.actions.nobunaga(
+                query=self.query, reference_reads=self.refseqs,
+                reference_taxonomy=self.taxonomy, database=self.database,
+                streaming=True, shards=2)
+
+    def _compressed_query(self):
+        dirfmt = os.path.join(self.temp_dir.name, 'compressed-query')
+        os.mkdir(dirfmt)
+        with open(str(self.query.view(DNAFASTAFormat)), 'rb') as src, \
+                gzip.open(os.path.join(dirfmt, 'dna-sequences.fasta.gz'),
+                          'wb') as dst:
+            dst.write(src.read())
+        return qiime2.Artifact.import_data(
+            'FeatureData[CompressedSequence]', dirfmt)
+
+    def test_nobunaga_compressed_query(self):
+        query = self._compressed_query()
+        for streaming in (False, True):
+            taxa = shogun.actions.nobunaga(
+                query=query, reference_reads=self.refseqs,
+                reference_taxonomy=self.taxonomy, database=self.database,
+                streaming=streaming)
+            self.assertTaxaTableEqual(taxa.taxa_table, self.taxatable)
+        with self.assertRaisesRegex(ValueError, 'compressed.*shards'):
+            shogun.actions.nobunaga(
+                query=query, reference_reads=self.refseqs,
+                reference_taxonomy=self.taxonomy, database=self.database,
+                shards=2)
+
+    def test_invalid_compressed_query(self):
+        fp = os.path.join(self.temp_dir.name, 'query.fasta.gz')
+        with gzip.open(fp, 'wt') as fh:
+            fh.write('>S1_0\nACGT\nnot a sequence\n')
+        with self.assertRaisesRegex(ValidationError, 'Line 3'):
+            DNAFASTAGzFormat(fp, mode='r').validate()
+
+    def test_nobunaga_native(self):
+        for streaming in (False, True):
+            taxa = shogun.actions.nobunaga(
+                query=self.query, reference_reads=self.refseqs,
+                reference_taxonomy=self.taxonomy, database=self.database,
+                taxacut=1.0, threads=2, streaming=streaming,
+                assigner='native')
+            self.assertTaxaTableEqual(taxa.taxa_table, self.taxatable)
+
+    def test_nobunaga_taxonomy_index(self):
+        index, = shogun.actions.compile_taxonomy(
+            reference_taxonomy=self.taxonomy)
+        taxa = shogun.actions.nobunaga(
+            query=self.query, reference_reads=self.refseqs,
+            reference_taxonomy=self.taxonomy, database=self.database,
+            taxacut=1.0, assigner='native', taxonomy_index=index)
+        self.assertTaxaTableEqual(taxa.taxa_table, self.taxatable)
+
+    def test_nobunaga_taxonomy_index_of_other_taxonomy(self):
+        taxonomy = self.taxonomy.view(pd.Series)
+        index, = shogun.actions.compile_taxonomy(
+            reference_taxonomy=qiime2.Artifact.import_data(
+                'FeatureData[Taxonomy]', taxonomy[1:]))
+        with self.assertRaisesRegex(ValueError, 'not compiled from'):
+            shogun.actions.nobunaga(
+                query=self.query, reference_reads=self.refseqs,
+                reference_taxonomy=self.taxonomy, database=self.database,
+                assigner='native', taxonomy_index=index)
+
+    def test_shogun_database_taxonomy_index(self):
+        bundle, = shogun.actions.bundle_database(
+            reference_reads=self.refseqs, reference_taxonomy=self.taxonomy,
+            database=self.database)
+        index, = shogun.actions.compile_taxonomy(
+            reference_taxonomy=self.taxonomy)
+        # checked against the fingerprint recorded in the bundle
+        with mock.patch('q2_shogun._shogun.read_database_taxonomy',
+                        side_effect=AssertionError('read')):
+            taxa, = shogun.actions.nobunaga(
+                query=self.query, shogun_database=bundle, taxacut=1.0,
+                assigner='native', taxonomy_index=index)
+        self.assertTaxaTableEqual(taxa, self.taxatable)
+        other, = shogun.actions.compile_taxonomy(
+            reference_taxonomy=qiime2.Artifact.import_data(
+                'FeatureData[Taxonomy]', self.taxonomy.view(pd.Series)[1:]))
+        with self.assertRaisesRegex(ValueError, 'not compiled from'):
+            shogun.actions.nobunaga(
+                query=self.query, shogun_database=bundle, assigner='native',
+                taxonomy_index=other)
+
+    def test_nobunaga_taxonomy_index_needs_native(self):
+        index, = shogun.actions.compile_taxonomy(
+            reference_taxonomy=self.taxonomy)
+        with self.assertRaisesRegex(ValueError, 'native assigner'):
+            shogun.actions.nobunaga(
+                query=self.query, reference_reads=self.refseqs,
+                reference_taxonomy=self.taxonomy, database=self.database,
+                taxonomy_index=index)
+
+    def _split_query(self, *groups):
+        '''Query artifacts of each group of samples, or of each sample'''
+        seqs = self.query.view(pd.Series)
+        samples = seqs.index.str.rsplit('_', n=1).str[0]
+        groups = groups or [[sample] for sample in sorted(set(samples))]
+        return [qiime2.Artifact.import_data('FeatureData[Sequence]',
+                                            seqs[samples.isin(group)])
+                for group in groups]
+
+    def test_nobunaga_collapse_duplicates(self):
+        seqs = self.query.view(pd.Series)
+        # every read of sample1 also occurs in sample4
+        duplicated = pd.concat([seqs, seqs[seqs.index.str.startswith(
+            'sample1_')].rename(lambda i: i.replace('sample1', 'sample4'))])
+        query = qiime2.Artifact.import_data('FeatureData[Sequence]',
+                                            duplicated)
+        expected, = shogun.actions.nobunaga(
+            query=query, reference_reads=self.refseqs,
+            reference_taxonomy=self.taxonomy, database=self.database)
+        for assigner, streaming in [('shogun', False), ('native', False),
+                                    ('native', True)]:
+            taxa, = shogun.actions.nobunaga(
+                query=query, reference_reads=self.refseqs,
+                reference_taxonomy=self.taxonomy, database=self.database,
+                taxacut=1.0, assigner=assigner, streaming=streaming,
+                collapse_duplicates=True)
+            self.assertTaxaTableEqual(taxa, expected)
+
+    def test_nobunaga_batch(self):
+        taxa = shogun.actions.nobunaga_batch(
+            queries=self._split_query(), reference_reads=self.refseqs,
+            reference_taxonomy=self.taxonomy, database=self.database,
+            threads=2, workers=2)
+        self.assertTaxaTableEqual(taxa.taxa_table, self.taxatable)
+
+    def test_nobunaga_batch_aligns_once(self):
+        run = mock.Mock(wraps=_run_command)
+        with mock.patch('q2_shogun._shogun._run_command', run):
+            taxa = shogun.actions.nobunaga_batch(
+                queries=self._split_query(), reference_reads=self.refseqs,
+                reference_taxonomy=self.taxonomy, database=self.database)
+        self.assertTaxaTableEqual(taxa.taxa_table, self.taxatable)
+        # one bowtie2 run, which loads the index once, for all queries
+        aligners = [cmd for (cmd,), _ in run.call_args_list
+                    if cmd[0] == 'bowtie2' or cmd[:2] == ['shogun', 'align']]
+        self.assertEqual(len(aligners), 1)
+        queries = aligners[0][aligners[0].index('-f') + 1]
+        self.assertEqual(len(queries.split(',')), 3)
+
+    def test_nobunaga_batch_auto(self):
+        taxa = shogun.actions.nobunaga_batch(
+            queries=self._split_query(), reference_reads=self.refseqs,
+            reference_taxonomy=self.taxonomy, database=self.database,
+            threads='auto', workers='auto')
+        self.assertTaxaTableEqual(taxa.taxa_table, self.taxatable)
+
+    def test_nobunaga_batch_repeated_samples(self):
+        first, second = self._split_query(['sample1'],
+                                          ['sample1', 'sample2'])
+        # detected before anything is aligned
+        with mock.patch('q2_shogun._shogun._run_command',
+                        side_effect=AssertionError('aligned')), \
+                self.assertRaisesRegex(ValueError, 'more than one.*sample1'):
+            shogun.actions.nobunaga_batch(
+                queries=[first, second],
+                reference_reads=self.refseqs,
+                reference_taxonomy=self.taxonomy, database=self.database)
+
+    def test_nobunaga_append(self):
+        first, second = self._split_query(['sample1'],
+                                          ['sample2', 'sample3'])
+        # without a cache, the reference is never read just to sign tables
+        with mock.patch('q2_shogun._cache.file_digest',
+                        side_effect=AssertionError('hashed')):
+            taxa, = shogun.actions.nobunaga(
+                query=first, reference_reads=self.refseqs,
+                reference_taxonomy=self.taxonomy, database=self.database)
+            taxa, = shogun.actions.nobunaga_append(
+                table=taxa, query=second, reference_reads=self.refseqs,
+                reference_taxonomy=self.taxonomy, database=self.database)
+        self.assertTaxaTableEqual(taxa, self.taxatable)
+
+    def test_nobunaga_append_checks_parameters(self):
+        first, second = self._split_query(['sample1'],
+                                          ['sample2', 'sample3'])
+        taxa, = shogun.actions.nobunaga(
+            query=first, reference_reads=self.refseqs,
+            reference_taxonomy=self.taxonomy, database=self.database)
+        with self.assertRaisesRegex(ValueError, 'same reference'):
+            shogun.actions.nobunaga_append(
+                table=taxa, query=second, reference_reads=self.refseqs,
+                reference_taxonomy=self.taxonomy, database=self.database,
+                percent_id=0.9)
+        with self.assertRaisesRegex(ValueError, 'same reference'):
+            shogun.actions.nobunaga_append(
+                table=taxa, query=second, reference_reads=self.refseqs,
+                reference_taxonomy=self.taxonomy, database=self.database,
+                assigner='native', taxacut=1.0)
+        with self.assertRaisesRegex(ValueError, 'already present'):
+            shogun.actions.nobunaga_append(
+                table=taxa, query=first, reference_reads=self.refseqs,
+                reference_taxonomy=self.taxonomy, database=self.database)
+
+    def test_nobunaga_sweep(self):
+        tables, = shogun.actions.nobunaga_sweep(
+            query=self.query, reference_reads=self.refseqs,
+            reference_taxonomy=self.taxonomy, database=self.database,
+            taxacuts=[1.0, 0.8], percent_ids=[0.98, 0.95], threads=2)
+        self.assertEqual(set(tables.keys()), {
+            'taxacut-1_percent-id-0.98', 'taxacut-1_percent-id-0.95',
+            'taxacut-0.8_percent-id-0.98', 'taxacut-0.8_percent-id-0.95'})
+        self.assertTaxaTableEqual(tables['taxacut-1_percent-id-0.98'],
+                                  self.taxatable)
+        single, = shogun.actions.nobunaga(
+            query=self.query, reference_reads=self.refseqs,
+            reference_taxonomy=self.taxonomy, database=self.database,
+            taxacut=0.8, percent_id=0.95, assigner='native')
+        self.assertTaxaTableEqual(tables['taxacut-0.8_percent-id-0.95'],
+                                  single)
+
+    def test_nobunaga_sweep_checks_grid(self):
+        kwargs = dict(query=self.query, reference_reads=self.refseqs,
+                      reference_taxonomy=self.taxonomy,
+                      database=self.database)
+        with self.assertRaisesRegex(ValueError, 'at least one.*taxacuts'):
+            shogun.actions.nobunaga_sweep(taxacuts=[], percent_ids=[0.98],
+                                          **kwargs)
+        with self.assertRaisesRegex(ValueError, 'at least one.*percent_ids'):
+            shogun.actions.nobunaga_sweep(taxacuts=[0.8], percent_ids=[],
+                                          **kwargs)
+        # the registered range agrees with the check in the action
+        with self.assertRaises(TypeError):
+            shogun.actions.nobunaga_sweep(taxacuts=[0.8],
+                                          percent_ids=[0.98, 0.0], **kwargs)
+        with self.assertRaisesRegex(ValueError, 'percent_ids.*not 0'):
+            _check_sweep_values('percent_ids', [0.98, 0.0])
+        with self.assertRaisesRegex(ValueError, 'too close'):
+            shogun.actions.nobunaga_sweep(taxacuts=[0.9999991, 0.9999992],
+                                          percent_ids=[0.98], **kwargs)
+
+    def test_result_cache(self):
+        cache = os.path.join(self.temp_dir.name, 'results')
+        kwargs = dict(query=self.query, reference_reads=self.refseqs,
+                      reference_taxonomy=self.taxonomy,
+                      database=self.database)
+        with mock.patch.dict(os.environ, {'Q2_SHOGUN_RESULT_CACHE': cache}):
+            first, = shogun.actions.nobunaga(**kwargs)
+            with mock.patch('q2_shogun._shogun._nobunaga',
+                            side_effect=AssertionError('not cached')):
+                second, = shogun.actions.nobunaga(**kwargs)
+                with self.assertRaisesRegex(AssertionError, 'not cached'):
+                    shogun.actions.nobunaga(taxacut=0.5, **kwargs)
+        self.assertTaxaTableEqual(second, first)
+        self.assertEqual(second.view(biom.Table).table_id,
+                         first.view(biom.Table).table_id)
+
+    def test_result_cache_keyed_on_reference_content(self):
+        cache = os.path.join(self.temp_dir.name, 'results')
+        seqs = self.refseqs.view(pd.Series)
+        # same size, one base changed in the middle of one sequence
+        seq = str(seqs.iloc[0])
+        middle = len(seq) // 2
+        edited = seqs.copy()
+        edited.iloc[0] = type(seqs.iloc[0])(
+            seq[:middle] + ('A' if seq[middle] != 'A' else 'C') +
+            seq[middle + 1:])
+        refseqs = qiime2.Artifact.import_data('FeatureData[Sequence]',
+                                              edited)
+        kwargs = dict(query=self.query, reference_taxonomy=self.taxonomy,
+                      database=self.database)
+        with mock.patch.dict(os.environ, {'Q2_SHOGUN_RESULT_CACHE': cache}):
+            shogun.actions.nobunaga(reference_reads=self.refseqs, **kwargs)
+            with mock.patch('q2_shogun._shogun._nobunaga',
+                            side_effect=AssertionError('not cached')):
+                with self.assertRaisesRegex(AssertionError, 'not cached'):
+                    shogun.actions.nobunaga(reference_reads=refseqs,
+                                            **kwargs)
+
+    def test_align_then_assign(self):
+        alignment, = shogun.actions.align(
+            query=self.query, database=self.database, threads=2)
+        alignment.validate()
+        for assigner in ('shogun', 'native'):
+            taxa, = shogun.actions.assign(
+                alignment=alignment, reference_taxonomy=self.taxonomy,
+                taxacut=1.0, assigner=assigner)
+            self.assertTaxaTableEqual(taxa, self.taxatable)
+
+    def test_invalid_alignment(self):
+        fp = os.path.join(self.temp_dir.name, 'alignment.sam.gz')
+        with gzip.open(fp, 'wt') as fh:
+            fh.write('not\ta\tSAM\trecord\n')
+        with self.assertRaisesRegex(ValidationError, 'SAM record'):
+            SAMGzFormat(fp, mode='r').validate()
+        with open(fp, 'w') as fh:
+            fh.write('plain text\n')
+        with self.assertRaisesRegex(ValidationError, 'gzip'):
+            SAMGzFormat(fp, mode='r').validate()
+
+    def test_shogun_database(self):
+        bundle, = shogun.actions.bundle_database(
+            reference_reads=self.refseqs, reference_taxonomy=self.taxonomy,
+            database=self.database)
+        bundle.validate()
+        taxa, = shogun.actions.nobunaga(query=self.query,
+                                        shogun_database=bundle)
+        self.assertTaxaTableEqual(taxa, self.taxatable)
+
+        alignment, = shogun.actions.align(query=self.query,
+                                          shogun_database=bundle)
+        for assigner in ('shogun', 'native'):
+            taxa, = shogun.actions.assign(
+                alignment=alignment, shogun_database=bundle, taxacut=1.0,
+                assigner=assigner)
+            self.assertTaxaTableEqual(taxa, self.taxatable)
+
+        with self.assertRaisesRegex(ValueError, 'but not both'):
+            shogun.actions.nobunaga(query=self.query, shogun_database=bundle,
+                                    database=self.database)
+        with self.assertRaisesRegex(ValueError, 'but not both'):
+            shogun.actions.nobunaga(query=self.query, database=self.database)
+
+    def test_index_scratch_stages_real_files(self):
+        index = os.path.join(self.temp_dir.name, 'index')
+        os.mkdir(index)
+        with mock.patch.dict(os.environ, {INDEX_SCRATCH_ENV: index}):
+            with database_dir(self.database.view(Bowtie2IndexDirFmt),
+                              self.refseqs.view(DNAFASTAFormat),
+                              self.taxonomy.view(pd.Series)) as dbdir:
+                self.assertEqual(os.path.dirname(dbdir), index)
+                staged = [os.path.join(root, name)
+                          for root, _, files in os.walk(dbdir)
+                          for name in files]
+                self.assertIn(os.path.join(dbdir, 'refseqs.fna'), staged)
+                for fp in staged:
+                    self.assertFalse(os.path.islink(fp), fp)
+                    self.assertEqual(os.stat(fp).st_dev,
+                                     os.stat(index).st_dev)
+
+    def test_native_database_skips_taxonomy(self):
+        with database_dir(self.database.view(Bowtie2IndexDirFmt),
+                          self.refseqs.view(DNAFASTAFormat),
+                          self.taxonomy.view(pd.Series),
+                          taxonomy=False) as dbdir:
+            self.assertEqual(
+                os.path.getsize(os.path.join(dbdir, 'taxa.tsv')), 0)
+
+    def test_build_database(self):
+        bundle, = shogun.actions.build_database(
+            reference_reads=self.refseqs, reference_taxonomy=self.taxonomy,
+            threads=2)
+        bundle.validate()
+        taxa, = shogun.actions.nobunaga(query=self.query,
+                                        shogun_database=bundle)
+        self.assertTaxaTableEqual(taxa, self.taxatable)
+
+        bundle, = shogun.actions.build_database(
+            reference_reads=self.refseqs, reference_taxonomy=self.taxonomy,
+            partitions=2)
+        bundle.validate()
+        for assigner in ('shogun', 'native'):
+            taxa, = shogun.actions.nobunaga(
+                query=self.query, shogun_database=bundle, threads=2,
+                assigner=assigner, taxacut=1.0)
+            self.assertTaxaTableEqual(taxa, self.taxatable)
+        with self.assertRaisesRegex(ValueError, 'partitioned'):
+            shogun.actions.nobunaga(query=self.query, shogun_database=bundle,
+                                    streaming=True)
+        # shogun align only knows databases with a single index
+        with mock.patch('q2_shogun._shogun._run_command',
+                        side_effect=AssertionError('ran')), \
+                self.assertRaisesRegex(ValueError, 'partitioned'):
+            shogun.actions.minipipe(query=self.query, shogun_database=bundle)
+
+    def test_invalid_shogun_database(self):
+        dbdir = os.path.join(self.temp_dir.name, 'database')
+        os.mkdir(dbdir)
+        with open(os.path.join(dbdir, 'metadata.yaml'), 'w') as fh:
+            fh.write('general:\n  taxonomy: taxa.tsv\n  fasta: refseqs.fna\n'
+                     'bowtie2: bowtie2/refseqs\n')
+        for fp in ('taxa.tsv', 'refseqs.fna'):
+            open(os.path.join(dbdir, fp), 'w').close()
+        with self.assertRaisesRegex(ValidationError, 'bowtie2 index'):
+            ShogunDatabaseDirFmt(dbdir, mode='r').validate()
+
+    def test_run_functional_no_levels(self):
+        outdir = os.path.join(self.temp_dir.name, 'functional')
+        self.assertEqual(run_functional('taxatable.tsv', 'db', outdir, set()),
+                         [None] * len(FUNCTIONAL_LEVELS))
+        self.assertFalse(os.path.exists(outdir))
+
+    def _fake_shogun(self, cmd):
+        '''Write the outputs ``shogun pipeline`` would name for ``cmd``'''
+        def _write(fp, feature):
+            with open(fp, 'w') as fh:
+                fh.write('#OTU ID\ts1\ts2\n%s\t1\t2\n' % feature)
+
+        args = dict(zip(cmd[2::2], cmd[3::2]))
+        if cmd[1] == 'functional':
+            os.makedirs(args['-o'], exist_ok=True)
+            prefix = os.path.splitext(os.path.basename(args['-i']))[0]
+            for suffix, feature in [('kegg', 'K1'), ('kegg.modules', 'M1'),
+                                    ('kegg.pathways', 'P1')]:
+                _write(os.path.join(args['-o'], '%s.strain.%s.txt' % (
+                    prefix, suffix)), feature)
+        else:
+            _write(args['-o'], cmd[1])
+
+    def test_functional_tables_as_pipeline(self):
+        # the steps of shogun pipeline behind the minipipe outputs
+        tmpdir = self.temp_dir.name
+        run = mock.Mock(side_effect=self._fake_shogun)
+        with mock.patch('q2_shogun._shogun._run_command', run):
+            tables = shogun_functional_tables('alignment.sam', 'db', tmpdir,
+                                              set(FUNCTIONAL_LEVELS))
+        taxatable = os.path.join(tmpdir, 'taxatable.tsv')
+        self.assertEqual([cmd for (cmd,), _ in run.call_args_list], [
+            ['shogun', 'assign_taxonomy', '-i', 'alignment.sam', '-d', 'db',
+             '-o', taxatable, '-a', 'bowtie2'],
+            ['shogun', 'redistribute', '-i', taxatable, '-d', 'db',
+             '-l', 'strain', '-o',
+             os.path.join(tmpdir, 'taxatable.strain.txt')],
+            ['shogun', 'functional', '-i', taxatable, '-d', 'db',
+             '-o', os.path.join(tmpdir, 'functional'), '-l', 'strain']])
+        for table, feature in zip(tables, ['redistribute', 'K1', 'M1',
+                                           'P1']):
+            self.assertEqual(table, biom.Table(np.array([[1., 2.]]),
+                                               [feature], ['s1', 's2']))
+
+    def test_functional_tables_skip_levels(self):
+        tmpdir = self.temp_dir.name
+        run = mock.Mock(side_effect=self._fake_shogun)
+        with mock.patch('q2_shogun._shogun._run_command', run):
+            strain, kegg, module, pathway = shogun_functional_tables(
+                'alignment.sam', 'db', tmpdir, {'kegg'})
+        self.assertEqual(kegg.ids(axis='observation').tolist(), ['K1'])
+        self.assertTrue(module.is_empty() and pathway.is_empty())
+        with mock.patch('q2_shogun._shogun._run_command', run):
+            tables = shogun_functional_tables('alignment.sam', 'db', tmpdir,
+                                              set())
+        self.assertEqual(run.call_args_list[-1][0][0][1], 'redistribute')
+        self.assertTrue(all(t.is_empty() for t in tables[1:]))
+
+
+class TestTaxonomyIndex(TestPluginBase):
+    package = 'q2_shogun.tests'
+
+    def test_round_trip(self):
+        taxonomy = qiime2.Artifact.load(
+            self.get_data_path('taxonomy.qza')).view(pd.Series)
+        index = LineageIndex.from_taxonomy(taxonomy)
+        _, ff = self.transform_format(LineageIndex, TaxonomyIndexDirFmt,
+                                      index)
+        ff.validate()
+        observed = self.get_transformer(TaxonomyIndexDirFmt,
+                                        LineageIndex)(ff)
+        self.assertEqual(list(observed.labels), list(index.labels))
+        np.testing.assert_array_equal(observed.lineages, index.lineages)
+        np.testing.assert_array_equal(observed.rows(taxonomy.index),
+                                      np.arange(len(taxonomy)))
+        self.assertEqual(observed.source, index.source)
+
+    def test_invalid_array(self):
+        fp = self.temp_dir.name + '/not-an-array.npy'
+        with open(fp, 'w') as fh:
+            fh.write('hello')
+        with self.assertRaisesRegex(ValidationError, 'npy'):
+            NumpyArrayFormat(fp, mode='r').validate()
+
+
+class TestFunctionalAnnotation(TestPluginBase):
+    package = 'q2_shogun.tests'
+
+    def test_profile_functions(self):
+        annotation = StrainFunctions(
+            ['k__A;t__1', 'k__A;t__2'], ['K1', 'K2'],
+            np.array([[1, 2], [0, 1]]), ['M1'], np.array([[1], [1]]),
+            ['P1'], np.array([[0], [1]]))
+        _, ff = self.transform_format(StrainFunctions,
+                                      FunctionalAnnotationDirFmt, annotation)
+        ff.validate()
+        artifact = qiime2.Artifact.import_data('FunctionalAnnotation', ff)
+        table = qiime2.Artifact.import_data(
+            'FeatureTable[Frequency]',
+            biom.Table(np.array([[2., 0.], [1., 3.]]),
+                       ['k__A;t__1', 'k__A;t__2'], ['s1', 's2']))
+        kos, modules, pathways = shogun.actions.profile_functions(
+            table=table, functional_annotation=artifact)
+        self.assertEqual(kos.view(biom.Table),
+                         biom.Table(np.array([[2., 0.], [5., 3.]]),
+                                    ['K1', 'K2'], ['s1', 's2']))
+        self.assertEqual(list(modules.view(biom.Table).ids('observation')),
+                         ['M1'])
+        self.assertEqual(list(pathways.view(pd.DataFrame).loc['s2']), [3.])
+
 
 if __name__ == '__main__':
     unittest.main()
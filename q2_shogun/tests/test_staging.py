@@ -0,0 +1,94 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import errno
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from q2_shogun import _staging
+from q2_shogun._staging import Stager
+
+
+def _unsupported(src, dst):
+    raise OSError(errno.EXDEV, 'Invalid cross-device link')
+
+
+class TestStager(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.src = os.path.join(self._tmp.name, 'src')
+        os.makedirs(os.path.join(self.src, 'sub'))
+        for name in ('a.bt2', os.path.join('sub', 'b.bt2')):
+            with open(os.path.join(self.src, name), 'w') as fh:
+                fh.write(name)
+        self.dst = os.path.join(self._tmp.name, 'dst')
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _assert_staged(self):
+        for name in ('a.bt2', os.path.join('sub', 'b.bt2')):
+            with open(os.path.join(self.dst, name)) as fh:
+                self.assertEqual(fh.read(), name)
+
+    def test_stage_tree(self):
+        stager = Stager()
+        stager.stage_tree(self.src, self.dst)
+        self._assert_staged()
+        self.assertEqual(sum(stager.used.values()), 2)
+
+    def test_falls_back_to_symlink(self):
+        funcs = dict(_staging._FUNCTIONS, reflink=_unsupported,
+                     hardlink=_unsupported)
+        with mock.patch.dict(_staging._FUNCTIONS, funcs):
+            stager = Stager()
+            stager.stage_tree(self.src, self.dst)
+        self._assert_staged()
+        self.assertTrue(os.path.islink(os.path.join(self.dst, 'a.bt2')))
+        self.assertEqual(stager.summary(), '2 by symlink')
+        self.assertEqual(list(stager.unsupported.values()),
+                         [{'reflink', 'hardlink'}])
+
+    def test_unsupported_per_device(self):
+        # a.bt2 is on another device, where hardlinks cannot reach
+        def _devices(src, dst):
+            return (int(src.endswith('a.bt2')), 0)
+
+        def _hardlink(src, dst):
+            if src.endswith('a.bt2'):
+                _unsupported(src, dst)
+            os.link(src, dst)
+
+        funcs = dict(_staging._FUNCTIONS, reflink=_unsupported,
+                     hardlink=_hardlink)
+        with mock.patch.dict(_staging._FUNCTIONS, funcs), \
+                mock.patch.object(_staging, '_devices', _devices):
+            stager = Stager(allow_symlink=False)
+            stager.stage_tree(self.src, self.dst)
+        self._assert_staged()
+        self.assertEqual(stager.summary(), '1 by hardlink, 1 by copy')
+
+    def test_symlink_disallowed(self):
+        funcs = dict(_staging._FUNCTIONS, reflink=_unsupported,
+                     hardlink=_unsupported)
+        with mock.patch.dict(_staging._FUNCTIONS, funcs):
+            stager = Stager(allow_symlink=False)
+            stager.stage_tree(self.src, self.dst)
+        self._assert_staged()
+        self.assertFalse(os.path.islink(os.path.join(self.dst, 'a.bt2')))
+        self.assertEqual(stager.summary(), '2 by copy')
+
+    def test_real_errors_propagate(self):
+        with self.assertRaises(FileNotFoundError):
+            Stager().stage(os.path.join(self.src, 'missing'), self.dst)
+
+
+if __name__ == '__main__':
+    unittest.main()
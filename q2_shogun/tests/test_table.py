@@ -0,0 +1,86 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018-2023, QIIME 2 development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE, distributed with this software.
+# ----------------------------------------------------------------------------
+
+import os
+import tempfile
+import unittest
+
+import biom
+import numpy as np
+
+from q2_shogun._table import merge_tables, read_taxatable
+
+
+TAXATABLE = (
+    '#OTU ID\tsample1\tsample2\tsample3\n'
+    'k__Bacteria;p__Firmicutes\t3\t0\t1\n'
+    'k__Bacteria;p__Proteobacteria\t0\t0\t0\n'
+    'k__Bacteria;p__Chlamydiae\t0\t7.5\t2\n'
+    'k__Bacteria;p__Actinobacteria\t1\t0\t0\n')
+
+
+class TestReadTaxatable(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _write(self, content):
+        fp = os.path.join(self._tmp.name, 'taxatable.tsv')
+        with open(fp, 'w') as fh:
+            fh.write(content)
+        return fp
+
+    def assertMatchesFromTSV(self, fp, **kwargs):
+        with open(fp) as fh:
+            expected = biom.Table.from_tsv(fh, None, None, None)
+        observed = read_taxatable(fp, **kwargs)
+        self.assertEqual(observed, expected)
+
+    def test_comment_header(self):
+        self.assertMatchesFromTSV(self._write(TAXATABLE))
+
+    def test_plain_header(self):
+        self.assertMatchesFromTSV(self._write(TAXATABLE.lstrip('#')))
+
+    def test_leading_comments(self):
+        self.assertMatchesFromTSV(
+            self._write('# Constructed by SHOGUN\n' + TAXATABLE))
+
+    def test_chunked(self):
+        fp = self._write(TAXATABLE)
+        for chunk_cells in (1, 3, 6):
+            self.assertMatchesFromTSV(fp, chunk_cells=chunk_cells)
+
+    def test_no_observations(self):
+        table = read_taxatable(self._write('#OTU ID\tsample1\tsample2\n'))
+        self.assertEqual(table.shape, (0, 2))
+        self.assertEqual(list(table.ids()), ['sample1', 'sample2'])
+
+    def test_sparse(self):
+        table = read_taxatable(self._write(TAXATABLE))
+        self.assertEqual(table.matrix_data.nnz, 5)
+
+
+class TestMergeTables(unittest.TestCase):
+    def test_merge(self):
+        a = biom.Table(np.array([[1, 0], [2, 3]]), ['f1', 'f2'], ['s1', 's2'])
+        b = biom.Table(np.array([[4], [5]]), ['f3', 'f1'], ['s3'])
+        expected = biom.Table(np.array([[1, 0, 5], [2, 3, 0], [0, 0, 4]]),
+                              ['f1', 'f2', 'f3'], ['s1', 's2', 's3'])
+        self.assertEqual(merge_tables([a, b]), expected)
+
+    def test_overlapping_samples(self):
+        a = biom.Table(np.array([[1]]), ['f1'], ['s1'])
+        with self.assertRaisesRegex(ValueError, 'more than one.*s1'):
+            merge_tables([a, a])
+
+
+if __name__ == '__main__':
+    unittest.main()